@@ -0,0 +1,211 @@
+"""
+Archival of finished games and cleanup of abandoned ones, run periodically from the JobQueue.
+
+A game ended more than ARCHIVE_AFTER_HOURS ago (and not started again) is written as one JSON line to a gzip file per
+month under DATA_DIR/archive, then all of its rows are purged with a handful of bulk deletes. Games that were created
+but never started within UNSTARTED_TTL_HOURS are purged without an archive record, as they have nothing worth keeping.
+Standings, tournament scores and task statistics are aggregates that outlive the games and are kept. The same job
+expires old callback idempotency keys.
+
+The archive is written before the rows are purged, so a crash in between can at worst duplicate a record, never lose
+one. Freed pages are returned to the filesystem with incremental_vacuum, a few at a time, so no run locks the database
+for long.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from collections.abc import Coroutine, Sequence
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from telegram.ext import ContextTypes, JobQueue
+
+from dashboard import mark_game_dirty
+from db import data_dir, engine
+from dedupe import purge_expired_callbacks
+from locations import delete_tracks, load_track
+from mappings import DeckCount, Game, GameChat, ScoreEvent, TeamCardJoin, Timer
+
+ARCHIVE_AFTER_HOURS = int(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+UNSTARTED_TTL_HOURS = int(os.getenv("UNSTARTED_TTL_HOURS", "72"))
+ARCHIVE_INTERVAL_MINUTES = int(os.getenv("ARCHIVE_INTERVAL_MINUTES", "60"))
+
+BATCH_SIZE = 50
+VACUUM_PAGES = 1_000
+
+archive_dir = data_dir / "archive"
+
+logger = logging.getLogger(__name__)
+
+
+# --- Archiving ---
+def _game_record(session: Session, game: Game) -> dict[str, object]:
+    chats = session.scalars(select(GameChat).where(GameChat.game_id == game.game_id)).all()
+
+    cards: defaultdict[int, defaultdict[str, list[int]]] = defaultdict(lambda: defaultdict(list))
+    for team_chat_id, card_id, state in session.execute(
+        select(TeamCardJoin.team_chat_id, TeamCardJoin.card_id, TeamCardJoin.state)
+        .join(GameChat, GameChat.chat_id == TeamCardJoin.team_chat_id)
+        .where(GameChat.game_id == game.game_id)
+        .order_by(TeamCardJoin.id),
+    ).tuples():
+        cards[team_chat_id][state.value].append(card_id)
+
+    score_events = session.scalars(
+        select(ScoreEvent).where(ScoreEvent.game_id == game.game_id).order_by(ScoreEvent.event_id),
+    ).all()
+
+    return {
+        "game_id": game.game_id,
+        "deck": game.deck,
+        "created_at": game.created_at,
+        "started_at": game.started_at,
+        "ended_at": game.ended_at,
+        "tournament_id": game.tournament_id,
+        "round": game.round,
+        "chats": [
+            {
+                "chat_id": chat.chat_id,
+                "role": chat.role.value,
+                "team_index": chat.team_index,
+                "score": chat.score,
+                "cards": cards.get(chat.chat_id, {}),
+                # [unix seconds, latitude, longitude] with coordinates in 1e-5 degrees, as stored
+                "track": [
+                    [point.t, point.lat_q, point.lon_q]
+                    for point in load_track(session, game.game_id, chat.chat_id)
+                ],
+            }
+            for chat in chats
+        ],
+        "score_events": [
+            {
+                "team_chat_id": event.team_chat_id,
+                "reason": event.reason.value,
+                "points": event.points,
+                "created_at": event.created_at,
+                "card_id": event.card_id,
+            }
+            for event in score_events
+        ],
+    }
+
+
+def _write_archive(records: list[dict[str, object]], now: float) -> None:
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    path = archive_dir / f"games-{time.strftime('%Y-%m', time.gmtime(now))}.jsonl.gz"
+    # appending adds a gzip member per run, which readers decompress as one continuous stream
+    with gzip.open(path, "at", encoding="utf-8") as file:
+        for record in records:
+            _ = file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def purge_games(session: Session, game_ids: Sequence[int]) -> None:
+    """
+    Deletes the games and every row that belongs to them, without archiving. The caller commits.
+    """
+    # plain connection executes, the purged rows are not in the session so there is nothing to synchronize
+    connection = session.connection()
+    chat_ids = select(GameChat.chat_id).where(GameChat.game_id.in_(game_ids)).scalar_subquery()
+
+    _ = connection.execute(delete(TeamCardJoin).where(TeamCardJoin.team_chat_id.in_(chat_ids)))
+    _ = connection.execute(delete(DeckCount).where(DeckCount.team_chat_id.in_(chat_ids)))
+    _ = connection.execute(delete(ScoreEvent).where(ScoreEvent.game_id.in_(game_ids)))
+    _ = connection.execute(delete(Timer).where(Timer.game_id.in_(game_ids)))
+    for game_id in game_ids:
+        delete_tracks(session, game_id)
+        mark_game_dirty(session, game_id)
+    _ = connection.execute(update(Game).where(Game.game_id.in_(game_ids)).values(running_team_chat_id=None))
+    _ = connection.execute(delete(GameChat).where(GameChat.game_id.in_(game_ids)))
+    _ = connection.execute(delete(Game).where(Game.game_id.in_(game_ids)))
+
+
+def archive_finished_games(session: Session, games: Sequence[Game], now: float) -> None:
+    """
+    Writes the games' archive records and purges their rows. The caller commits.
+    """
+    _write_archive([_game_record(session, game) for game in games], now)
+    purge_games(session, [game.game_id for game in games])
+
+
+def _incremental_vacuum() -> None:
+    with engine.connect() as connection:
+        # sqlite3 runs one vacuum step per fetched row, so the empty rows must be drained for the pages to be freed
+        _ = connection.connection.driver_connection.execute(  # pyright: ignore[reportOptionalMemberAccess]
+            f"PRAGMA incremental_vacuum({VACUUM_PAGES})",
+        ).fetchall()
+        connection.commit()
+
+
+def archive_games(now: float) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+    """
+    Archives and purges one batch of finished games and purges one batch of abandoned ones. Returns the (game id,
+    admin chat id) pairs of the archived and of the abandoned games.
+    """
+    with Session(engine) as session:
+        finished = session.scalars(
+            select(Game)
+            .where(~Game.is_started, Game.ended_at <= now - ARCHIVE_AFTER_HOURS * 3600)
+            .order_by(Game.ended_at)
+            .limit(BATCH_SIZE),
+        ).all()
+        abandoned = session.scalars(
+            select(Game)
+            .where(~Game.is_started, Game.started_at.is_(None), Game.created_at <= now - UNSTARTED_TTL_HOURS * 3600)
+            .order_by(Game.created_at)
+            .limit(BATCH_SIZE),
+        ).all()
+        if len(finished) == 0 and len(abandoned) == 0:
+            return [], []
+
+        archived_chats = [(game.game_id, game.admin_chat.chat_id) for game in finished]
+        abandoned_chats = [(game.game_id, game.admin_chat.chat_id) for game in abandoned]
+
+        if len(finished) > 0:
+            archive_finished_games(session, finished, now)
+        if len(abandoned) > 0:
+            purge_games(session, [game.game_id for game in abandoned])
+        session.commit()
+
+    _incremental_vacuum()
+    return archived_chats, abandoned_chats
+
+
+async def _archive_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    now = time.time()
+    with Session(engine) as session:
+        purge_expired_callbacks(session, now)
+        session.commit()
+
+    archived, abandoned = archive_games(now)
+    if len(archived) == 0 and len(abandoned) == 0:
+        return
+    logger.info("Archived %d finished games, purged %d abandoned games", len(archived), len(abandoned))
+
+    bot = context.bot
+    sends: list[Coroutine[object, object, object]] = [
+        bot.send_message(
+            admin_chat_id,
+            f"Game {game_id} has been archived and all its chats unassigned, use /create_game to set up a new game",
+        )
+        for game_id, admin_chat_id in archived
+    ]
+    sends += [
+        bot.send_message(
+            admin_chat_id,
+            f"Game {game_id} was not started within {UNSTARTED_TTL_HOURS} hours and has been deleted, "
+            "all its chats are unassigned",
+        )
+        for game_id, admin_chat_id in abandoned
+    ]
+    for result in await asyncio.gather(*sends, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.warning("Failed to send archive message: %s", result)
+
+
+def start_archiver(job_queue: JobQueue[ContextTypes.DEFAULT_TYPE]) -> None:
+    _ = job_queue.run_repeating(_archive_job, interval=ARCHIVE_INTERVAL_MINUTES * 60, first=60, name="archive")
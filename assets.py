@@ -0,0 +1,138 @@
+"""
+Offline card asset pipeline.
+
+Re-encodes every card PNG into a Telegram-optimized variant (JPEG or WebP, longest edge capped at a target
+resolution), names each variant by the content hash of its source and records both in <root>/variants.json.
+catalog.py merges that manifest into the compiled card index so the bot sends the variant instead of the full-size
+PNG (recompile the catalog after running this). A variant is only recorded when it is actually smaller than its
+source, and sources that are unchanged and were encoded with the same format, size and quality are skipped on re-runs.
+
+Requires Pillow, which is only needed to run this pipeline, not the bot.
+
+Usage: python assets.py [--root cards] [--format jpeg|webp] [--max-size 1280] [--quality 85]
+"""
+import argparse
+import hashlib
+import io
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+CARD_DIRS = ("rules", "tasks", "powerups")
+VARIANTS_DIR_NAME = "optimized"
+MANIFEST_NAME = "variants.json"
+
+
+@dataclass(frozen=True)
+class CardVariant:
+    sha256: str
+    variant: str | None  # relative to the cards root, None if the source is already the smallest legible file
+    source_bytes: int
+    variant_bytes: int | None
+    encoding: str | None = None  # format, size and quality the entry was built with, see _encoding
+
+
+def load_variant_manifest(root_path: Path) -> dict[str, CardVariant]:
+    """
+    Returns the recorded variants keyed by source path relative to root_path, or an empty dict if the pipeline has not
+    been run.
+    """
+    manifest_path = root_path / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return {}
+
+    with manifest_path.open(encoding="utf-8") as f:
+        raw: dict[str, dict[str, str | int | None]] = json.load(f)
+    return {source: CardVariant(**entry) for source, entry in raw.items()}  # pyright: ignore[reportArgumentType]
+
+
+def _encoding(image_format: str, max_size: int, quality: int) -> str:
+    return f"{image_format}/{max_size}/{quality}"
+
+
+def _encode_variant(source_path: Path, image_format: str, max_size: int, quality: int) -> bytes:
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("The asset pipeline requires Pillow, install it with `pip install Pillow`") from None
+
+    with Image.open(source_path) as image:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            # JPEG has no alpha channel and Telegram renders transparent photo areas black, so flatten onto white
+            rgba = image.convert("RGBA")
+            flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+            flattened.paste(rgba, mask=rgba.getchannel("A"))
+            image = flattened
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format.upper(), quality=quality, optimize=True)
+        return buffer.getvalue()
+
+
+def build_variants(root_path: Path, image_format: str, max_size: int, quality: int) -> dict[str, CardVariant]:
+    variants_dir = root_path / VARIANTS_DIR_NAME
+    variants_dir.mkdir(exist_ok=True)
+    previous = load_variant_manifest(root_path)
+    extension = "jpg" if image_format == "jpeg" else image_format
+    encoding = _encoding(image_format, max_size, quality)
+
+    manifest: dict[str, CardVariant] = {}
+    for card_dir in CARD_DIRS:
+        for source_path in sorted((root_path / card_dir).iterdir()):
+            if not source_path.is_file():
+                continue
+
+            source = source_path.relative_to(root_path).as_posix()
+            source_bytes = source_path.read_bytes()
+            sha256 = hashlib.sha256(source_bytes).hexdigest()
+
+            cached = previous.get(source)
+            if cached is not None and cached.sha256 == sha256 and cached.encoding == encoding and (
+                cached.variant is None or (root_path / cached.variant).is_file()
+            ):
+                manifest[source] = cached
+                continue
+
+            encoded = _encode_variant(source_path, image_format, max_size, quality)
+            if len(encoded) >= len(source_bytes):
+                manifest[source] = CardVariant(sha256, None, len(source_bytes), None, encoding)
+                continue
+
+            variant = f"{VARIANTS_DIR_NAME}/{sha256[:16]}.{extension}"
+            _ = (root_path / variant).write_bytes(encoded)
+            manifest[source] = CardVariant(sha256, variant, len(source_bytes), len(encoded), encoding)
+
+    # drop variants whose source has been changed or removed
+    referenced = {entry.variant for entry in manifest.values() if entry.variant is not None}
+    for variant_path in variants_dir.iterdir():
+        if f"{VARIANTS_DIR_NAME}/{variant_path.name}" not in referenced:
+            variant_path.unlink()
+
+    with (root_path / MANIFEST_NAME).open("w", encoding="utf-8") as f:
+        json.dump({source: asdict(entry) for source, entry in manifest.items()}, f, indent=2, ensure_ascii=False)
+        _ = f.write("\n")
+
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--root", type=Path, default=Path("cards"), help="cards directory")
+    _ = parser.add_argument("--format", choices=("jpeg", "webp"), default="jpeg", help="variant image format")
+    _ = parser.add_argument("--max-size", type=int, default=1280, help="longest edge of the variant in pixels")
+    _ = parser.add_argument("--quality", type=int, default=85, help="encoder quality (1-100)")
+    args = parser.parse_args()
+
+    manifest = build_variants(args.root, args.format, args.max_size, args.quality)
+
+    source_total = sum(entry.source_bytes for entry in manifest.values())
+    sent_total = sum(entry.variant_bytes or entry.source_bytes for entry in manifest.values())
+    print(
+        f"{len(manifest)} cards, {sum(entry.variant is not None for entry in manifest.values())} variants: "
+        f"{source_total / 1024:.0f} KiB -> {sent_total / 1024:.0f} KiB sent",
+    )
+
+
+if __name__ == "__main__":
+    main()
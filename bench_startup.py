@@ -0,0 +1,91 @@
+"""
+Startup-time benchmark: reports where cold-start time goes.
+
+Runs a fresh interpreter with -X importtime, times each startup phase (imports, init_db, init_cards, handler setup)
+and prints the slowest imports by cumulative time.
+
+Usage: python bench_startup.py [--top N] [--runs N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+_PHASES_SCRIPT = """
+import time
+start = time.perf_counter()
+def phase(name):
+    global start
+    now = time.perf_counter()
+    print(f"PHASE {name} {now - start:.6f}", flush=True)
+    start = now
+
+import main
+phase("import main")
+from dotenv import load_dotenv
+_ = load_dotenv()
+import db
+phase("import db")
+db.init_db()
+phase("init_db")
+import utils
+phase("import utils")
+utils.init_cards()
+phase("init_cards")
+import handlers
+phase("import handlers")
+"""
+
+
+def _run_once(data_dir: str) -> tuple[dict[str, float], list[tuple[int, int, str]]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PHASES_SCRIPT],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "DATA_DIR": data_dir},
+        check=True,
+    )
+
+    phases: dict[str, float] = {}
+    for line in result.stdout.splitlines():
+        if line.startswith("PHASE "):
+            name, seconds = line.removeprefix("PHASE ").rsplit(" ", 1)
+            phases[name] = float(seconds)
+
+    imports: list[tuple[int, int, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    return phases, imports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--top", type=int, default=20, help="number of slowest imports to show")
+    _ = parser.add_argument("--runs", type=int, default=3, help="number of cold starts to average phases over")
+    args = parser.parse_args()
+
+    totals: dict[str, float] = {}
+    imports: list[tuple[int, int, str]] = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as data_dir:
+            phases, imports = _run_once(data_dir)
+        for name, seconds in phases.items():
+            totals[name] = totals.get(name, 0.0) + seconds
+
+    print(f"Startup phases (mean of {args.runs} runs):")
+    for name, seconds in totals.items():
+        print(f"  {name:<16} {1000 * seconds / args.runs:8.1f} ms")
+    print(f"  {'total':<16} {1000 * sum(totals.values()) / args.runs:8.1f} ms")
+
+    print("\nSlowest imports by cumulative time (last run):")
+    for cumulative_us, self_us, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+
+
+if __name__ == "__main__":
+    main()
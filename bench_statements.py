@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for the pre-built statements in statements.py.
+
+Times the hot per-update queries two ways against a scratch database holding one game: building the Core construct
+in the function body on every call (as utils.py used to), and executing the pre-built statement with bind params.
+Construction alone is timed too, since that plus cache key generation is the overhead pre-building removes.
+
+Usage: python bench_statements.py [--iterations N]
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections.abc import Callable
+
+
+def _timed(iterations: int, f: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        _ = f()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--iterations", type=int, default=5000, help="executions per query variant")
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp()
+
+    import logging
+    from sqlalchemy import select
+    from sqlalchemy.orm import Session, joinedload
+
+    import db
+    import statements
+    import utils
+    from mappings import CardState, ChatRole, Game, GameChat, TaskCard, TeamCardJoin
+
+    db.engine.echo = False
+    logging.disable(logging.CRITICAL)
+    db.init_db()
+    utils.init_cards()
+
+    chat_id = -1
+    with Session(db.engine) as session:
+        session.add(Game(game_id=100000))
+        session.add(GameChat(chat_id=chat_id, game_id=100000, role=ChatRole.TEAM, team_index=1))
+        for card_id in session.scalars(select(TaskCard.card_id)).all():
+            session.add(TeamCardJoin(team_chat_id=chat_id, card_id=card_id, state=CardState.UNDRAWN))
+        session.commit()
+
+    def build_card_ids_by_state():
+        return (
+            select(TeamCardJoin.card_id)
+            .where(TeamCardJoin.team_chat_id == chat_id, TeamCardJoin.state == CardState.UNDRAWN)
+            .order_by(TeamCardJoin.id)
+        )
+
+    def build_game_chat():
+        return select(GameChat).where(GameChat.chat_id == chat_id).options(joinedload(GameChat.game))
+
+    rows: list[tuple[str, float, float, float]] = []
+    with Session(db.engine) as session:
+        for name, build, prebuilt, params in [
+            ("card ids by state", build_card_ids_by_state, statements.CARD_IDS_BY_STATE,
+             {"chat_id": chat_id, "state": CardState.UNDRAWN}),
+            ("game chat by id", build_game_chat, statements.GAME_CHAT_BY_ID, {"chat_id": chat_id}),
+        ]:
+            construct_us = _timed(args.iterations, lambda: build()._generate_cache_key())  # pyright: ignore[reportPrivateUsage]
+            inline_us = _timed(args.iterations, lambda: session.scalars(build()).unique().all())
+            prebuilt_us = _timed(args.iterations, lambda: session.scalars(prebuilt, params).unique().all())
+            session.expunge_all()
+            rows.append((name, construct_us, inline_us, prebuilt_us))
+
+    print(f"{'query':<20}{'build + cache key':>20}{'inline':>12}{'pre-built':>12}{'saved':>10}")
+    for name, construct_us, inline_us, prebuilt_us in rows:
+        print(
+            f"{name:<20}{construct_us:>17.1f} us{inline_us:>9.1f} us{prebuilt_us:>9.1f} us"
+            f"{100 * (inline_us - prebuilt_us) / inline_us:>9.1f}%",
+        )
+    print(f"compiled cache: {len(db.engine._compiled_cache or {})} entries")  # pyright: ignore[reportPrivateUsage]
+
+
+if __name__ == "__main__":
+    main()
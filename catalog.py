@@ -0,0 +1,335 @@
+"""
+Card catalog: the authored manifest (<root>/catalog.toml) and its compiled index (<root>/catalog.json).
+
+The manifest lists every deck's rules, tasks and powerups with their metadata, including what each card scores.
+Compiling validates it, fills in the default points, assigns card ids (kept stable across recompiles), merges in the
+image variants recorded by assets.py and writes one flat list of rows, which the bot loads with a single read and a
+single bulk insert.
+
+At startup the same rows are also frozen into a CardIndex: immutable records with O(1) lookup by id and precomputed
+id sets per deck, card type, task type and special, so handlers resolve card metadata without touching the database.
+
+Usage: python catalog.py [--root cards]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import tomllib
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any
+
+from assets import load_variant_manifest
+from mappings import CardType, PowerupSpecial, TaskSpecial, TaskType
+
+MANIFEST_NAME = "catalog.toml"
+INDEX_NAME = "catalog.json"
+INDEX_VERSION = 2
+DEFAULT_DECK = "default"
+
+# (points, points while all or nothing is active) of tasks that do not set their own
+DEFAULT_TASK_POINTS = {
+    TaskType.NORMAL: (2, 2),
+    TaskType.EXTREME: (3, 4),
+}
+# bonus for completing both tasks of a Buy 1 Get 1 Free, unless the powerup sets its own
+DEFAULT_B1G1F_BONUS_POINTS = 2
+
+logger = logging.getLogger(__name__)
+
+type CardRow = dict[str, Any]  # pyright: ignore[reportExplicitAny]
+
+
+class CatalogError(Exception):
+    pass
+
+
+def _manifest_hash(manifest_bytes: bytes, root_path: Path) -> str:
+    # variants feed into the index too, so a re-run of assets.py also makes the index stale
+    variants_path = root_path / "variants.json"
+    variants_bytes = variants_path.read_bytes() if variants_path.is_file() else b""
+    return hashlib.sha256(manifest_bytes + b"\0" + variants_bytes).hexdigest()
+
+
+def _enum_value[E: (TaskType, TaskSpecial, PowerupSpecial)](enum_class: type[E], raw: object, where: str,
+                                                             errors: list[str]) -> E | None:
+    try:
+        return enum_class(raw)
+    except ValueError:
+        errors.append(f"{where}: {raw!r} is not one of {', '.join(member.value for member in enum_class)}")
+        return None
+
+
+def _points(entry: dict[str, object], key: str, default: int, where: str, errors: list[str]) -> int:
+    points = entry.get(key, default)
+    if not isinstance(points, int) or isinstance(points, bool) or points < 0:
+        errors.append(f"{where}.{key}: must be a whole number of points, 0 or more")
+        return default
+    return points
+
+
+def _validate_card(root_path: Path, deck: str, card_type: CardType, entry: object, index: int,
+                   errors: list[str]) -> CardRow | None:
+    where = f"decks.{deck}.{card_type.value}s[{index}]"
+    if not isinstance(entry, dict):
+        errors.append(f"{where}: expected a table")
+        return None
+
+    allowed_keys = {"title", "image"} | {
+        CardType.RULE: set[str](),
+        CardType.TASK: {"type", "special", "points", "all_or_nothing_points"},
+        CardType.POWERUP: {"send_to_chasers", "special", "bonus_points"},
+    }[card_type]
+    for key in entry.keys() - allowed_keys:
+        errors.append(f"{where}: unknown key {key!r}")
+
+    title = entry.get("title")
+    image = entry.get("image")
+    if not isinstance(title, str) or title.strip() == "":
+        errors.append(f"{where}: title must be a non-empty string")
+    if not isinstance(image, str) or not (root_path / image).is_file():
+        errors.append(f"{where}: image {image!r} does not exist")
+
+    row: CardRow = {
+        "deck": deck,
+        "card_type": card_type,
+        "title": title,
+        "image": image,
+        "task_type": None,
+        "task_special": None,
+        "powerup_special": None,
+        "powerup_send_to_chasers": None,
+        "task_points": None,
+        "task_all_or_nothing_points": None,
+        "powerup_bonus_points": None,
+    }
+    if card_type == CardType.TASK:
+        row["task_type"] = _enum_value(TaskType, entry.get("type"), f"{where}.type", errors)
+        row["task_special"] = _enum_value(TaskSpecial, entry.get("special", "none"), f"{where}.special", errors)
+        if row["task_type"] is not None:
+            points, all_or_nothing_points = DEFAULT_TASK_POINTS[row["task_type"]]
+            row["task_points"] = _points(entry, "points", points, where, errors)
+            # a task that sets its points scores them under all or nothing too, unless it sets those as well
+            row["task_all_or_nothing_points"] = _points(
+                entry, "all_or_nothing_points", row["task_points"] if "points" in entry else all_or_nothing_points,
+                where, errors,
+            )
+    elif card_type == CardType.POWERUP:
+        send_to_chasers = entry.get("send_to_chasers")
+        if not isinstance(send_to_chasers, bool):
+            errors.append(f"{where}.send_to_chasers: must be true or false")
+        row["powerup_send_to_chasers"] = send_to_chasers
+        row["powerup_special"] = _enum_value(
+            PowerupSpecial, entry.get("special", "none"), f"{where}.special", errors,
+        )
+        if "bonus_points" in entry and row["powerup_special"] != PowerupSpecial.BUY_1_GET_1_FREE:
+            errors.append(f"{where}.bonus_points: only {PowerupSpecial.BUY_1_GET_1_FREE.value} powerups award a bonus")
+        elif row["powerup_special"] == PowerupSpecial.BUY_1_GET_1_FREE:
+            row["powerup_bonus_points"] = _points(entry, "bonus_points", DEFAULT_B1G1F_BONUS_POINTS, where, errors)
+
+    return row
+
+
+def compile_catalog(root_path: Path) -> dict[str, Any]:  # pyright: ignore[reportExplicitAny]
+    """
+    Validates the manifest and returns the compiled index. Raises CatalogError listing every problem found.
+    """
+    manifest_bytes = (root_path / MANIFEST_NAME).read_bytes()
+    try:
+        manifest = tomllib.loads(manifest_bytes.decode("utf-8"))
+    except tomllib.TOMLDecodeError as e:
+        raise CatalogError(f"{MANIFEST_NAME} is not valid TOML: {e}") from None
+
+    errors: list[str] = []
+    decks: object = manifest.get("decks")
+    if not isinstance(decks, dict) or len(decks) == 0:
+        raise CatalogError(f"{MANIFEST_NAME} must define at least one [decks.<name>] table")
+    if DEFAULT_DECK not in decks:
+        errors.append(f"a deck named {DEFAULT_DECK!r} is required")
+
+    rows: list[CardRow] = []
+    for deck, deck_entries in decks.items():
+        if not isinstance(deck_entries, dict):
+            errors.append(f"decks.{deck}: expected a table")
+            continue
+        for key in deck_entries.keys() - {"rules", "tasks", "powerups"}:
+            errors.append(f"decks.{deck}: unknown key {key!r}")
+
+        for card_type in CardType:
+            entries: object = deck_entries.get(f"{card_type.value}s", [])
+            if not isinstance(entries, list):
+                errors.append(f"decks.{deck}.{card_type.value}s: expected an array of tables")
+                continue
+            for i, entry in enumerate(entries):
+                row = _validate_card(root_path, deck, card_type, entry, i, errors)
+                if row is not None:
+                    rows.append(row)
+
+        if not any(row["deck"] == deck and row["card_type"] == CardType.TASK for row in rows):
+            errors.append(f"decks.{deck}: has no tasks")
+
+    seen: set[tuple[str, str]] = set()
+    for row in rows:
+        key = (row["deck"], row["title"])
+        if key in seen:
+            errors.append(f"decks.{row['deck']}: duplicate card title {row['title']!r}")
+        seen.add(key)
+
+    if len(errors) > 0:
+        raise CatalogError(f"{MANIFEST_NAME} is invalid:\n" + "\n".join(f"  - {error}" for error in errors))
+
+    # keep card ids stable across recompiles, so running games keep pointing at the same cards
+    previous_ids: dict[tuple[str, str], int] = {}
+    index_path = root_path / INDEX_NAME
+    if index_path.is_file():
+        with index_path.open(encoding="utf-8") as f:
+            for previous_row in json.load(f)["cards"]:
+                previous_ids[(previous_row["deck"], previous_row["title"])] = previous_row["card_id"]
+    next_id = max(previous_ids.values(), default=0) + 1
+
+    variants = load_variant_manifest(root_path)
+    cards: list[CardRow] = []
+    for row in rows:
+        card_id = previous_ids.get((row["deck"], row["title"]))
+        if card_id is None:
+            card_id = next_id
+            next_id += 1
+
+        image: str = row.pop("image")
+        variant = variants.get(image)
+        cards.append({
+            "card_id": card_id,
+            **row,
+            "image_path": str(root_path / image),
+            "image_hash": variant.sha256 if variant is not None else None,
+            "variant_path": str(root_path / variant.variant) if variant is not None and variant.variant else None,
+        })
+
+    return {
+        "version": INDEX_VERSION,
+        "manifest_sha256": _manifest_hash(manifest_bytes, root_path),
+        "cards": sorted(cards, key=lambda card: card["card_id"]),
+    }
+
+
+def write_index(root_path: Path, index: dict[str, Any]) -> None:  # pyright: ignore[reportExplicitAny]
+    with (root_path / INDEX_NAME).open("w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, ensure_ascii=False)
+        _ = f.write("\n")
+
+
+def load_index(root_path: Path) -> list[CardRow]:
+    """
+    Returns the compiled card rows with enum values restored. Recompiles in memory, with a warning, if the index is
+    missing or older than the manifest.
+    """
+    index: dict[str, Any] | None = None  # pyright: ignore[reportExplicitAny]
+    index_path = root_path / INDEX_NAME
+    if index_path.is_file():
+        with index_path.open(encoding="utf-8") as f:
+            index = json.load(f)
+
+    manifest_hash = _manifest_hash((root_path / MANIFEST_NAME).read_bytes(), root_path)
+    if index is None or index["version"] != INDEX_VERSION or index["manifest_sha256"] != manifest_hash:
+        logger.warning("%s is missing or stale, compiling the card catalog; run `python catalog.py` to fix", index_path)
+        index = compile_catalog(root_path)
+
+    cards: list[CardRow] = index["cards"]
+    for card in cards:
+        card["card_type"] = CardType(card["card_type"])
+        if card["task_type"] is not None:
+            card["task_type"] = TaskType(card["task_type"])
+            card["task_special"] = TaskSpecial(card["task_special"])
+        if card["powerup_special"] is not None:
+            card["powerup_special"] = PowerupSpecial(card["powerup_special"])
+    return cards
+
+
+# --- In-memory card index ---
+@dataclass(frozen=True, slots=True)
+class CardRecord:
+    card_id: int
+    deck: str
+    card_type: CardType
+    title: str
+    image_path: str
+    image_hash: str | None
+    variant_path: str | None
+    task_type: TaskType | None
+    task_special: TaskSpecial | None
+    powerup_special: PowerupSpecial | None
+    powerup_send_to_chasers: bool | None
+    task_points: int | None
+    task_all_or_nothing_points: int | None
+    powerup_bonus_points: int | None
+
+    @property
+    def send_image_path(self) -> str:
+        return self.variant_path or self.image_path
+
+
+def _group_ids[K](records: Iterable[CardRecord],
+                  key: Callable[[CardRecord], K | None]) -> MappingProxyType[K, frozenset[int]]:
+    groups: dict[K, set[int]] = {}
+    for record in records:
+        value = key(record)
+        if value is not None:
+            groups.setdefault(value, set()).add(record.card_id)
+    return MappingProxyType({value: frozenset(ids) for value, ids in groups.items()})
+
+
+@dataclass(frozen=True, slots=True)
+class CardIndex:
+    by_id: MappingProxyType[int, CardRecord]
+    ids_by_deck: MappingProxyType[str, frozenset[int]]
+    ids_by_card_type: MappingProxyType[CardType, frozenset[int]]
+    ids_by_task_type: MappingProxyType[TaskType, frozenset[int]]
+    ids_by_task_special: MappingProxyType[TaskSpecial, frozenset[int]]
+    ids_by_powerup_special: MappingProxyType[PowerupSpecial, frozenset[int]]
+    rule_images_by_deck: MappingProxyType[str, tuple[str, ...]]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[CardRow]) -> CardIndex:
+        records = sorted((CardRecord(**row) for row in rows), key=lambda record: record.card_id)
+        rule_images: dict[str, list[str]] = {}
+        for record in records:
+            if record.card_type == CardType.RULE:
+                rule_images.setdefault(record.deck, []).append(record.send_image_path)
+
+        return cls(
+            by_id=MappingProxyType({record.card_id: record for record in records}),
+            ids_by_deck=_group_ids(records, lambda record: record.deck),
+            ids_by_card_type=_group_ids(records, lambda record: record.card_type),
+            ids_by_task_type=_group_ids(records, lambda record: record.task_type),
+            ids_by_task_special=_group_ids(records, lambda record: record.task_special),
+            ids_by_powerup_special=_group_ids(records, lambda record: record.powerup_special),
+            rule_images_by_deck=MappingProxyType({deck: tuple(images) for deck, images in rule_images.items()}),
+        )
+
+    def ids(self, card_type: CardType) -> frozenset[int]:
+        return self.ids_by_card_type.get(card_type, frozenset())
+
+    def records(self, card_ids: Iterable[int]) -> list[CardRecord]:
+        return [self.by_id[card_id] for card_id in card_ids]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--root", type=Path, default=Path("cards"), help="cards directory")
+    args = parser.parse_args()
+
+    try:
+        index = compile_catalog(args.root)
+    except CatalogError as e:
+        raise SystemExit(str(e)) from None
+    write_index(args.root, index)
+
+    decks = sorted({card["deck"] for card in index["cards"]})
+    print(f"Compiled {len(index['cards'])} cards in {len(decks)} deck(s) ({', '.join(decks)}) into {INDEX_NAME}")
+
+
+if __name__ == "__main__":
+    main()
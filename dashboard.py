@@ -0,0 +1,208 @@
+"""
+Read-only JSON API for admin dashboards, served from the bot's own event loop.
+
+    GET /games             every game's snapshot
+    GET /games/<game id>   one game's snapshot
+
+Snapshots (teams, scores, running team, B1G1F state and card counts per CardState) are cached as encoded JSON. Commits
+that touch a game mark it dirty: ORM changes are picked up in before_flush, and the bulk card state updates mark their
+chat through mark_chat_dirty. A request only rebuilds the games marked since the previous request, so polling a quiet
+bot never touches the database.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, UOWTransaction
+
+from db import engine
+from mappings import DeckCount, Game, GameChat, TeamCardJoin
+
+DASHBOARD_HOST = os.getenv("DASHBOARD_HOST", "127.0.0.1")
+DASHBOARD_PORT = int(os.getenv("DASHBOARD_PORT", "8080"))
+
+REQUEST_TIMEOUT_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+_snapshots: dict[int, bytes] = {}  # game id -> encoded snapshot
+_index_body: bytes | None = None  # encoded list of all snapshots, None once any snapshot changes
+_loaded = False
+
+# committed but not yet rebuilt
+_dirty_game_ids: set[int] = set()
+_dirty_chat_ids: set[int] = set()
+
+_server: asyncio.Server | None = None
+
+
+# --- Invalidation ---
+def mark_game_dirty(session: Session, game_id: int) -> None:
+    session.info.setdefault("dashboard_game_ids", set()).add(game_id)
+
+
+def mark_chat_dirty(session: Session, chat_id: int) -> None:
+    session.info.setdefault("dashboard_chat_ids", set()).add(chat_id)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_dirty(session: Session, _flush_context: UOWTransaction, _instances: object) -> None:
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Game | GameChat):
+            mark_game_dirty(session, obj.game_id)
+        elif isinstance(obj, TeamCardJoin):
+            mark_chat_dirty(session, obj.team_chat_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_dirty(session: Session) -> None:
+    _dirty_game_ids.update(session.info.pop("dashboard_game_ids", ()))
+    _dirty_chat_ids.update(session.info.pop("dashboard_chat_ids", ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_dirty(session: Session) -> None:
+    _ = session.info.pop("dashboard_game_ids", None)
+    _ = session.info.pop("dashboard_chat_ids", None)
+
+
+# --- Snapshots ---
+def _build_snapshots(session: Session, game_ids: set[int]) -> dict[int, dict[str, object]]:
+    games = session.scalars(select(Game).where(Game.game_id.in_(game_ids))).all()
+    chats = session.scalars(
+        select(GameChat).where(GameChat.game_id.in_(game_ids)).order_by(GameChat.team_index),
+    ).all()
+
+    card_counts: defaultdict[int, dict[str, int]] = defaultdict(dict)
+    for chat_id, state, count in session.execute(
+        select(DeckCount.team_chat_id, DeckCount.state, func.sum(DeckCount.count))
+        .join(GameChat, GameChat.chat_id == DeckCount.team_chat_id)
+        .where(GameChat.game_id.in_(game_ids))
+        .group_by(DeckCount.team_chat_id, DeckCount.state),
+    ).tuples():
+        if count > 0:
+            card_counts[chat_id][state.value] = count
+
+    teams: defaultdict[int, list[dict[str, object]]] = defaultdict(list)
+    for chat in chats:
+        if chat.team_index is not None:
+            teams[chat.game_id].append({
+                "team_index": chat.team_index,
+                "chat_id": chat.chat_id,
+                "score": chat.score,
+                "cards": card_counts.get(chat.chat_id, {}),
+            })
+
+    return {
+        game.game_id: {
+            "game_id": game.game_id,
+            "deck": game.deck,
+            "is_started": game.is_started,
+            "is_paused": game.is_paused,
+            "running_team_chat_id": game.running_team_chat_id,
+            "B1G1F": game.B1G1F.name,
+            "all_or_nothing": game.all_or_nothing,
+            "tournament_id": game.tournament_id,
+            "round": game.round,
+            "teams": teams.get(game.game_id, []),
+            "created_at": game.created_at,
+            "started_at": game.started_at,
+            "ended_at": game.ended_at,
+        }
+        for game in games
+    }
+
+
+def _refresh() -> None:
+    global _index_body, _loaded
+
+    if _loaded and len(_dirty_game_ids) == 0 and len(_dirty_chat_ids) == 0:
+        return
+
+    with Session(engine) as session:
+        if not _loaded:
+            game_ids = set(session.scalars(select(Game.game_id)))
+        else:
+            game_ids = _dirty_game_ids | set(session.scalars(
+                select(GameChat.game_id).where(GameChat.chat_id.in_(_dirty_chat_ids)),
+            ))
+        _dirty_game_ids.clear()
+        _dirty_chat_ids.clear()
+        _loaded = True
+        snapshots = _build_snapshots(session, game_ids)
+
+    for game_id in game_ids:
+        snapshot = snapshots.get(game_id)
+        if snapshot is None:
+            _ = _snapshots.pop(game_id, None)  # deleted or archived
+        else:
+            _snapshots[game_id] = json.dumps(snapshot, separators=(",", ":")).encode()
+    _index_body = None
+
+
+def _games_body() -> bytes:
+    global _index_body
+
+    if _index_body is None:
+        _index_body = b"[" + b",".join(_snapshots[game_id] for game_id in sorted(_snapshots)) + b"]"
+    return _index_body
+
+
+# --- HTTP ---
+_GAME_PATH = re.compile(r"/games/(\d+)")
+
+
+def _route(method: str, path: str) -> tuple[str, bytes]:
+    if method != "GET":
+        return "405 Method Not Allowed", b'{"error":"method not allowed"}'
+
+    _refresh()
+    path = path.partition("?")[0].rstrip("/")
+    if path == "/games":
+        return "200 OK", _games_body()
+    match = _GAME_PATH.fullmatch(path)
+    if match is not None and int(match.group(1)) in _snapshots:
+        return "200 OK", _snapshots[int(match.group(1))]
+    return "404 Not Found", b'{"error":"not found"}'
+
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        async with asyncio.timeout(REQUEST_TIMEOUT_SECONDS):
+            request_line = (await reader.readline()).decode("latin-1")
+            while (await reader.readline()).strip() != b"":  # headers are not needed
+                pass
+
+        method, path, _ = request_line.split(" ", 2)
+        started = time.perf_counter()
+        status, body = _route(method, path)
+        logger.debug("%s %s -> %s in %.1f ms", method, path, status, (time.perf_counter() - started) * 1000)
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body,
+        )
+        await writer.drain()
+    except (ValueError, TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_dashboard() -> None:
+    global _server
+
+    _server = await asyncio.start_server(_handle_connection, DASHBOARD_HOST, DASHBOARD_PORT)
+    logger.info("Dashboard API listening on %s:%d", DASHBOARD_HOST, DASHBOARD_PORT)
+
+
+async def stop_dashboard() -> None:
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
@@ -1,68 +1,145 @@
 import os
 from pathlib import Path
 
-from dotenv import load_dotenv
-from sqlalchemy import DDL, create_engine
+from sqlalchemy import DDL, create_engine, text
 
 from mappings import Base
 
-_ = load_dotenv()
-
+# DATA_DIR is read on import, so .env must be loaded before this module is first imported (see main.init)
 data_dir = Path(os.getenv("DATA_DIR", "data"))
-data_dir.mkdir(parents=True, exist_ok=True)
 
 db_path = data_dir / "games.db"
-engine = create_engine(f"sqlite:///{db_path}", echo=True)
-
-with engine.connect() as conn:
-    _ = conn.execute(DDL("DROP TABLE IF EXISTS Card"))
-    _ = conn.execute(DDL("DROP TABLE IF EXISTS Chat"))
-    _ = conn.execute(DDL("DROP TABLE IF EXISTS Game"))
-    _ = conn.execute(DDL("DROP TABLE IF EXISTS TeamCardJoin"))
-
-    Base.metadata.create_all(engine)
-
-    _ = conn.execute(
-        DDL(
-            """
-            CREATE TRIGGER check_game_started_before_update
-                BEFORE UPDATE
-                ON Game
-                FOR EACH ROW
-                WHEN NEW.is_started = 1
-            BEGIN
-                SELECT CASE
-                           WHEN NOT EXISTS (SELECT 1 FROM Chat WHERE Chat.game_id = NEW.game_id AND role = 'LOCATION')
-                               OR NOT EXISTS (SELECT 1 FROM Chat WHERE Chat.game_id = NEW.game_id AND role = 'TEAM_1')
-                               OR NOT EXISTS (SELECT 1 FROM Chat WHERE Chat.game_id = NEW.game_id AND role = 'TEAM_2')
-                               OR NOT EXISTS (SELECT 1 FROM Chat WHERE Chat.game_id = NEW.game_id AND role = 'TEAM_3')
-                               OR NEW.running_team_chat_id IS NULL
-                               THEN RAISE(ABORT, 'Cannot start game: all required chats must exist')
-                           END;
-            END;
-            """,
-        ),
-    )
-
-    _ = conn.execute(
-        DDL(
-            """
-            CREATE TRIGGER check_running_team_id
-                BEFORE UPDATE
-                ON Game
-                FOR EACH ROW
-                WHEN NEW.running_team_chat_id IS NOT NULL
-            BEGIN
-                SELECT CASE
-                           WHEN NOT EXISTS (SELECT 1
-                                            FROM Chat
-                                            WHERE Chat.chat_id = NEW.running_team_chat_id
-                                              AND Chat.role IN ('TEAM_1', 'TEAM_2', 'TEAM_3'))
-                               THEN RAISE(ABORT, 'running_team_chat_id must reference a team chat')
-                           END;
-            END;
-            """,
-        ),
-    )
-
-    conn.commit()
+# the hot statements in statements.py are few, but every handler's ad-hoc queries also take cache slots
+engine = create_engine(
+    f"sqlite:///{db_path}",
+    query_cache_size=int(os.getenv("QUERY_CACHE_SIZE", "1000")),
+)
+
+
+# bump whenever mappings.py changes the schema, with a _MIGRATIONS entry for any table that already existed
+SCHEMA_VERSION = 11
+
+# the tables from before SCHEMA_VERSION 1, when every boot recreated them, so a version 0 database holds nothing to keep
+_LEGACY_TABLES = ("Card", "Chat", "Game", "TeamCardJoin")
+
+# statements that bring a database of the previous version up to each version, run in order on boot. create_all runs
+# first and adds the tables new since the database's version in their current shape, so only changes to tables that
+# existed before need an entry here. SQLite only adds columns that are nullable or have a constant default
+_MIGRATIONS: dict[int, tuple[str, ...]] = {
+    4: (
+        "ALTER TABLE Game ADD COLUMN created_at FLOAT NOT NULL DEFAULT 0",
+        "ALTER TABLE Game ADD COLUMN started_at FLOAT",
+        "ALTER TABLE Game ADD COLUMN ended_at FLOAT",
+        # the archive job would take existing games for long abandoned otherwise
+        "UPDATE Game SET created_at = CAST(strftime('%s', 'now') AS REAL)",
+        "UPDATE Game SET started_at = created_at WHERE is_started OR running_team_chat_id IS NOT NULL",
+    ),
+    6: (
+        "ALTER TABLE Game ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE Chat ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+    ),
+    7: (
+        # the counters start out in step with the decks already dealt, see decks.py
+        """
+        INSERT INTO DeckCount (team_chat_id, state, slot, count)
+        SELECT TeamCardJoin.team_chat_id,
+               TeamCardJoin.state,
+               CASE
+                   WHEN Card.card_type = 'POWERUP' THEN 'POWERUP'
+                   WHEN Card.task_type = 'EXTREME' THEN 'EXTREME_TASK'
+                   ELSE 'NORMAL_TASK'
+                   END,
+               COUNT(*)
+        FROM TeamCardJoin
+                 JOIN Card ON Card.card_id = TeamCardJoin.card_id
+        GROUP BY 1, 2, 3
+        """,
+    ),
+    10: (
+        "ALTER TABLE Game ADD COLUMN tournament_id INTEGER REFERENCES Tournament (tournament_id)",
+        'ALTER TABLE Game ADD COLUMN "round" INTEGER',
+        'CREATE INDEX IF NOT EXISTS "ix_Game_tournament_id" ON Game (tournament_id)',
+    ),
+    11: (
+        # card rows are replaced from the catalog on boot, which fills in the points
+        "ALTER TABLE Card ADD COLUMN task_points INTEGER",
+        "ALTER TABLE Card ADD COLUMN task_all_or_nothing_points INTEGER",
+        "ALTER TABLE Card ADD COLUMN powerup_bonus_points INTEGER",
+        "ALTER TABLE Game ADD COLUMN B1G1F_bonus INTEGER NOT NULL DEFAULT 0",
+        # a B1G1F card in play was worth the old fixed bonus
+        "UPDATE Game SET B1G1F_bonus = 2 WHERE B1G1F != 'INACTIVE'",
+    ),
+}
+
+
+def init_db() -> None:
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    # archive.py frees pages with incremental_vacuum, which needs this mode; switching an existing file needs a VACUUM
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar_one() != 2:  # 2 is INCREMENTAL
+            _ = conn.execute(DDL("PRAGMA auto_vacuum = INCREMENTAL"))
+            _ = conn.execute(DDL("VACUUM"))
+
+    with engine.connect() as conn:
+        # games, boards and parked updates persist across restarts and schema changes
+        version: int = conn.execute(text("PRAGMA user_version")).scalar_one()
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"The database has schema version {version}, newer than this bot's {SCHEMA_VERSION}")
+        if version == 0:
+            for table_name in _LEGACY_TABLES:
+                _ = conn.execute(DDL(f"DROP TABLE IF EXISTS {table_name}"))
+
+        Base.metadata.create_all(conn)
+
+        # a version 0 database has just been created in the current shape
+        if 0 < version < SCHEMA_VERSION:
+            for migration_version in range(version + 1, SCHEMA_VERSION + 1):
+                for statement in _MIGRATIONS.get(migration_version, ()):
+                    _ = conn.execute(text(statement))
+        if version != SCHEMA_VERSION:
+            _ = conn.execute(DDL(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+        _ = conn.execute(
+            DDL(
+                """
+                CREATE TRIGGER IF NOT EXISTS check_game_started_before_update
+                    BEFORE UPDATE
+                    ON Game
+                    FOR EACH ROW
+                    WHEN NEW.is_started = 1
+                BEGIN
+                    SELECT CASE
+                               WHEN NOT EXISTS (SELECT 1 FROM Chat WHERE Chat.game_id = NEW.game_id AND role = 'LOCATION')
+                                   OR (SELECT COUNT(*) FROM Chat WHERE Chat.game_id = NEW.game_id AND role = 'TEAM') < 2
+                                   OR NEW.running_team_chat_id IS NULL
+                                   THEN RAISE(ABORT, 'Cannot start game: a location chat and at least 2 team chats must exist')
+                               END;
+                END;
+                """,
+            ),
+        )
+
+        _ = conn.execute(
+            DDL(
+                """
+                CREATE TRIGGER IF NOT EXISTS check_running_team_id
+                    BEFORE UPDATE
+                    ON Game
+                    FOR EACH ROW
+                    WHEN NEW.running_team_chat_id IS NOT NULL
+                BEGIN
+                    SELECT CASE
+                               WHEN NOT EXISTS (SELECT 1
+                                                FROM Chat
+                                                WHERE Chat.chat_id = NEW.running_team_chat_id
+                                                  AND Chat.game_id = NEW.game_id
+                                                  AND Chat.role = 'TEAM')
+                                   THEN RAISE(ABORT, 'running_team_chat_id must reference a team chat of the game')
+                               END;
+                END;
+                """,
+            ),
+        )
+
+        conn.commit()
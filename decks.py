@@ -0,0 +1,94 @@
+"""
+Per-team deck statistics: how many of a team's cards are in each CardState, split into normal tasks, extreme tasks and
+powerups.
+
+The DeckCount rows are adjusted in the same transaction as every card state change (set_card_states is the only
+place states change after a team's deck is dealt), so availability checks and /deck read a few primary key rows
+instead of counting the team's TeamCardJoin rows.
+"""
+from collections import Counter
+from collections.abc import Collection, Iterable, Mapping
+
+from sqlalchemy import Connection, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from catalog import CardRecord
+from mappings import Base, CardState, CardType, DeckCount, DeckSlot, TaskType, TeamCardJoin
+
+TASK_SLOTS = (DeckSlot.NORMAL_TASK, DeckSlot.EXTREME_TASK)
+EXTREME_TASK_SLOTS = (DeckSlot.EXTREME_TASK,)
+POWERUP_SLOTS = (DeckSlot.POWERUP,)
+
+_table = Base.metadata.tables[DeckCount.__tablename__]
+
+
+def deck_slot(card: CardRecord) -> DeckSlot:
+    if card.card_type == CardType.POWERUP:
+        return DeckSlot.POWERUP
+    elif card.card_type == CardType.TASK:
+        return DeckSlot.EXTREME_TASK if card.task_type == TaskType.EXTREME else DeckSlot.NORMAL_TASK
+    raise RuntimeError(f"{card.card_type} cards are not dealt to teams")
+
+
+# --- Updating ---
+def _add(session: Session, chat_id: int, state: CardState, slot_counts: Counter[DeckSlot]) -> None:
+    for slot, count in slot_counts.items():
+        _ = session.execute(
+            insert(_table)
+            .values(team_chat_id=chat_id, state=state, slot=slot, count=count)
+            .on_conflict_do_update(
+                index_elements=[_table.c.team_chat_id, _table.c.state, _table.c.slot],
+                set_={"count": _table.c.count + count},
+            ),
+        )
+
+
+def deal_decks(session: Session, decks: Mapping[int, Collection[CardRecord]]) -> None:
+    """
+    Deals new teams their decks, all undrawn, given each team chat id's cards. However many teams are dealt, that is
+    one TeamCardJoin insert and one DeckCount insert.
+    """
+    join_rows = [
+        {"team_chat_id": chat_id, "card_id": card.card_id, "state": CardState.UNDRAWN}
+        for chat_id, cards in decks.items()
+        for card in cards
+    ]
+    count_rows = [
+        {"team_chat_id": chat_id, "state": CardState.UNDRAWN, "slot": slot, "count": count}
+        for chat_id, cards in decks.items()
+        for slot, count in Counter(deck_slot(card) for card in cards).items()
+    ]
+    if len(join_rows) > 0:
+        _ = session.execute(insert(Base.metadata.tables[TeamCardJoin.__tablename__]), join_rows)
+    if len(count_rows) > 0:
+        _ = session.execute(insert(_table), count_rows)
+
+
+def move_cards(session: Session, chat_id: int, cards: Iterable[CardRecord], from_state: CardState,
+               to_state: CardState) -> None:
+    slot_counts = Counter(deck_slot(card) for card in cards)
+    for slot, count in slot_counts.items():
+        _ = session.execute(
+            update(_table)
+            .where(_table.c.team_chat_id == chat_id, _table.c.state == from_state, _table.c.slot == slot)
+            .values(count=_table.c.count - count),
+        )
+    _add(session, chat_id, to_state, slot_counts)
+
+
+# --- Reading ---
+def count_cards(session: Session, chat_id: int, state: CardState, slots: Collection[DeckSlot]) -> int:
+    return session.scalar(
+        select(func.coalesce(func.sum(DeckCount.count), 0))
+        .where(DeckCount.team_chat_id == chat_id, DeckCount.state == state, DeckCount.slot.in_(slots)),
+    ) or 0
+
+
+def read_deck_counts(connection: Connection, chat_id: int) -> dict[tuple[DeckSlot, CardState], int]:
+    return {
+        (slot, state): count
+        for slot, state, count in connection.execute(
+            select(DeckCount.slot, DeckCount.state, DeckCount.count).where(DeckCount.team_chat_id == chat_id),
+        ).tuples()
+    }
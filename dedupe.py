@@ -0,0 +1,105 @@
+"""
+Idempotent callback handling: every callback query is claimed before it is routed, and a query that was already
+claimed is dropped.
+
+A query is identified by its update id (Telegram redelivering an update), its query id and the keyboard message it was
+sent from (a double tap, which arrives as two queries with different ids). Keyboards are single use, so one claim per
+message is all a handler ever needs. Recent keys are kept in a bounded LRU, so duplicates are dropped without touching
+the database, and every claim is also written to the ProcessedCallback table, so duplicates delivered after a restart
+are dropped too. Claims are made before the handler runs, so a crash mid-handler never runs a press twice. If the
+handler fails before it consumes the keyboard (validate_callback_query clears the chat's callback_message_id), the
+claim on the keyboard message is released, so the team can press it again rather than be stuck on it.
+"""
+import os
+from collections import OrderedDict
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from telegram import Update
+
+from db import engine
+from mappings import Base, GameChat, ProcessedCallback
+
+RECENT_KEYS_SIZE = 4_096
+# Telegram keeps undelivered updates for 24 hours, so older keys can never come back
+CALLBACK_TTL_HOURS = int(os.getenv("CALLBACK_TTL_HOURS", "24"))
+
+_recent_keys: OrderedDict[str, None] = OrderedDict()
+
+
+def _message_key(chat_id: int, message_id: int) -> str:
+    return f"m{chat_id}:{message_id}"
+
+
+def _callback_keys(tele_update: Update) -> list[str]:
+    query = tele_update.callback_query
+    if query is None:
+        raise RuntimeError("Update has no callback query")
+
+    keys = [f"u{tele_update.update_id}", f"q{query.id}"]
+    if query.message is not None:
+        keys.append(_message_key(query.message.chat.id, query.message.message_id))
+    return keys
+
+
+def claim_callback(tele_update: Update, now: float) -> bool:
+    """
+    Returns True if the callback query was not seen before and is now claimed, False if it is a duplicate.
+    """
+    keys = _callback_keys(tele_update)
+    # no awaits until the keys are in the LRU, so concurrent duplicates on the event loop cannot both get through
+    if any(key in _recent_keys for key in keys):
+        # the duplicate's own update and query ids, not its keyboard message, whose claim may have been released
+        for key in keys[:2]:
+            _recent_keys[key] = None
+            _recent_keys.move_to_end(key)
+        return False
+
+    for key in keys:
+        _recent_keys[key] = None
+    while len(_recent_keys) > RECENT_KEYS_SIZE:
+        _ = _recent_keys.popitem(last=False)
+
+    table = Base.metadata.tables[ProcessedCallback.__tablename__]
+    with Session(engine) as session:
+        # through the connection for a CursorResult, which has the inserted row count
+        inserted = session.connection().execute(
+            insert(table)
+            .values([{"key": key, "created_at": now} for key in keys])
+            .on_conflict_do_nothing(index_elements=[table.c.key]),
+        ).rowcount
+        session.commit()
+
+    return inserted == len(keys)
+
+
+def release_unconsumed_keyboard(tele_update: Update) -> None:
+    """
+    Releases the claim on the query's keyboard message if its chat still waits on that keyboard, i.e. the handler
+    failed before consuming it. The update and query keys stay claimed, only a new press gets through.
+    """
+    query = tele_update.callback_query
+    if query is None or query.message is None:
+        return
+
+    chat_id, message_id = query.message.chat.id, query.message.message_id
+    table = Base.metadata.tables[ProcessedCallback.__tablename__]
+    with Session(engine) as session:
+        callback_message_id = session.scalar(
+            select(GameChat.callback_message_id).where(GameChat.chat_id == chat_id),
+        )
+        if callback_message_id != message_id:
+            return
+
+        key = _message_key(chat_id, message_id)
+        _ = _recent_keys.pop(key, None)
+        _ = session.execute(delete(table).where(table.c.key == key))
+        session.commit()
+
+
+def purge_expired_callbacks(session: Session, now: float) -> None:
+    _ = session.execute(
+        delete(Base.metadata.tables[ProcessedCallback.__tablename__])
+        .where(ProcessedCallback.created_at < now - CALLBACK_TTL_HOURS * 3600),
+    )
@@ -1,24 +1,46 @@
+import asyncio
+import itertools
+import logging
 import random
+import re
+import time
+from collections.abc import Coroutine, Sequence
 from enum import Enum, auto
-from typing import Any, Literal, cast
+from typing import Any
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from telegram import InlineKeyboardButton, Update, InlineKeyboardMarkup
-from telegram.ext import Application, CallbackQueryHandler, ContextTypes, CommandHandler, ExtBot, JobQueue
+from telegram.ext import Application, CallbackQueryHandler, ContextTypes, CommandHandler, ExtBot, JobQueue, \
+    MessageHandler, filters
 
+from archive import ARCHIVE_AFTER_HOURS, purge_games
+from catalog import DEFAULT_DECK, CardRecord
 from db import engine
-from mappings import ChatRole, Game, GameChat, Card, CardType, PowerupSpecial, TaskSpecial, TeamCardJoin, CardState, \
-    B1G1FStates, \
-    PowerupCard, TaskCard
-from utils import CheckFailedError, add_points, card_callback_generator, card_callback_pattern, chat_not_assigned_check, \
-    create_shown_task_selector, game_not_started_check, \
+from decks import read_deck_counts
+from statements import get_game_chat, read_card_ids, read_chat_view
+from logs import bind_log_context
+from locations import distance_meters, latest_point, load_track, points_near, record_location
+from metrics import render_prometheus, render_summary
+from profiling import MAX_PROFILED_UPDATES, profile_status, profiles_dir, request_profile
+from rules import Trigger, compile_rules, run_effect
+from scoring import all_time_leaderboard, award_points, award_task, game_leaderboard, \
+    record_round_started, record_task_drawn, task_completion_rates
+from scheduler import HEAD_START_MINUTES, cancel_cycle_timers, schedule_cycle_timers
+from mappings import ChatRole, Game, GameChat, CardType, PowerupSpecial, TaskSpecial, CardState, \
+    B1G1FStates, DeckSlot, ScoreReason, Tournament
+from utils import CheckFailedError, callback_dispatcher, callback_enum, card_callback_generator, \
+    chat_not_assigned_check, \
+    create_card_selector, create_shown_task_selector, game_not_started_check, MIN_TEAMS, next_running_team_chat, \
+    validate_team_number, \
     get_game_chat_or_raise, \
-    get_chat_id, get_tasks, validate_callback_query, validate_game_id, \
-    ensure_running_team_chat, \
-    graceful_fail, generate_shown_tasks, \
+    get_chat_id, get_chat_title, get_tasks, validate_callback_query, validate_game_id, \
+    ensure_running_team_chat, ensure_running_team_view, filter_cards, get_card_ids, get_card_index, set_card_states, \
+    graceful_fail, generate_shown_tasks, count_undrawn_powerups, count_undrawn_tasks, \
     to_started_game, ensure_admin_chat, db_select_card, generate_shown_powerups, \
-    create_shown_powerup_selector, get_powerups, no_callback
+    create_shown_powerup_selector, get_powerups, no_callback, deal_team_decks
+
+logger = logging.getLogger(__name__)
 
 
 # --- General handlers ---
@@ -29,57 +51,64 @@ async def start_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def rules_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with Session(engine) as session:
-        rule_cards = session.scalars(
-            select(Card).where(Card.card_type == CardType.RULE).order_by(Card.card_id),
-        ).all()
-
-        for rule_card in rule_cards:
-            _ = await context.bot.send_photo(
-                get_chat_id(tele_update), rule_card.image_path,
-            )
+    chat_id = get_chat_id(tele_update)
+    with engine.connect() as connection:
+        chat = read_chat_view(connection, chat_id)
+    deck = chat.deck if chat is not None else DEFAULT_DECK
+
+    for rule_image in get_card_index().rule_images_by_deck.get(deck, ()):
+        _ = await context.bot.send_photo(chat_id, rule_image)
+
+
+_HELP_TEXT = (
+    "Available commands:\n"
+    "/help - Lists all available commands\n"
+    "/rules - Shows the game rules\n"
+    "\n"
+    "/create_game [deck] - Creates a new game and assigns this chat as the admin chat\n"
+    "/create_team <game id> [team number] - Assigns this chat as a team's chat (next free number by default)\n"
+    "/create_location_chat <game id> - Assigns this chat as the location chat\n"
+    "\n"
+    "Runner-only commands:\n"
+    "/current_task - Shows the currently drawn tasks\n"
+    "/show_powerups - Shows the currently drawn powerups\n"
+    "/complete_task - Marks a drawn task as completed and draws new tasks/powerups\n"
+    "/use_powerup - Initiates the use of a powerup\n"
+    "/deck - Shows how many tasks and powerups are left in your deck\n"
+    "\n"
+    "/leaderboard [all|tasks] - Shows this game's standings, the all-time standings or task completion rates\n"
+    "/tournament [standings|export] [tournament id] - Shows or exports the tournament standings\n"
+)
+_ADMIN_HELP_TEXT = _HELP_TEXT + (
+    "\nAdmin commands:\n"
+    "/delete_game - Deletes the game and unassigns all chats\n"
+    "/delete_team <team number> - Deletes a team's chat assignment\n"
+    "/delete_location_chat - Deletes the location chat assignment\n"
+    "\n"
+    "/start_game - Starts the game for all teams\n"
+    "/end_game - Ends the game for all teams\n"
+    "/catch - Marks a catch as having occurred in the game and updates teams' roles. Once all teams are ready, restart the game by running /restart_game\n"
+    "/restart_game - Restarts the game after a catch has occurred\n"
+    "\n"
+    "/distance - Shows how far each chasing team is from the runners\n"
+    "/route <team number> - Summarises a team's shared location track\n"
+    "\n"
+    "/tournament create <name> - Creates a tournament and assigns this chat as its admin chat\n"
+    "/tournament add_game <tournament id> - Adds this chat's game to the tournament's current round\n"
+    "/tournament next_round <tournament id> - Archives the round's ended games and sets up the next round\n"
+    "\n"
+    "/stats [prometheus] - Shows per-handler latency and throughput statistics\n"
+    "/profile [number of updates|status] - Profiles the next updates (10 by default) or shows the profiling status\n"
+)
 
 
 async def help_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "Available commands:\n"
-        "/help - Lists all available commands\n"
-        "/rules - Shows the game rules\n"
-        "\n"
-        "/create_game - Creates a new game and assigns this chat as the admin chat\n"
-        "/create_team_1 <game id> - Assigns this chat as team 1's chat\n"
-        "/create_team_2 <game id> - Assigns this chat as team 2's chat\n"
-        "/create_team_3 <game id> - Assigns this chat as team 3's chat\n"
-        "/create_location_chat <game id> - Assigns this chat as the location chat\n"
-        "\n"
-        "Runner-only commands:\n"
-        "/current_task - Shows the currently drawn tasks\n"
-        "/show_powerups - Shows the currently drawn powerups\n"
-        "/complete_task - Marks a drawn task as completed and draws new tasks/powerups\n"
-        "/use_powerup - Initiates the use of a powerup\n"
-    )
-
-    with Session(engine) as session:
-        try:
-            chat = get_game_chat_or_raise(session, tele_update)
-            if chat.game.admin_chat.chat_id == chat.chat_id:
-                help_text += (
-                    "\nAdmin commands:\n"
-                    "/delete_game - Deletes the game and unassigns all chats\n"
-                    "/delete_team_1 - Deletes team 1's chat assignment\n"
-                    "/delete_team_2 - Deletes team 2's chat assignment\n"
-                    "/delete_team_3 - Deletes team 3's chat assignment\n"
-                    "/delete_location_chat - Deletes the location chat assignment\n"
-                    "\n"
-                    "/start_game - Starts the game for all teams\n"
-                    "/end_game - Ends the game for all teams\n"
-                    "/catch - Marks a catch as having occurred in the game and updates teams' roles. Once all teams are ready, restart the game by running /restart_game\n"
-                    "/restart_game - Restarts the game after a catch has occurred\n"
-                )
-        except CheckFailedError:
-            pass
+    chat_id = get_chat_id(tele_update)
+    with engine.connect() as connection:
+        chat = read_chat_view(connection, chat_id)
+    is_admin = chat is not None and chat.role == ChatRole.ADMIN
 
-        _ = await context.bot.send_message(chat_id=get_chat_id(tele_update), text=help_text)
+    _ = await context.bot.send_message(chat_id=chat_id, text=_ADMIN_HELP_TEXT if is_admin else _HELP_TEXT)
 
 
 @graceful_fail
@@ -112,14 +141,17 @@ async def create_game_handler(tele_update: Update, context: ContextTypes.DEFAULT
     with Session(engine) as session:
         chat_not_assigned_check(session, tele_update)
 
-        while True:
-            game_id = random.randint(100000, 999999)
-            if session.get(Game, game_id) is None:
-                break
+        deck = context.args[0] if context.args is not None and len(context.args) > 0 else DEFAULT_DECK
+        if deck not in get_card_index().ids_by_deck:
+            raise CheckFailedError(f"Deck {deck} does not exist")
 
+        # imported on first use, games are created far less often than the bot is started
+        from provisioning import allocate_game_ids
+        game_id, = allocate_game_ids(session, 1)
         chat_id = get_chat_id(tele_update)
+        bind_log_context(game_id=game_id)
 
-        session.add(Game(game_id=game_id))
+        session.add(Game(game_id=game_id, deck=deck))
         session.add(GameChat(chat_id=chat_id, game_id=game_id, role=ChatRole.ADMIN))
         session.commit()
 
@@ -127,45 +159,38 @@ async def create_game_handler(tele_update: Update, context: ContextTypes.DEFAULT
         chat_id,
         (
             f"New game created with game id: {game_id}, this chat is the admin chat of the game\n\n"
-            "Use this id to set the team and location chats via /create_team_<team number> and /create_location_chat"
+            "Use this id to set the team and location chats via /create_team and /create_location_chat"
         ),
     )
 
 
-def create_team_handler_generator(team_num: Literal[1, 2, 3]):
-    @graceful_fail
-    @no_callback
-    async def create_team_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
-        with Session(engine) as session:
-            chat_not_assigned_check(session, tele_update)
+@graceful_fail
+@no_callback
+async def create_team_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with Session(engine) as session:
+        chat_not_assigned_check(session, tele_update)
 
-            game = validate_game_id(session, context)
-            if getattr(game, f"team_{team_num}_chat") is not None:
+        game = validate_game_id(session, context, max_args=2)
+        taken_team_nums = {team_chat.team_index for team_chat in game.team_chats}
+        if context.args is not None and len(context.args) == 2:
+            team_num = validate_team_number(context.args[1])
+            if team_num in taken_team_nums:
                 raise CheckFailedError(
                     f"Team chat already exists, choose another team number or ask your admin to delete team {team_num}'s chat",
                 )
+        else:
+            team_num = min(set(range(1, len(taken_team_nums) + 2)) - taken_team_nums)
 
-            chat_id = get_chat_id(tele_update)
-            team_chat = GameChat(chat_id=chat_id, game_id=game.game_id, role=ChatRole(f"team_{team_num}"))
-            session.add(team_chat)
-
-            cards = session.scalars(select(Card).where(Card.card_type != CardType.RULE)).all()
-            for card in cards:
-                session.add(
-                    TeamCardJoin(
-                        team_chat_id=team_chat.chat_id,
-                        card_id=card.card_id,
-                        state=CardState.UNDRAWN,
-                    ),
-                )
-            session.commit()
-
-        _ = await context.bot.send_message(
-            chat_id,
-            f"This chat has been assigned to team {team_num}",
-        )
+        chat_id = get_chat_id(tele_update)
+        team_chat = GameChat(chat_id=chat_id, game_id=game.game_id, role=ChatRole.TEAM, team_index=team_num)
+        session.add(team_chat)
+        deal_team_decks(session, {chat_id: game.deck})
+        session.commit()
 
-    return create_team_handler
+    _ = await context.bot.send_message(
+        chat_id,
+        f"This chat has been assigned to team {team_num}",
+    )
 
 
 @graceful_fail
@@ -199,13 +224,8 @@ async def delete_game_handler(tele_update: Update, context: ContextTypes.DEFAULT
         game_not_started_check(session, tele_update)
 
         chat = ensure_admin_chat(session, tele_update)
-        game = chat.game
-        chats = session.scalars(
-            select(GameChat)
-            .where(GameChat.game_id == game.game_id),
-        ).all()
-
-        session.delete(game)
+        # SQLite does not enforce the foreign keys, so the game's rows in other tables are deleted explicitly
+        purge_games(session, [chat.game_id])
         session.commit()
 
         _ = await context.bot.send_message(
@@ -214,30 +234,28 @@ async def delete_game_handler(tele_update: Update, context: ContextTypes.DEFAULT
         )
 
 
-def delete_team_handler_generator(team_num: Literal[1, 2, 3]):
-    @graceful_fail
-    @no_callback
-    async def delete_team_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
-        with Session(engine) as session:
-            game_not_started_check(session, tele_update)
+@graceful_fail
+@no_callback
+async def delete_team_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with Session(engine) as session:
+        game_not_started_check(session, tele_update)
 
-            chat = ensure_admin_chat(session, tele_update)
-            game = chat.game
-            team_chat: GameChat | None = cast(GameChat | None, getattr(game, f"team_{team_num}_chat"))
-            if team_chat is None:
-                raise CheckFailedError(f"Team {team_num} chat does not exist, cannot delete")
+        chat = ensure_admin_chat(session, tele_update)
+        if context.args is None or len(context.args) != 1:
+            raise CheckFailedError("Please provide the team number to delete")
+        team_num = validate_team_number(context.args[0])
 
-            session.delete(team_chat)
-            session.commit()
+        team_chat = next((team_chat for team_chat in chat.game.team_chats if team_chat.team_index == team_num), None)
+        if team_chat is None:
+            raise CheckFailedError(f"Team {team_num} chat does not exist, cannot delete")
 
-            _ = await context.bot.send_message(
-                get_chat_id(tele_update),
-                f"Team {team_num} chat successfully deleted, team can now create a new chat assignment",
-            )
-
-            session.commit()
+        session.delete(team_chat)
+        session.commit()
 
-    return delete_team_handler
+        _ = await context.bot.send_message(
+            get_chat_id(tele_update),
+            f"Team {team_num} chat successfully deleted, team can now create a new chat assignment",
+        )
 
 
 @graceful_fail
@@ -266,6 +284,7 @@ class StartCycleStates(Enum):
     DRAWING_TASKS = auto()
 
 
+@callback_enum
 class StartCycleActions(Enum):
     SELECT_TASK = auto()
 
@@ -274,20 +293,23 @@ async def _start_cycle(session: Session, tele_update: Update, context: ContextTy
     chat = ensure_admin_chat(session, tele_update)
     started_game = to_started_game(chat.game)
     running_chat_id = started_game.running_team_chat.chat_id
-    for team_num in range(1, 4):
-        team_chat: GameChat = cast(GameChat, getattr(started_game, f"team_{team_num}_chat"))
-        if team_chat.chat_id == running_chat_id:
-            text = "The game has started! You are the runners, please send your location into the location chat"
-        else:
-            text = "The game has started! You are the chasers, please wait 20 minutes before starting your chase"
-        _ = await context.bot.send_message(team_chat.chat_id, text)
+    _ = await asyncio.gather(*(
+        context.bot.send_message(
+            team_chat.chat_id,
+            "The game has started! You are the runners, please send your location into the location chat"
+            if team_chat.chat_id == running_chat_id else
+            f"The game has started! You are the chasers, please wait {HEAD_START_MINUTES} minutes before starting "
+            "your chase, I will tell you when the head start is over",
+        )
+        for team_chat in started_game.team_chats
+    ))
+    schedule_cycle_timers(session, started_game.game_id, running_chat_id)
 
-    for task in generate_shown_tasks(session, running_chat_id, 3, False):
-        _ = await context.bot.send_photo(running_chat_id, task.image_path)
+    shown_tasks = generate_shown_tasks(session, running_chat_id, 3, False)
+    for task in shown_tasks:
+        _ = await context.bot.send_photo(running_chat_id, task.send_image_path)
 
-    keyboard_markup = create_shown_task_selector(
-        session, running_chat_id, StartCycleActions.SELECT_TASK
-    )
+    keyboard_markup = create_card_selector(shown_tasks, StartCycleActions.SELECT_TASK)
     callback_message = await context.bot.send_message(
         running_chat_id, "Select your task:", reply_markup=keyboard_markup,
     )
@@ -308,20 +330,19 @@ async def start_game_handler(tele_update: Update, context: ContextTypes.DEFAULT_
         missing_chats: list[str] = []
         if game.location_chat is None:
             missing_chats.append("location")
-        if game.team_1_chat is None:
-            missing_chats.append("team_1")
-        if game.team_2_chat is None:
-            missing_chats.append("team_2")
-        if game.team_3_chat is None:
-            missing_chats.append("team_3")
+        if len(game.team_chats) < MIN_TEAMS:
+            missing_chats.append(f"{MIN_TEAMS - len(game.team_chats)} more team(s)")
 
         if len(missing_chats) > 0:
             raise CheckFailedError(f"Missing required chats: {', '.join(missing_chats)}")
 
-        assert game.team_1_chat is not None, "team_1_chat should not be None here"
-        game.running_team_chat_id = game.team_1_chat.chat_id
+        game.running_team_chat_id = game.team_chats[0].chat_id
 
         game.is_started = True
+        if game.started_at is None:
+            game.started_at = time.time()
+            record_round_started(session, game)
+        game.ended_at = None
 
         await _start_cycle(session, tele_update, context)
 
@@ -338,10 +359,13 @@ async def end_game_handler(tele_update: Update, context: ContextTypes.DEFAULT_TY
             raise CheckFailedError("Game is not started")
 
         game.is_started = False
+        game.ended_at = time.time()
+        cancel_cycle_timers(session, game.game_id)
 
         _ = await context.bot.send_message(
             get_chat_id(tele_update),
-            "Game successfully ended, teams can now wait for the next game or ask their admin to restart the game",
+            "Game successfully ended, teams can now wait for the next game or ask their admin to restart the game. "
+            f"Unless it is restarted, the game will be archived after {ARCHIVE_AFTER_HOURS} hours",
         )
 
         session.commit()
@@ -363,17 +387,16 @@ async def catch_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE)
                 get_chat_id(tele_update), running_team_chat.callback_message_id, reply_markup=None,
             )
 
-        for team_card_join in running_team_chat.team_card_joins:
-            if team_card_join.state == CardState.SHOWN:
-                team_card_join.state = CardState.UNDRAWN
-            elif team_card_join.state == CardState.DRAWN:
-                team_card_join.state = CardState.USED
+        running_chat_id = running_team_chat.chat_id
+        for from_state, to_state in ((CardState.SHOWN, CardState.UNDRAWN), (CardState.DRAWN, CardState.USED)):
+            _ = set_card_states(
+                session, running_chat_id, get_card_ids(session, running_chat_id, from_state), from_state, to_state,
+            )
 
-        running_team_num = int(running_team_chat.role.value.split("_")[-1])
-        new_running_team_chat = cast(GameChat, getattr(started_game, f"team_{(running_team_num + 1) % 3}_chat"))
-        game.running_team_chat_id = new_running_team_chat.chat_id
+        game.running_team_chat_id = next_running_team_chat(started_game).chat_id
 
         game.is_paused = True
+        cancel_cycle_timers(session, game.game_id)
         game.all_or_nothing = False
         game.B1G1F = B1G1FStates.INACTIVE
 
@@ -402,6 +425,7 @@ async def restart_game_handler(tele_update: Update, context: ContextTypes.DEFAUL
 
 
 # --- Complete task handlers ---
+@callback_enum
 class CompleteTaskActions(Enum):
     REVEAL_TASKS_OR_POWERUPS = auto()
     SELECT_TASK = auto()
@@ -411,10 +435,14 @@ class CompleteTaskActions(Enum):
     DREW_B1G1F = auto()
 
 
-async def _send_select_task_message(session: Session, chat: GameChat, context: ContextTypes.DEFAULT_TYPE):
+async def _send_select_task_message(session: Session, chat: GameChat, context: ContextTypes.DEFAULT_TYPE,
+                                    shown_tasks: Sequence[CardRecord] | None = None):
     B1G1F = chat.game.B1G1F
     chat_id = chat.chat_id
-    keyboard = create_shown_task_selector(session, chat_id, CompleteTaskActions.SELECT_TASK)
+    if shown_tasks is None:
+        keyboard = create_shown_task_selector(session, chat_id, CompleteTaskActions.SELECT_TASK)
+    else:
+        keyboard = create_card_selector(shown_tasks, CompleteTaskActions.SELECT_TASK)
 
     if B1G1F == B1G1FStates.NONE_DRAWN:
         text = "Select your first task to draw:"
@@ -432,9 +460,12 @@ async def _send_select_task_message(session: Session, chat: GameChat, context: C
 
 
 async def _send_select_powerup_message(session: Session, chat: GameChat, context: ContextTypes.DEFAULT_TYPE,
-                                       enum_value: Enum):
+                                       enum_value: Enum, shown_powerups: Sequence[CardRecord] | None = None):
     chat_id = chat.chat_id
-    keyboard = create_shown_powerup_selector(session, chat_id, enum_value)
+    if shown_powerups is None:
+        keyboard = create_shown_powerup_selector(session, chat_id, enum_value)
+    else:
+        keyboard = create_card_selector(shown_powerups, enum_value)
 
     callback_message = await context.bot.send_message(
         chat_id, "Select a powerup to draw:", reply_markup=keyboard,
@@ -451,9 +482,10 @@ async def on_select_task(tele_update: Update, context: ContextTypes.DEFAULT_TYPE
 
         card_id = int(data.split(":")[-1])
         selected_task = db_select_card(session, chat, card_id, not B1G1F == B1G1FStates.NONE_DRAWN)
+        record_task_drawn(session, selected_task.card_id)
 
         _ = await context.bot.send_message(get_chat_id(tele_update), "You have selected the following task:")
-        _ = await context.bot.send_photo(get_chat_id(tele_update), selected_task.image_path)
+        _ = await context.bot.send_photo(get_chat_id(tele_update), selected_task.send_image_path)
 
         if B1G1F == B1G1FStates.NONE_DRAWN:
             game.B1G1F = B1G1FStates.ONE_DRAWN
@@ -478,33 +510,12 @@ async def on_select_powerup(tele_update: Update, context: ContextTypes.DEFAULT_T
 
         card_id = int(data.split(":")[-1])
         selected_powerup = db_select_card(session, chat, card_id, False)
-        if not isinstance(selected_powerup, PowerupCard):
+        if selected_powerup.card_type != CardType.POWERUP:
             raise RuntimeError("Selected card is not a powerup card")
         _ = await context.bot.send_message(get_chat_id(tele_update), "You have selected the following powerup:")
-        _ = await context.bot.send_photo(get_chat_id(tele_update), selected_powerup.image_path)
-
-        shown_tasks = get_tasks(session, chat.chat_id, CardState.SHOWN)
-
-        if selected_powerup.powerup_special == PowerupSpecial.BUY_1_GET_1_FREE and len(shown_tasks) >= 2:
-            keyboard = InlineKeyboardMarkup.from_column(
-                [
-                    InlineKeyboardButton(
-                        "Use powerup immediately",
-                        callback_data=f"{card_callback_generator(CompleteTaskActions.DREW_B1G1F)}:USE",
-                    ),
-                    InlineKeyboardButton(
-                        "Save powerup for later",
-                        callback_data=f"{card_callback_generator(CompleteTaskActions.DREW_B1G1F)}:KEEP",
-                    ),
-                ],
-            )
-            callback_message = await context.bot.send_message(
-                chat.chat_id,
-                "Do you want to use the Buy 1 Get 1 Free powerup now or save it for later?",
-                reply_markup=keyboard,
-            )
-            chat.callback_message_id = callback_message.message_id
-        else:
+        _ = await context.bot.send_photo(get_chat_id(tele_update), selected_powerup.send_image_path)
+
+        if await run_effect(Trigger.POWERUP_DRAWN, session, chat, selected_powerup, context):
             _ = await _send_select_task_message(session, chat, context)
 
         session.commit()
@@ -514,29 +525,25 @@ async def on_select_powerup(tele_update: Update, context: ContextTypes.DEFAULT_T
 async def on_B1G1F_use_or_keep(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
     with Session(engine) as session:
         chat, data = await validate_callback_query(session, tele_update, context)
-        game = chat.game
 
         choice = data.split(":")[-1]
         if choice == "USE":
-            game.B1G1F = B1G1FStates.NONE_DRAWN
-
-            team_card_join = session.scalars(
-                select(TeamCardJoin)
-                .join(PowerupCard, TeamCardJoin.card_id == PowerupCard.card_id)
-                .where(
-                    TeamCardJoin.team_chat_id == chat.chat_id,
-                    TeamCardJoin.state == CardState.DRAWN,
-                    PowerupCard.powerup_special == PowerupSpecial.BUY_1_GET_1_FREE,
-                ),
-            ).one_or_none()
-            if team_card_join is None:
+            b1g1f_ids = get_card_index().ids_by_powerup_special.get(PowerupSpecial.BUY_1_GET_1_FREE, frozenset())
+            drawn_b1g1f_ids = b1g1f_ids.intersection(get_card_ids(session, chat.chat_id, CardState.DRAWN))
+            if len(drawn_b1g1f_ids) == 0:
                 raise RuntimeError("No Buy 1 Get 1 Free powerup card found to use")
-            team_card_join.state = CardState.USED
+            b1g1f_id = min(drawn_b1g1f_ids)
+            _ = set_card_states(session, chat.chat_id, [b1g1f_id], CardState.DRAWN, CardState.USED)
+            _ = await run_effect(Trigger.POWERUP_USED, session, chat, get_card_index().by_id[b1g1f_id], context)
 
         await _send_select_task_message(session, chat, context)
         session.commit()
 
 
+REVEAL_SIZE = 3
+LOW_DECK_TASKS = 2 * REVEAL_SIZE  # warn when fewer tasks are left than two more reveals need
+
+
 async def _draw_new_cards(session: Session, chat: GameChat, context: ContextTypes.DEFAULT_TYPE):
     game = chat.game
     num_cards = game.reveal_num_tasks or 3
@@ -552,33 +559,43 @@ async def _draw_new_cards(session: Session, chat: GameChat, context: ContextType
         session.commit()
 
     chat_id = chat.chat_id
-    for task in generate_shown_tasks(session, chat_id, num_cards, extremes_only):
-        _ = await context.bot.send_photo(chat_id, task.image_path)
+    shown_tasks = generate_shown_tasks(session, chat_id, num_cards, extremes_only)
+    for task in shown_tasks:
+        _ = await context.bot.send_photo(chat_id, task.send_image_path)
 
-    if not reveal_more:
-        await _send_select_task_message(session, chat, context)
+    # the shown tasks that are not picked go back into the deck
+    tasks_left = count_undrawn_tasks(session, chat_id, False) + len(shown_tasks) - 1
+    if tasks_left < LOW_DECK_TASKS:
+        _ = await context.bot.send_message(
+            chat_id, f"Heads up: only {tasks_left} tasks will be left in your deck, see /deck for details",
+        )
+
+    # only offer reveals the deck can still serve, a reveal that cannot be filled would fail after the tap
+    reveal_tasks = count_undrawn_tasks(session, chat_id, extremes_only) >= REVEAL_SIZE
+    reveal_powerups = count_undrawn_powerups(session, chat_id) >= REVEAL_SIZE
+    if not reveal_more or not (reveal_tasks or reveal_powerups):
+        await _send_select_task_message(session, chat, context, shown_tasks)
         return
 
-    keyboard = InlineKeyboardMarkup.from_column(
-        [
-            InlineKeyboardButton(
-                "Reveal 3 more tasks",
-                callback_data=f"{card_callback_generator(CompleteTaskActions.REVEAL_TASKS_OR_POWERUPS)}:TASKS",
-            ),
-            InlineKeyboardButton(
-                "Reveal 3 powerups",
-                callback_data=f"{card_callback_generator(CompleteTaskActions.REVEAL_TASKS_OR_POWERUPS)}:POWERUPS",
-            ),
-        ],
-    )
+    reveal_prefix = card_callback_generator(CompleteTaskActions.REVEAL_TASKS_OR_POWERUPS)
+    buttons: list[InlineKeyboardButton] = []
+    if reveal_tasks:
+        buttons.append(InlineKeyboardButton(f"Reveal {REVEAL_SIZE} more tasks", callback_data=f"{reveal_prefix}:TASKS"))
+    if reveal_powerups:
+        buttons.append(InlineKeyboardButton(f"Reveal {REVEAL_SIZE} powerups", callback_data=f"{reveal_prefix}:POWERUPS"))
+    keyboard = InlineKeyboardMarkup.from_column(buttons)
     callback_message = await context.bot.send_message(
-        chat_id, "Choose whether to reveal 3 more tasks or 3 more powerups", reply_markup=keyboard,
+        chat_id,
+        f"Choose whether to reveal {REVEAL_SIZE} more tasks or {REVEAL_SIZE} more powerups" if len(buttons) == 2 else
+        f"Your deck is running low, only {'tasks' if reveal_tasks else 'powerups'} can still be revealed",
+        reply_markup=keyboard,
     )
     chat.callback_message_id = callback_message.message_id
 
     session.commit()
 
 
+@graceful_fail
 async def on_reveal(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
     with Session(engine) as session:
         chat, data = await validate_callback_query(session, tele_update, context)
@@ -588,54 +605,103 @@ async def on_reveal(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
         choice = data.split(":")[-1]
 
         if choice == "TASKS":
-            for task in generate_shown_tasks(session, chat_id, 3, game.all_or_nothing):
-                _ = await context.bot.send_photo(chat_id, task.image_path)
+            for task in generate_shown_tasks(session, chat_id, REVEAL_SIZE, game.all_or_nothing):
+                _ = await context.bot.send_photo(chat_id, task.send_image_path)
 
             await _send_select_task_message(session, chat, context)
         elif choice == "POWERUPS":
-            for powerup in generate_shown_powerups(session, chat_id, 3):
-                _ = await context.bot.send_photo(chat_id, powerup.image_path)
+            shown_powerups = generate_shown_powerups(session, chat_id, REVEAL_SIZE)
+            for powerup in shown_powerups:
+                _ = await context.bot.send_photo(chat_id, powerup.send_image_path)
 
-            await _send_select_powerup_message(session, chat, context, CompleteTaskActions.SELECT_POWERUP)
+            await _send_select_powerup_message(
+                session, chat, context, CompleteTaskActions.SELECT_POWERUP, shown_powerups,
+            )
         else:
             raise RuntimeError(f"Invalid choice for reveal: {choice}")
 
         session.commit()
 
 
-async def _get_task_info(session: Session, card: TaskCard, chat: GameChat, context: ContextTypes.DEFAULT_TYPE):
-    if card.task_special == TaskSpecial.FULLERTON:
-        keyboard = InlineKeyboardMarkup.from_column(
-            [
-                InlineKeyboardButton(
-                    "Arrived early/on time",
-                    callback_data=f"{card_callback_generator(CompleteTaskActions.FULLERTON)}:EARLY",
-                ),
-                InlineKeyboardButton(
-                    "Arrived late", callback_data=f"{card_callback_generator(CompleteTaskActions.FULLERTON)}:LATE",
-                ),
-            ],
-        )
-        callback_message = await context.bot.send_message(
-            chat.chat_id,
-            "Did you arrive at your chosen location early/on time or late?",
-            reply_markup=keyboard,
-        )
-        chat.callback_message_id = callback_message.message_id
+# --- Card effects, see rules.py ---
+async def _ask_fullerton_arrival(session: Session, chat: GameChat, _card: CardRecord,
+                                 context: ContextTypes.DEFAULT_TYPE) -> bool:
+    keyboard = InlineKeyboardMarkup.from_column(
+        [
+            InlineKeyboardButton(
+                "Arrived early/on time",
+                callback_data=f"{card_callback_generator(CompleteTaskActions.FULLERTON)}:EARLY",
+            ),
+            InlineKeyboardButton(
+                "Arrived late", callback_data=f"{card_callback_generator(CompleteTaskActions.FULLERTON)}:LATE",
+            ),
+        ],
+    )
+    callback_message = await context.bot.send_message(
+        chat.chat_id,
+        "Did you arrive at your chosen location early/on time or late?",
+        reply_markup=keyboard,
+    )
+    chat.callback_message_id = callback_message.message_id
 
-        session.commit()
-        return
-    elif card.task_special == TaskSpecial.MBS:
-        game = chat.game
-        num_tasks = random.randint(1, 3)
-        game.reveal_num_tasks = num_tasks
-        _ = await context.bot.send_message(
-            chat.chat_id,
-            f"The dice has ordained that your next draw will reveal {num_tasks} tasks",
-        )
-        session.commit()
+    session.commit()
+    return False  # on_fullerton_response draws
+
+
+async def _roll_reveal_size(session: Session, chat: GameChat, _card: CardRecord,
+                            context: ContextTypes.DEFAULT_TYPE) -> bool:
+    num_tasks = random.randint(1, 3)
+    chat.game.reveal_num_tasks = num_tasks
+    _ = await context.bot.send_message(
+        chat.chat_id,
+        f"The dice has ordained that your next draw will reveal {num_tasks} tasks",
+    )
+    session.commit()
+    return True
 
-    await _draw_new_cards(session, chat, context)
+
+async def _offer_B1G1F_now(session: Session, chat: GameChat, _card: CardRecord,
+                           context: ContextTypes.DEFAULT_TYPE) -> bool:
+    if len(get_tasks(session, chat.chat_id, CardState.SHOWN)) < 2:
+        return True
+
+    keyboard = InlineKeyboardMarkup.from_column(
+        [
+            InlineKeyboardButton(
+                "Use powerup immediately",
+                callback_data=f"{card_callback_generator(CompleteTaskActions.DREW_B1G1F)}:USE",
+            ),
+            InlineKeyboardButton(
+                "Save powerup for later",
+                callback_data=f"{card_callback_generator(CompleteTaskActions.DREW_B1G1F)}:KEEP",
+            ),
+        ],
+    )
+    callback_message = await context.bot.send_message(
+        chat.chat_id,
+        "Do you want to use the Buy 1 Get 1 Free powerup now or save it for later?",
+        reply_markup=keyboard,
+    )
+    chat.callback_message_id = callback_message.message_id
+    return False  # on_B1G1F_use_or_keep asks for the task
+
+
+async def _activate_B1G1F(_session: Session, chat: GameChat, card: CardRecord,
+                          _context: ContextTypes.DEFAULT_TYPE) -> bool:
+    chat.game.B1G1F = B1G1FStates.NONE_DRAWN
+    chat.game.B1G1F_bonus = card.powerup_bonus_points or 0
+    return True
+
+
+async def _activate_all_or_nothing(_session: Session, chat: GameChat, _card: CardRecord,
+                                   _context: ContextTypes.DEFAULT_TYPE) -> bool:
+    chat.game.all_or_nothing = True
+    return True
+
+
+async def _get_task_info(session: Session, card: CardRecord, chat: GameChat, context: ContextTypes.DEFAULT_TYPE):
+    if await run_effect(Trigger.TASK_COMPLETED, session, chat, card, context):
+        await _draw_new_cards(session, chat, context)
 
 
 @graceful_fail
@@ -670,29 +736,17 @@ async def complete_task_handler(tele_update: Update, context: ContextTypes.DEFAU
         chat = ensure_running_team_chat(session, tele_update)
         game = chat.game
 
-        team_card_joins = session.scalars(
-            select(TeamCardJoin)
-            .join(TaskCard, TeamCardJoin.card_id == TaskCard.card_id)
-            .where(
-                TeamCardJoin.team_chat_id == chat.chat_id,
-                TeamCardJoin.state == CardState.DRAWN,
-            ),
-        ).all()
-        if len(team_card_joins) == 0:
+        drawn_tasks = get_tasks(session, chat.chat_id, CardState.DRAWN)
+        if len(drawn_tasks) == 0:
             raise CheckFailedError("No drawn tasks to complete")
-        drawn_tasks: list[TaskCard] = []
-        for team_card_join in team_card_joins:
-            if not isinstance(team_card_join.card, TaskCard):
-                raise RuntimeError("Drawn card is not a task card")
-            drawn_tasks.append(team_card_join.card)
 
         if game.B1G1F == B1G1FStates.INACTIVE or game.B1G1F == B1G1FStates.NONE_DRAWN:
-            if len(team_card_joins) != 1:
+            if len(drawn_tasks) != 1:
                 raise RuntimeError("Multiple drawn tasks found despite B1G1F being inactive")
 
             drawn_task = drawn_tasks[0]
-            team_card_joins[0].state = CardState.USED
-            add_points(chat, drawn_task)
+            _ = set_card_states(session, chat.chat_id, [drawn_task.card_id], CardState.DRAWN, CardState.USED)
+            award_task(session, chat, get_chat_title(tele_update), drawn_task)
 
             _ = await context.bot.send_message(
                 chat.chat_id,
@@ -703,14 +757,9 @@ async def complete_task_handler(tele_update: Update, context: ContextTypes.DEFAU
 
             await _get_task_info(session, drawn_task, chat, context)
         elif game.B1G1F == B1G1FStates.BOTH_DRAWN:
-            if len(team_card_joins) != 2:
+            if len(drawn_tasks) != 2:
                 raise RuntimeError("Expected 2 drawn tasks with B1G1F BOTH_DRAWN state")
-            keyboard = InlineKeyboardMarkup.from_column(
-                [InlineKeyboardButton(
-                    task.title,
-                    callback_data=f"{card_callback_generator(CompleteTaskActions.B1G1F)}:{task.card_id}",
-                ) for task in drawn_tasks],
-            )
+            keyboard = create_card_selector(drawn_tasks, CompleteTaskActions.B1G1F)
             callback_message = await context.bot.send_message(
                 chat.chat_id,
                 "Good job! Select which task you completed:",
@@ -720,32 +769,21 @@ async def complete_task_handler(tele_update: Update, context: ContextTypes.DEFAU
 
             session.commit()
         elif game.B1G1F == B1G1FStates.ONE_COMPLETED:
-            if len(team_card_joins) != 1:
+            if len(drawn_tasks) != 1:
                 raise RuntimeError("Expected 2 drawn tasks with B1G1F ONE_COMPLETED state")
             drawn_task = drawn_tasks[0]
 
-            pending_team_card_join = session.scalars(
-                select(TeamCardJoin)
-                .join(TaskCard, TeamCardJoin.card_id == TaskCard.card_id)
-                .where(
-                    TeamCardJoin.team_chat_id == chat.chat_id,
-                    TeamCardJoin.state == CardState.PENDING,
-                ),
-            ).one_or_none()
-            if pending_team_card_join is None:
+            pending_tasks = get_tasks(session, chat.chat_id, CardState.PENDING)
+            if len(pending_tasks) != 1:
                 raise RuntimeError("No pending task found with B1G1F ONE_COMPLETED state")
-            if not isinstance(pending_team_card_join.card, TaskCard):
-                raise RuntimeError("Pending card is not a task card")
-            pending_task = pending_team_card_join.card
+            pending_task = pending_tasks[0]
 
-            team_card_joins[0].state = CardState.USED
-            pending_team_card_join.state = CardState.USED
-            add_points(chat, drawn_task)
-            add_points(chat, pending_task)
-
-            if chat.score is None:
-                raise RuntimeError("Team chat has no score")
-            chat.score += 2
+            _ = set_card_states(session, chat.chat_id, [drawn_task.card_id], CardState.DRAWN, CardState.USED)
+            _ = set_card_states(session, chat.chat_id, [pending_task.card_id], CardState.PENDING, CardState.USED)
+            title = get_chat_title(tele_update)
+            award_task(session, chat, title, drawn_task)
+            award_task(session, chat, title, pending_task)
+            award_points(session, chat, title, game.B1G1F_bonus, ScoreReason.B1G1F_BONUS)
 
             _ = await context.bot.send_message(
                 chat.chat_id,
@@ -765,21 +803,11 @@ async def on_B1G1F_select_completed_task(tele_update: Update, context: ContextTy
         chat, data = await validate_callback_query(session, tele_update, context)
 
         card_id = int(data.split(":")[-1])
-        team_card_join = session.scalars(
-            select(TeamCardJoin)
-            .join(TaskCard, TeamCardJoin.card_id == TaskCard.card_id)
-            .where(
-                TeamCardJoin.card_id == card_id,
-                TeamCardJoin.team_chat_id == chat.chat_id,
-                TeamCardJoin.state == CardState.DRAWN,
-            ),
-        ).one_or_none()
-        if team_card_join is None:
+        if card_id not in get_card_index().ids(CardType.TASK) or len(
+            set_card_states(session, chat.chat_id, [card_id], CardState.DRAWN, CardState.PENDING),
+        ) == 0:
             raise CheckFailedError("No drawn task found with that ID")
-        selected_task = team_card_join.card
-        if not isinstance(selected_task, TaskCard):
-            raise RuntimeError("Selected card is not a task card")
-        team_card_join.state = CardState.PENDING
+        selected_task = get_card_index().by_id[card_id]
 
         session.commit()
 
@@ -790,33 +818,57 @@ async def on_B1G1F_select_completed_task(tele_update: Update, context: ContextTy
 @graceful_fail
 @no_callback
 async def current_task_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with Session(engine) as session:
-        chat = ensure_running_team_chat(session, tele_update)
-        chat_id = chat.chat_id
-        drawn_tasks = get_tasks(session, chat_id, CardState.DRAWN)
-        if len(drawn_tasks) == 0:
-            raise CheckFailedError("No drawn tasks found")
-        for task in drawn_tasks:
-            _ = await context.bot.send_photo(chat_id, task.image_path)
+    with engine.connect() as connection:
+        chat_id = ensure_running_team_view(connection, tele_update).chat_id
+        drawn_tasks = filter_cards(read_card_ids(connection, chat_id, CardState.DRAWN), CardType.TASK)
 
-        session.commit()
+    if len(drawn_tasks) == 0:
+        raise CheckFailedError("No drawn tasks found")
+    for task in drawn_tasks:
+        _ = await context.bot.send_photo(chat_id, task.send_image_path)
 
 
 @graceful_fail
 @no_callback
 async def show_powerups_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with Session(engine) as session:
-        chat = ensure_running_team_chat(session, tele_update)
-        chat_id = chat.chat_id
-        drawn_powerups = get_powerups(session, chat_id, CardState.DRAWN)
-        if len(drawn_powerups) == 0:
-            raise CheckFailedError("No drawn tasks found")
-        for powerup in drawn_powerups:
-            _ = await context.bot.send_photo(chat_id, powerup.image_path)
+    with engine.connect() as connection:
+        chat_id = ensure_running_team_view(connection, tele_update).chat_id
+        drawn_powerups = filter_cards(read_card_ids(connection, chat_id, CardState.DRAWN), CardType.POWERUP)
+
+    if len(drawn_powerups) == 0:
+        raise CheckFailedError("No drawn tasks found")
+    for powerup in drawn_powerups:
+        _ = await context.bot.send_photo(chat_id, powerup.send_image_path)
 
-        session.commit()
 
+_DECK_SLOT_NAMES = {
+    DeckSlot.NORMAL_TASK: "Normal tasks",
+    DeckSlot.EXTREME_TASK: "Extreme tasks",
+    DeckSlot.POWERUP: "Powerups",
+}
+
+
+@graceful_fail
+async def deck_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = get_chat_id(tele_update)
+    with engine.connect() as connection:
+        chat = read_chat_view(connection, chat_id)
+        if chat is None or chat.role != ChatRole.TEAM:
+            raise CheckFailedError("This chat is not a team chat")
+        counts = read_deck_counts(connection, chat_id)
+
+    lines = ["Your deck:"]
+    for slot, name in _DECK_SLOT_NAMES.items():
+        others = ", ".join(
+            f"{counts[slot, state]} {state.value}" for state in CardState
+            if state != CardState.UNDRAWN and counts.get((slot, state), 0) > 0
+        )
+        lines.append(f"{name}: {counts.get((slot, CardState.UNDRAWN), 0)} left" + (f" ({others})" if others else ""))
 
+    _ = await context.bot.send_message(chat_id, "\n".join(lines))
+
+
+@callback_enum
 class UsePowerupStates(Enum):
     SELECTING_POWERUP = auto()
 
@@ -832,19 +884,16 @@ async def use_powerup_handler(tele_update: Update, context: ContextTypes.DEFAULT
         if len(drawn_powerups) == 0:
             raise CheckFailedError("No shown powerups found")
         for powerup in drawn_powerups:
-            _ = await context.bot.send_photo(chat_id, powerup.image_path)
-
-        column = [
-            InlineKeyboardButton(
-                powerup.title,
-                callback_data=f"{card_callback_generator(UsePowerupStates.SELECTING_POWERUP)}:{powerup.card_id}",
-            ) for powerup in drawn_powerups
-        ] + [InlineKeyboardButton(
-            "Cancel",
-            callback_data=f"{card_callback_generator(UsePowerupStates.SELECTING_POWERUP)}:CANCEL",
-        )]
-
-        keyboard = InlineKeyboardMarkup.from_column(column)
+            _ = await context.bot.send_photo(chat_id, powerup.send_image_path)
+
+        keyboard = create_card_selector(
+            drawn_powerups,
+            UsePowerupStates.SELECTING_POWERUP,
+            [InlineKeyboardButton(
+                "Cancel",
+                callback_data=f"{card_callback_generator(UsePowerupStates.SELECTING_POWERUP)}:CANCEL",
+            )],
+        )
 
         callback_message = await context.bot.send_message(
             chat_id, "Select a powerup to use:", reply_markup=keyboard,
@@ -867,41 +916,322 @@ async def on_use_powerup_select(tele_update: Update, context: ContextTypes.DEFAU
             return
 
         card_id = int(data.split(":")[-1])
-        team_card_join = session.scalars(
-            select(TeamCardJoin)
-            .join(PowerupCard, TeamCardJoin.card_id == PowerupCard.card_id)
-            .where(
-                TeamCardJoin.team_chat_id == chat.chat_id,
-                TeamCardJoin.card_id == card_id,
-                TeamCardJoin.state == CardState.DRAWN,
-            ),
-        ).one_or_none()
-
-        if team_card_join is None:
+        if card_id not in get_card_index().ids(CardType.POWERUP) or len(
+            set_card_states(session, chat_id, [card_id], CardState.DRAWN, CardState.USED),
+        ) == 0:
             raise CheckFailedError("No shown powerup found with that ID")
-        selected_powerup = team_card_join.card
-        if not isinstance(selected_powerup, PowerupCard):
-            raise RuntimeError("Selected card is not a powerup card")
+        selected_powerup = get_card_index().by_id[card_id]
+
+        async def announce_powerup(game_chat: GameChat):
+            if game_chat.chat_id == chat_id:
+                text = "You have used the following powerup:"
+            elif selected_powerup.powerup_send_to_chasers:
+                text = "The runners have used the following powerup:"
+            else:
+                return
+            _ = await context.bot.send_message(game_chat.chat_id, text)
+            _ = await context.bot.send_photo(game_chat.chat_id, selected_powerup.send_image_path)
+
+        _ = await asyncio.gather(*(announce_powerup(game_chat) for game_chat in started_game.team_chats))
+        session.commit()
 
-        for game_chat in [started_game.team_1_chat, started_game.team_2_chat, started_game.team_3_chat]:
-            if game_chat.chat_id != chat_id and selected_powerup.powerup_send_to_chasers:
-                _ = await context.bot.send_message(
-                    game_chat.chat_id, "The runners have used the following powerup:",
-                )
-                _ = await context.bot.send_photo(game_chat.chat_id, selected_powerup.image_path)
-            elif game_chat.chat_id == chat_id:
-                _ = await context.bot.send_message(chat_id, "You have used the following powerup:")
-                _ = await context.bot.send_photo(chat_id, selected_powerup.image_path)
-        team_card_join.state = CardState.USED
+        _ = await run_effect(Trigger.POWERUP_USED, session, chat, selected_powerup, context)
         session.commit()
 
-        game = chat.game
-        if selected_powerup.powerup_special == PowerupSpecial.BUY_1_GET_1_FREE:
-            game.B1G1F = B1G1FStates.NONE_DRAWN
-        elif selected_powerup.powerup_special == PowerupSpecial.ALL_OR_NOTHING:
-            game.all_or_nothing = True
 
-        session.commit()
+# --- Location tracking ---
+NEARBY_METERS = 500
+NEARBY_WINDOW_MINUTES = 10
+
+
+@graceful_fail
+async def location_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = tele_update.effective_message
+    if message is None or message.location is None:
+        return
+
+    with Session(engine) as session:
+        chat = get_game_chat(session, get_chat_id(tele_update))
+        if chat is None or not chat.game.is_started:
+            return
+
+        # the runners share their location in the location chat, chasers may share theirs in their team chat
+        if chat.role == ChatRole.LOCATION and not chat.game.is_paused:
+            team_chat_id = chat.game.running_team_chat_id
+        elif chat.role == ChatRole.TEAM:
+            team_chat_id = chat.chat_id
+        else:
+            return
+        if team_chat_id is None:
+            return
+
+        sent_at = message.edit_date or message.date  # live locations arrive as edits of the original message
+        _ = record_location(
+            session, chat.game_id, team_chat_id, int(sent_at.timestamp()),
+            message.location.latitude, message.location.longitude,
+        )
+
+
+def _format_age(seconds: float) -> str:
+    return f"{int(seconds // 60)} min ago" if seconds >= 60 else "just now"
+
+
+@graceful_fail
+async def distance_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with Session(engine) as session:
+        chat = ensure_admin_chat(session, tele_update)
+        started_game = to_started_game(chat.game)
+        game_id = started_game.game_id
+        runners = started_game.running_team_chat
+
+        runners_point = latest_point(session, game_id, runners.chat_id)
+        if runners_point is None:
+            raise CheckFailedError("The running team has not shared their location yet")
+
+        now = time.time()
+        lines = [f"Runners (team {runners.team_index}) last seen {_format_age(now - runners_point.t)}"]
+        for team_chat in started_game.team_chats:
+            if team_chat.chat_id == runners.chat_id:
+                continue
+            point = latest_point(session, game_id, team_chat.chat_id)
+            if point is None:
+                lines.append(f"Team {team_chat.team_index}: no location shared")
+            else:
+                lines.append(
+                    f"Team {team_chat.team_index}: {distance_meters(point, runners_point):.0f} m away, "
+                    f"last seen {_format_age(now - point.t)}",
+                )
+
+        nearby = points_near(
+            session, game_id, runners_point, NEARBY_METERS, since=int(now) - NEARBY_WINDOW_MINUTES * 60,
+        )
+        nearby_teams = sorted(
+            str(team_chat.team_index) for team_chat in started_game.team_chats
+            if team_chat.chat_id in nearby and team_chat.chat_id != runners.chat_id
+        )
+        lines.append(
+            f"\nChasers within {NEARBY_METERS} m of the runners' last location in the past "
+            f"{NEARBY_WINDOW_MINUTES} min: {', '.join(f'team {team}' for team in nearby_teams) or 'none'}",
+        )
+
+    _ = await context.bot.send_message(get_chat_id(tele_update), "\n".join(lines))
+
+
+@graceful_fail
+async def route_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with Session(engine) as session:
+        chat = ensure_admin_chat(session, tele_update)
+        if context.args is None or len(context.args) != 1:
+            raise CheckFailedError("Please provide a team number")
+        team_num = validate_team_number(context.args[0])
+
+        team_chat = next((team_chat for team_chat in chat.game.team_chats if team_chat.team_index == team_num), None)
+        if team_chat is None:
+            raise CheckFailedError(f"Team {team_num} does not exist")
+
+        points = load_track(session, chat.game_id, team_chat.chat_id)
+        if len(points) == 0:
+            raise CheckFailedError(f"Team {team_num} has not shared their location yet")
+
+    travelled = sum(distance_meters(a, b) for a, b in itertools.pairwise(points))
+    chat_id = get_chat_id(tele_update)
+    _ = await context.bot.send_message(
+        chat_id,
+        f"Team {team_num} has shared {len(points)} locations over {(points[-1].t - points[0].t) // 60} min, "
+        f"travelling {travelled / 1000:.2f} km. Their last location:",
+    )
+    _ = await context.bot.send_location(chat_id, latitude=points[-1].lat, longitude=points[-1].lon)
+
+
+# --- Leaderboards ---
+LEADERBOARD_SIZE = 10
+
+
+@graceful_fail
+async def leaderboard_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    mode = context.args[0] if context.args is not None and len(context.args) > 0 else None
+
+    with Session(engine) as session:
+        if mode is None:
+            chat = get_game_chat_or_raise(session, tele_update)
+            team_chats = game_leaderboard(chat.game.team_chats)
+            if len(team_chats) == 0:
+                raise CheckFailedError("No teams have joined this game yet")
+            lines = ["Game leaderboard:"] + [
+                f"{rank}. Team {team_chat.team_index}: {team_chat.score} points"
+                for rank, team_chat in enumerate(team_chats, start=1)
+            ]
+        elif mode == "all":
+            standings = all_time_leaderboard(session, LEADERBOARD_SIZE)
+            if len(standings) == 0:
+                raise CheckFailedError("No points have been scored yet")
+            lines = ["All-time leaderboard:"] + [
+                f"{rank}. {standing.title}: {standing.points} points, {standing.tasks_completed} tasks "
+                f"over {standing.games_played} games"
+                for rank, standing in enumerate(standings, start=1)
+            ]
+        elif mode == "tasks":
+            chat = get_game_chat(session, get_chat_id(tele_update))
+            deck = chat.game.deck if chat is not None else DEFAULT_DECK
+            card_index = get_card_index()
+            task_ids = card_index.ids(CardType.TASK) & card_index.ids_by_deck.get(deck, frozenset())
+            rates = task_completion_rates(session, task_ids)
+            if len(rates) == 0:
+                raise CheckFailedError("No tasks have been drawn yet")
+            lines = [f"Task completion rates ({deck}):"] + [
+                f"{card_index.by_id[card_id].title}: {completed}/{drawn} ({completed / drawn:.0%})"
+                for card_id, drawn, completed in rates
+            ]
+        else:
+            raise CheckFailedError("Usage: /leaderboard [all|tasks]")
+
+    _ = await context.bot.send_message(get_chat_id(tele_update), "\n".join(lines))
+
+
+# --- Tournaments ---
+_TOURNAMENT_USAGE = (
+    "Usage: /tournament create <name> | add_game <tournament id> | next_round <tournament id> | "
+    "standings [tournament id] | export [tournament id]"
+)
+
+
+def _role_description(game_chat: GameChat) -> str:
+    if game_chat.role == ChatRole.ADMIN:
+        return "the admin chat"
+    elif game_chat.role == ChatRole.LOCATION:
+        return "the location chat"
+    return f"team {game_chat.team_index}"
+
+
+@graceful_fail
+async def tournament_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # imported on first use, most bot runs never see a tournament and the module brings in csv and the bulk provisioning
+    from tournaments import add_game, ensure_tournament_admin, export_standings, find_tournament, next_round, \
+        tournament_standings, validate_tournament_id
+
+    args = context.args if context.args is not None and len(context.args) > 0 else ["standings"]
+    action = args[0]
+    chat_id = get_chat_id(tele_update)
+
+    with Session(engine) as session:
+        if action == "create" and len(args) >= 2:
+            tournament = Tournament(name=" ".join(args[1:]), admin_chat_id=chat_id)
+            session.add(tournament)
+            session.commit()
+            _ = await context.bot.send_message(
+                chat_id,
+                f"Tournament {tournament.name} created with id {tournament.tournament_id}, this chat is its admin chat"
+                f"\n\nAdd games to round 1 by running /tournament add_game {tournament.tournament_id} in their admin "
+                "chats",
+            )
+
+        elif action == "add_game" and len(args) == 2:
+            game = ensure_admin_chat(session, tele_update).game
+            tournament = validate_tournament_id(session, args[1])
+            add_game(tournament, game)
+            session.commit()
+            _ = await context.bot.send_message(
+                chat_id, f"Game {game.game_id} has been added to round {game.round} of {tournament.name}",
+            )
+
+        elif action == "next_round" and len(args) == 2:
+            tournament = validate_tournament_id(session, args[1])
+            ensure_tournament_admin(tournament, chat_id)
+            games = next_round(session, tournament, time.time())
+            session.commit()
+
+            game_chats = session.scalars(
+                select(GameChat).where(GameChat.game_id.in_([game.game_id for game in games])),
+            ).all()
+            sends: list[Coroutine[object, object, object]] = [
+                context.bot.send_message(
+                    game_chat.chat_id,
+                    f"Round {tournament.current_round} of {tournament.name} is set up, this chat is "
+                    f"{_role_description(game_chat)} of game {game_chat.game_id}"
+                    + (", start it with /start_game when everyone is ready" if game_chat.role == ChatRole.ADMIN else ""),
+                )
+                for game_chat in game_chats
+            ]
+            for result in await asyncio.gather(*sends, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.warning("Failed to send round message: %s", result)
+            _ = await context.bot.send_message(
+                chat_id, f"Round {tournament.current_round} is set up with {len(games)} games",
+            )
+
+        elif action in ("standings", "export") and len(args) <= 2:
+            tournament = validate_tournament_id(session, args[1]) if len(args) == 2 else find_tournament(session, chat_id)
+            if tournament is None:
+                raise CheckFailedError("Please provide a tournament id")
+
+            if action == "export":
+                ensure_tournament_admin(tournament, chat_id)
+                _ = await context.bot.send_document(
+                    chat_id, export_standings(session, tournament),
+                    filename=f"tournament-{tournament.tournament_id}.csv",
+                )
+                return
+
+            standings = tournament_standings(session, tournament.tournament_id)
+            if len(standings) == 0:
+                raise CheckFailedError("No tournament games have been started yet")
+            lines = [f"{tournament.name} standings, round {tournament.current_round}:"] + [
+                f"{rank}. {standing.title}: {standing.points} points, {standing.tasks_completed} tasks "
+                f"over {len(standing.round_points)} rounds"
+                for rank, standing in enumerate(standings, start=1)
+            ]
+            _ = await context.bot.send_message(chat_id, "\n".join(lines))
+
+        else:
+            raise CheckFailedError(_TOURNAMENT_USAGE)
+
+
+# --- Diagnostics (admin only) ---
+@graceful_fail
+async def stats_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with Session(engine) as session:
+        _ = ensure_admin_chat(session, tele_update)
+
+    chat_id = get_chat_id(tele_update)
+    if context.args is not None and len(context.args) > 0 and context.args[0] == "prometheus":
+        _ = await context.bot.send_document(
+            chat_id, render_prometheus().encode(), filename="metrics.txt",
+        )
+    else:
+        _ = await context.bot.send_message(chat_id, render_summary())
+
+
+PROFILE_DEFAULT_UPDATES = 10
+
+
+@graceful_fail
+async def profile_handler(tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    with Session(engine) as session:
+        _ = ensure_admin_chat(session, tele_update)
+
+    chat_id = get_chat_id(tele_update)
+    arg = context.args[0] if context.args is not None and len(context.args) == 1 else None
+    if context.args is not None and len(context.args) > 1 or (
+        arg is not None and arg != "status" and re.fullmatch(r"[1-9]\d*", arg) is None
+    ):
+        raise CheckFailedError("Usage: /profile [number of updates|status]")
+
+    if arg == "status":
+        remaining, last_path = profile_status()
+        _ = await context.bot.send_message(
+            chat_id,
+            f"{remaining} updates left to profile\nLast profile: {last_path if last_path is not None else 'none yet'}",
+        )
+        return
+
+    num_updates = int(arg) if arg is not None else PROFILE_DEFAULT_UPDATES
+
+    request_profile(num_updates)
+    _ = await context.bot.send_message(
+        chat_id,
+        f"Profiling the next {min(num_updates, MAX_PROFILED_UPDATES)} updates into {profiles_dir}, "
+        "summarize the result with python profiling.py",
+    )
 
 
 # --- Setting handlers ---
@@ -914,15 +1244,11 @@ def set_handlers(application: ApplicationType) -> None:
         # CommandHandler("cancel", cancel_handler),
 
         CommandHandler("create_game", create_game_handler),
-        CommandHandler("create_team_1", create_team_handler_generator(1), has_args=True),
-        CommandHandler("create_team_2", create_team_handler_generator(2), has_args=True),
-        CommandHandler("create_team_3", create_team_handler_generator(3), has_args=True),
+        CommandHandler("create_team", create_team_handler, has_args=True),
         CommandHandler("create_location_chat", create_location_chat_handler, has_args=True),
 
         CommandHandler("delete_game", delete_game_handler),
-        CommandHandler("delete_team_1", delete_team_handler_generator(1)),
-        CommandHandler("delete_team_2", delete_team_handler_generator(2)),
-        CommandHandler("delete_team_3", delete_team_handler_generator(3)),
+        CommandHandler("delete_team", delete_team_handler),
         CommandHandler("delete_location_chat", delete_location_chat_handler),
 
         CommandHandler("end_game", end_game_handler),
@@ -930,21 +1256,47 @@ def set_handlers(application: ApplicationType) -> None:
 
         CommandHandler("start_game", start_game_handler),
         CommandHandler("restart_game", restart_game_handler),
-        CallbackQueryHandler(on_select_task, card_callback_pattern(StartCycleActions.SELECT_TASK)),
 
         CommandHandler("complete_task", complete_task_handler),
-        CallbackQueryHandler(on_B1G1F_select_completed_task, card_callback_pattern(CompleteTaskActions.B1G1F)),
-        CallbackQueryHandler(on_fullerton_response, card_callback_pattern(CompleteTaskActions.FULLERTON)),
-
-        CallbackQueryHandler(on_reveal, card_callback_pattern(CompleteTaskActions.REVEAL_TASKS_OR_POWERUPS)),
-        CallbackQueryHandler(on_select_task, card_callback_pattern(CompleteTaskActions.SELECT_TASK)),
-        CallbackQueryHandler(on_select_powerup, card_callback_pattern(CompleteTaskActions.SELECT_POWERUP)),
-        CallbackQueryHandler(on_B1G1F_use_or_keep, card_callback_pattern(CompleteTaskActions.DREW_B1G1F)),
 
         CommandHandler("current_task", current_task_handler),
         CommandHandler("show_powerups", show_powerups_handler),
         CommandHandler("use_powerup", use_powerup_handler),
-        CallbackQueryHandler(on_use_powerup_select, card_callback_pattern(UsePowerupStates.SELECTING_POWERUP))
+        CommandHandler("deck", deck_handler),
+
+        CommandHandler("distance", distance_handler),
+        CommandHandler("route", route_handler),
+
+        CommandHandler("leaderboard", leaderboard_handler),
+        CommandHandler("tournament", tournament_handler),
+
+        CommandHandler("stats", stats_handler),
+        CommandHandler("profile", profile_handler),
+
+        MessageHandler(filters.LOCATION, location_handler),
+
+        CallbackQueryHandler(callback_dispatcher({
+            StartCycleActions.SELECT_TASK: on_select_task,
+
+            CompleteTaskActions.B1G1F: on_B1G1F_select_completed_task,
+            CompleteTaskActions.FULLERTON: on_fullerton_response,
+
+            CompleteTaskActions.REVEAL_TASKS_OR_POWERUPS: on_reveal,
+            CompleteTaskActions.SELECT_TASK: on_select_task,
+            CompleteTaskActions.SELECT_POWERUP: on_select_powerup,
+            CompleteTaskActions.DREW_B1G1F: on_B1G1F_use_or_keep,
+
+            UsePowerupStates.SELECTING_POWERUP: on_use_powerup_select,
+        })),
     ]
 
     application.add_handlers(handlers)
+
+    compile_rules(get_card_index(), {
+        (Trigger.TASK_COMPLETED, TaskSpecial.FULLERTON): _ask_fullerton_arrival,
+        (Trigger.TASK_COMPLETED, TaskSpecial.MBS): _roll_reveal_size,
+
+        (Trigger.POWERUP_DRAWN, PowerupSpecial.BUY_1_GET_1_FREE): _offer_B1G1F_now,
+        (Trigger.POWERUP_USED, PowerupSpecial.BUY_1_GET_1_FREE): _activate_B1G1F,
+        (Trigger.POWERUP_USED, PowerupSpecial.ALL_OR_NOTHING): _activate_all_or_nothing,
+    })
@@ -0,0 +1,188 @@
+"""
+Run loop with a graceful shutdown, replacing Application.run_polling.
+
+On SIGINT/SIGTERM polling stops first, so no new updates are fetched, then the updates already fetched are given up
+to DRAIN_TIMEOUT_SECONDS to be handled. Whatever is still queued after that is parked in the PendingUpdate table
+instead of being lost, the update in progress runs to completion and the application stops, which runs the last
+persistence round and flushes it. The next start replays the parked updates before polling resumes.
+
+The id of the last handled update is saved periodically and on shutdown. Telegram redelivers updates whose
+acknowledgement was lost with a killed process, and those at or below the saved id are skipped on the next run, until
+the first newer update arrives. The id is only trusted for OFFSET_MAX_AGE_HOURS after it was handled: Telegram drops
+updates after 24 hours, so nothing older can come back, and after a week without updates it picks the next update id
+at random, which may well be below the saved one.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+
+from db import engine
+from handlers import ApplicationType
+from mappings import Base, BotState, PendingUpdate
+
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "20"))
+OFFSET_SAVE_SECONDS = 30
+OFFSET_MAX_AGE_HOURS = 24
+
+_OFFSET_NAME = "last_update_id"
+_OFFSET_HANDLED_AT_NAME = "last_update_handled_at"
+
+logger = logging.getLogger(__name__)
+
+_last_update_id = 0  # last update handled
+_last_handled_at = 0.0
+_saved_update_id = 0  # last update handled before this process started, 0 once no redelivery can be below it
+
+
+# --- Offset ---
+def _load_offset() -> tuple[int, float]:
+    """
+    Returns the saved update id and when it was handled.
+    """
+    with Session(engine) as session:
+        state = {
+            name: value for name, value in session.execute(
+                select(BotState.name, BotState.value).where(BotState.name.in_([_OFFSET_NAME, _OFFSET_HANDLED_AT_NAME])),
+            ).tuples()
+        }
+    return state.get(_OFFSET_NAME, 0), state.get(_OFFSET_HANDLED_AT_NAME, 0)
+
+
+def _save_offset() -> None:
+    if _last_update_id == 0:
+        return
+
+    table = Base.metadata.tables[BotState.__tablename__]
+    with Session(engine) as session:
+        for name, value in ((_OFFSET_NAME, _last_update_id), (_OFFSET_HANDLED_AT_NAME, int(_last_handled_at))):
+            _ = session.execute(
+                insert(table)
+                .values(name=name, value=value)
+                .on_conflict_do_update(index_elements=[table.c.name], set_={"value": value}),
+            )
+        session.commit()
+
+
+async def _save_offset_job(_context: ContextTypes.DEFAULT_TYPE) -> None:
+    _save_offset()
+
+
+async def _skip_handled(tele_update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _saved_update_id
+
+    if _saved_update_id == 0:
+        return
+    # redeliveries come first and in order, so a newer update means they are over
+    if tele_update.update_id > _saved_update_id or time.time() - _last_handled_at > OFFSET_MAX_AGE_HOURS * 3600:
+        _saved_update_id = 0
+        return
+    raise ApplicationHandlerStop
+
+
+async def _mark_handled(tele_update: Update, _context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _last_update_id, _last_handled_at
+    # not the max: updates are handled one at a time in order, and after a reset the ids start again lower
+    _last_update_id = tele_update.update_id
+    _last_handled_at = time.time()
+
+
+# --- Parking ---
+def park_queued_updates(application: ApplicationType) -> int:
+    """
+    Moves the updates still waiting in the application's queue into the PendingUpdate table.
+    """
+    parked: list[Update] = []
+    while True:
+        try:
+            item: object = application.update_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        application.update_queue.task_done()
+        if isinstance(item, Update):
+            parked.append(item)
+
+    if len(parked) > 0:
+        with Session(engine) as session:
+            _ = session.execute(
+                insert(Base.metadata.tables[PendingUpdate.__tablename__]).on_conflict_do_nothing(),
+                [{"update_id": tele_update.update_id, "data": tele_update.to_json()} for tele_update in parked],
+            )
+            session.commit()
+    return len(parked)
+
+
+def replay_parked_updates(application: ApplicationType) -> int:
+    """
+    Queues the updates parked by the previous run, oldest first, and removes them from the table.
+    """
+    with Session(engine) as session:
+        rows = session.execute(select(PendingUpdate.data).order_by(PendingUpdate.update_id)).scalars().all()
+        for data in rows:
+            tele_update = Update.de_json(json.loads(data), application.bot)
+            if tele_update is not None:
+                application.update_queue.put_nowait(tele_update)
+        _ = session.execute(delete(PendingUpdate))
+        session.commit()
+    return len(rows)
+
+
+# --- Running ---
+async def _drain(application: ApplicationType) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DRAIN_TIMEOUT_SECONDS
+    while application.update_queue.qsize() > 0 and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+
+
+async def run(application: ApplicationType) -> None:
+    global _saved_update_id, _last_update_id, _last_handled_at
+
+    _saved_update_id, _last_handled_at = _load_offset()
+    _last_update_id = _saved_update_id
+    application.add_handler(TypeHandler(Update, _skip_handled), group=-1)
+    application.add_handler(TypeHandler(Update, _mark_handled), group=1)
+    if application.job_queue is not None:
+        _ = application.job_queue.run_repeating(_save_offset_job, interval=OFFSET_SAVE_SECONDS, name="offset")
+
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_requested.set)
+
+    updater = application.updater
+    if updater is None:
+        raise RuntimeError("Application has no updater to poll with")
+
+    async with application:  # initialize and, on the way out, shutdown (which flushes the persistence)
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+
+        replayed = replay_parked_updates(application)
+        if replayed > 0:
+            logger.info("Replaying %d updates parked by the previous run", replayed)
+        _ = await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+        _ = await stop_requested.wait()
+        logger.info("Shutting down, draining fetched updates")
+
+        await updater.stop()
+        await _drain(application)
+        parked = park_queued_updates(application)
+        if parked > 0:
+            logger.warning("Parked %d updates that were not handled within %ss", parked, DRAIN_TIMEOUT_SECONDS)
+
+        await application.stop()
+        _save_offset()
+
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)
@@ -0,0 +1,266 @@
+"""
+Location tracks: ingestion, compact storage and spatial queries for the positions teams share during a game.
+
+Each team's track is append-only LocationPoint rows. Coordinates are quantized to 1e-5 degrees (about a metre) and
+every row except one keyframe per KEYFRAME_INTERVAL stores deltas from the previous point, so decoding a position
+never reads more than KEYFRAME_INTERVAL rows. Every row also carries the grid cell of its absolute position, indexed
+per game, so radius queries only decode the segments of cells that overlap the search area.
+
+Tracks are kept bounded in two stages: points that barely moved since the previous one are dropped on ingestion,
+and once a track outgrows MAX_TRACK_POINTS everything but its latest MAX_TRACK_POINTS / 2 points is thinned to one
+point per DOWNSAMPLE_SECONDS (or wider, until the track is back under three quarters of the limit).
+"""
+import math
+from dataclasses import dataclass
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from mappings import Base, LocationPoint
+
+COORD_SCALE = 100_000  # 1e-5 degrees
+KEYFRAME_INTERVAL = 32
+CELL_SIZE = 250  # in 1e-5 degrees, about 280 m of latitude
+MIN_MOVE_METERS = 15
+MIN_INTERVAL_SECONDS = 60
+MAX_TRACK_POINTS = 2_000
+DOWNSAMPLE_SECONDS = 120
+
+_EARTH_RADIUS_METERS = 6_371_000
+_METERS_PER_DEGREE = math.pi * _EARTH_RADIUS_METERS / 180
+
+
+@dataclass(frozen=True, slots=True)
+class TrackPoint:
+    t: int
+    lat_q: int
+    lon_q: int
+
+    @property
+    def lat(self) -> float:
+        return self.lat_q / COORD_SCALE
+
+    @property
+    def lon(self) -> float:
+        return self.lon_q / COORD_SCALE
+
+
+@dataclass(slots=True)
+class _TrackTail:
+    last: TrackPoint
+    since_keyframe: int  # points written after the last keyframe
+    length: int
+
+
+_table = Base.metadata.tables[LocationPoint.__tablename__]
+
+# (game id, team chat id) -> end of the stored track, only updated after a commit so it never runs ahead of the table
+_tails: dict[tuple[int, int], _TrackTail] = {}
+
+
+# --- Encoding ---
+def distance_meters(a: TrackPoint, b: TrackPoint) -> float:
+    lat_a, lat_b = math.radians(a.lat), math.radians(b.lat)
+    h = (
+        math.sin((lat_b - lat_a) / 2) ** 2
+        + math.cos(lat_a) * math.cos(lat_b) * math.sin(math.radians(b.lon - a.lon) / 2) ** 2
+    )
+    return 2 * _EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+
+
+def _cell(lat_q: int, lon_q: int) -> int:
+    return (lat_q // CELL_SIZE) * 1_000_000 + lon_q // CELL_SIZE
+
+
+def _encode(game_id: int, team_chat_id: int, point: TrackPoint, previous: TrackPoint | None,
+            keyframe: bool) -> dict[str, int | bool]:
+    if keyframe or previous is None:
+        t, lat, lon = point.t, point.lat_q, point.lon_q
+    else:
+        t, lat, lon = point.t - previous.t, point.lat_q - previous.lat_q, point.lon_q - previous.lon_q
+
+    return {
+        "game_id": game_id,
+        "team_chat_id": team_chat_id,
+        "keyframe": keyframe or previous is None,
+        "t": t,
+        "lat": lat,
+        "lon": lon,
+        "cell": _cell(point.lat_q, point.lon_q),
+    }
+
+
+def _decode(rows: list[tuple[bool, int, int, int]]) -> list[TrackPoint]:
+    points: list[TrackPoint] = []
+    for keyframe, t, lat, lon in rows:
+        if keyframe or len(points) == 0:
+            points.append(TrackPoint(t, lat, lon))
+        else:
+            previous = points[-1]
+            points.append(TrackPoint(previous.t + t, previous.lat_q + lat, previous.lon_q + lon))
+    return points
+
+
+def _track_rows(game_id: int, team_chat_id: int):
+    return (
+        select(LocationPoint.keyframe, LocationPoint.t, LocationPoint.lat, LocationPoint.lon)
+        .where(LocationPoint.game_id == game_id, LocationPoint.team_chat_id == team_chat_id)
+        .order_by(LocationPoint.point_id)
+    )
+
+
+def _load_tail(session: Session, game_id: int, team_chat_id: int) -> _TrackTail | None:
+    tail = _tails.get((game_id, team_chat_id))
+    if tail is not None:
+        return tail
+
+    track_filter = (LocationPoint.game_id == game_id, LocationPoint.team_chat_id == team_chat_id)
+    last_keyframe_id = session.scalar(
+        select(func.max(LocationPoint.point_id)).where(*track_filter, LocationPoint.keyframe),
+    )
+    if last_keyframe_id is None:
+        return None
+
+    segment = _decode(list(session.execute(
+        _track_rows(game_id, team_chat_id).where(LocationPoint.point_id >= last_keyframe_id),
+    ).tuples()))
+    length = session.scalar(select(func.count()).where(*track_filter)) or 0
+    tail = _TrackTail(segment[-1], len(segment) - 1, length)
+    _tails[(game_id, team_chat_id)] = tail
+    return tail
+
+
+# --- Ingestion ---
+def record_location(session: Session, game_id: int, team_chat_id: int, t: int, lat: float, lon: float) -> bool:
+    """
+    Appends a position to the team's track and commits. Returns False if it was dropped as too close to the previous
+    point.
+    """
+    point = TrackPoint(t, round(lat * COORD_SCALE), round(lon * COORD_SCALE))
+    tail = _load_tail(session, game_id, team_chat_id)
+    if tail is not None and (
+        point.t - tail.last.t < MIN_INTERVAL_SECONDS and distance_meters(tail.last, point) < MIN_MOVE_METERS
+    ):
+        return False
+
+    keyframe = tail is None or tail.since_keyframe + 1 >= KEYFRAME_INTERVAL
+    previous = tail.last if tail is not None else None
+    _ = session.execute(insert(_table), [_encode(game_id, team_chat_id, point, previous, keyframe)])
+
+    length = tail.length + 1 if tail is not None else 1
+    downsample = length > MAX_TRACK_POINTS
+    if downsample:
+        _downsample(session, game_id, team_chat_id)
+    session.commit()
+
+    if not downsample:
+        since_keyframe = 0 if tail is None or keyframe else tail.since_keyframe + 1
+        _tails[(game_id, team_chat_id)] = _TrackTail(point, since_keyframe, length)
+    return True
+
+
+def _downsample(session: Session, game_id: int, team_chat_id: int) -> None:
+    points = load_track(session, game_id, team_chat_id)
+    split = max(len(points) - MAX_TRACK_POINTS // 2, 0)
+    older, recent = points[:split], points[split:]
+
+    # widen the interval until the track has real headroom, so a sparse older half cannot cause a rewrite per insert
+    interval = DOWNSAMPLE_SECONDS
+    while True:
+        thinned: list[TrackPoint] = []
+        for point in older:
+            if len(thinned) == 0 or point.t - thinned[-1].t >= interval:
+                thinned.append(point)
+        if len(thinned) + len(recent) <= MAX_TRACK_POINTS * 3 // 4:
+            break
+        interval *= 2
+    thinned.extend(recent)
+
+    _ = session.execute(
+        delete(_table).where(_table.c.game_id == game_id, _table.c.team_chat_id == team_chat_id),
+    )
+    _ = session.execute(insert(_table), [
+        _encode(game_id, team_chat_id, point, thinned[i - 1] if i > 0 else None, i % KEYFRAME_INTERVAL == 0)
+        for i, point in enumerate(thinned)
+    ])
+    _ = _tails.pop((game_id, team_chat_id), None)
+
+
+def delete_tracks(session: Session, game_id: int) -> None:
+    _ = session.execute(delete(_table).where(_table.c.game_id == game_id))
+    for key in [key for key in _tails if key[0] == game_id]:
+        del _tails[key]
+
+
+# --- Queries ---
+def load_track(session: Session, game_id: int, team_chat_id: int) -> list[TrackPoint]:
+    """
+    Replays a team's whole track in order.
+    """
+    return _decode(list(session.execute(_track_rows(game_id, team_chat_id)).tuples()))
+
+
+def latest_point(session: Session, game_id: int, team_chat_id: int) -> TrackPoint | None:
+    tail = _load_tail(session, game_id, team_chat_id)
+    return tail.last if tail is not None else None
+
+
+def points_near(session: Session, game_id: int, center: TrackPoint, radius_meters: float,
+                since: int = 0) -> dict[int, list[TrackPoint]]:
+    """
+    Returns each team's points within radius_meters of center recorded at or after since, looking only at the grid
+    cells that overlap the search area and at the part of each track from since on.
+    """
+    lat_cells = math.ceil(radius_meters / _METERS_PER_DEGREE * COORD_SCALE / CELL_SIZE)
+    lon_cells = math.ceil(
+        radius_meters / (_METERS_PER_DEGREE * max(math.cos(math.radians(center.lat)), 0.01)) * COORD_SCALE / CELL_SIZE
+    )
+    center_row, center_column = center.lat_q // CELL_SIZE, center.lon_q // CELL_SIZE
+    cells = [
+        (center_row + row) * 1_000_000 + center_column + column
+        for row in range(-lat_cells, lat_cells + 1)
+        for column in range(-lon_cells, lon_cells + 1)
+    ]
+
+    # keyframes hold absolute times and a track's times only increase, so every point recorded at or after since
+    # comes after the track's last keyframe from before since
+    window_start = (
+        select(LocationPoint.team_chat_id, func.max(LocationPoint.point_id).label("point_id"))
+        .where(LocationPoint.game_id == game_id, LocationPoint.keyframe, LocationPoint.t < since)
+        .group_by(LocationPoint.team_chat_id)
+        .subquery()
+    )
+    candidates = session.execute(
+        select(LocationPoint.team_chat_id, func.min(LocationPoint.point_id), func.max(LocationPoint.point_id))
+        .outerjoin(window_start, window_start.c.team_chat_id == LocationPoint.team_chat_id)
+        .where(
+            LocationPoint.game_id == game_id,
+            LocationPoint.cell.in_(cells),
+            LocationPoint.point_id >= func.coalesce(window_start.c.point_id, 0),
+        )
+        .group_by(LocationPoint.team_chat_id),
+    ).tuples()
+
+    nearby: dict[int, list[TrackPoint]] = {}
+    for team_chat_id, first_id, last_id in candidates:
+        # decode from the keyframe the first candidate depends on up to the last candidate
+        segment_start = session.scalar(
+            select(func.max(LocationPoint.point_id)).where(
+                LocationPoint.game_id == game_id,
+                LocationPoint.team_chat_id == team_chat_id,
+                LocationPoint.keyframe,
+                LocationPoint.point_id <= first_id,
+            ),
+        )
+        points = _decode(list(session.execute(
+            _track_rows(game_id, team_chat_id).where(
+                LocationPoint.point_id >= segment_start, LocationPoint.point_id <= last_id,
+            ),
+        ).tuples()))
+        team_points = [
+            point for point in points if point.t >= since and distance_meters(center, point) <= radius_meters
+        ]
+        if len(team_points) > 0:
+            nearby[team_chat_id] = team_points
+
+    return nearby
@@ -0,0 +1,178 @@
+"""
+Structured logging: one JSON object per line on stdout, written from a background thread.
+
+Records go through a QueueHandler, so the event loop only pays for building the record and putting it on a queue; the
+QueueListener thread formats and writes them. The update being handled is attached to every record logged while
+handling it (update_id, chat_id and handler from graceful_fail, game_id once the chat's game is read), along with any
+of those fields passed in extra.
+
+Volume is bounded per category, the logger name: INFO and below are sampled at the category's rate from
+LOG_SAMPLE_RATES (e.g. "handler=0.05,dashboard=0"), and every category, warnings included, is capped at
+LOG_RATE_CAP records per second. The next record a category writes after dropping some reports how many it dropped.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "handler=0.1")
+LOG_RATE_CAP = int(os.getenv("LOG_RATE_CAP", "50"))
+
+# the structured fields a record may carry, in output order
+CONTEXT_FIELDS = ("update_id", "chat_id", "game_id", "handler", "latency_ms", "outcome")
+
+_log_context: ContextVar[dict[str, object] | None] = ContextVar("log_context", default=None)
+
+_listener: QueueListener | None = None
+
+
+# --- Context ---
+@contextmanager
+def log_context(**fields: object) -> Iterator[None]:
+    """
+    Attaches the given fields to every record logged in the enclosed block, on top of the fields already attached.
+    """
+    token = _log_context.set({**(_log_context.get() or {}), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def bind_log_context(**fields: object) -> None:
+    """
+    Adds fields to the innermost log_context block, for values only known partway through it, e.g. the game id.
+    """
+    context = _log_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+# --- Filtering ---
+def _parse_sample_rates(spec: str) -> dict[str, float]:
+    rates: dict[str, float] = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() != "":
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rates: dict[str, float], rate_cap: int):
+        super().__init__()
+        self.sample_rates: dict[str, float] = sample_rates
+        self.rate_cap: int = rate_cap
+        self._windows: dict[str, tuple[int, int]] = {}  # category -> (second, records passed in it)
+        self._dropped: dict[str, int] = {}
+
+    def _sample_rate(self, category: str) -> float:
+        # "handler" also covers "handler.x", the most specific configured name wins
+        while True:
+            if category in self.sample_rates:
+                return self.sample_rates[category]
+            if "." not in category:
+                return 1.0
+            category = category.rpartition(".")[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = record.name
+        if record.levelno <= logging.INFO and random.random() >= self._sample_rate(category):
+            return False  # sampled out by design, not counted as dropped
+
+        second = int(record.created)
+        window_second, passed = self._windows.get(category, (second, 0))
+        if window_second != second:
+            passed = 0
+        if passed >= self.rate_cap:
+            self._dropped[category] = self._dropped.get(category, 0) + 1
+            return False
+        self._windows[category] = (second, passed + 1)
+
+        dropped = self._dropped.pop(category, 0)
+        if dropped > 0:
+            record.dropped = dropped
+        return True
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the current log context onto the record. Runs in the thread that logs, before the record is queued.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in (_log_context.get() or {}).items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+# --- Formatting ---
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, object] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in (*CONTEXT_FIELDS, "dropped"):
+            value: object = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info is not None:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text is not None:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the stock prepare runs the full formatter here, on the event loop; only resolve what may not be safe to
+        # hand to another thread (the arguments and the traceback) and leave the JSON encoding to the listener
+        if record.exc_info is not None:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+# --- Setup ---
+def setup_logging() -> None:
+    """
+    Routes all logging through the queue to a JSON stdout writer. The listener is stopped, and the queue drained, at
+    interpreter exit.
+    """
+    global _listener
+
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(_parse_sample_rates(LOG_SAMPLE_RATES), LOG_RATE_CAP))
+    queue_handler.addFilter(ContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    # httpx logs every Bot API request and APScheduler every job run at INFO, which would drown out the bot's records
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    _ = atexit.register(_listener.stop)
@@ -1,5 +1,4 @@
 import asyncio
-import logging
 import os
 from typing import Any
 
@@ -7,13 +6,6 @@ from dotenv import load_dotenv
 from telegram import BotCommand
 from telegram.ext import ApplicationBuilder, AIORateLimiter, ContextTypes, ExtBot, Application, JobQueue
 
-from handlers import set_handlers
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.WARNING,
-)
-
 type ApplicationType = Application[ExtBot[int], ContextTypes.DEFAULT_TYPE, dict[Any, Any], dict[Any, Any], dict[Any, Any], JobQueue[ContextTypes.DEFAULT_TYPE]]  # pyright: ignore[reportExplicitAny]
 async def set_bot_commands(application: ApplicationType):
     commands = [
@@ -21,29 +13,69 @@ async def set_bot_commands(application: ApplicationType):
         BotCommand("help", "Lists all available commands"),
         BotCommand("rules", "Shows the game rules"),
         BotCommand("create_game", "Creates a new game and assigns this chat as the admin chat"),
-        BotCommand("create_team_1", "Assigns this chat as team 1's chat"),
-        BotCommand("create_team_2", "Assigns this chat as team 2's chat"),
-        BotCommand("create_team_3", "Assigns this chat as team 3's chat"),
+        BotCommand("create_team", "Assigns this chat as a team's chat"),
         BotCommand("create_location_chat", "Assigns this chat as the location chat"),
         BotCommand("current_task", "Shows the currently drawn tasks"),
         BotCommand("show_powerups", "Shows the currently drawn powerups"),
         BotCommand("complete_task", "Marks a drawn task as completed and draws new tasks/powerups"),
         BotCommand("use_powerup", "Initiates the use of a powerup"),
+        BotCommand("deck", "Shows how many tasks and powerups are left in your deck"),
+        BotCommand("leaderboard", "Shows the game standings, all-time standings or task completion rates"),
+        BotCommand("tournament", "Creates and runs tournaments, shows or exports their standings"),
         BotCommand("delete_game", "Deletes the game and unassigns all chats"),
-        BotCommand("delete_team_1", "Deletes team 1's chat assignment"),
-        BotCommand("delete_team_2", "Deletes team 2's chat assignment"),
-        BotCommand("delete_team_3", "Deletes team 3's chat assignment"),
+        BotCommand("delete_team", "Deletes a team's chat assignment"),
         BotCommand("delete_location_chat", "Deletes the location chat assignment"),
         BotCommand("start_game", "Starts the game for all teams"),
         BotCommand("end_game", "Ends the game for all teams"),
         BotCommand("catch", "Marks a catch as having occurred in the game"),
         BotCommand("restart_game", "Restarts the game after a catch has occurred"),
+        BotCommand("distance", "Shows how far each chasing team is from the runners"),
+        BotCommand("route", "Summarises a team's shared location track"),
+        BotCommand("stats", "Shows per-handler latency and throughput statistics"),
+        BotCommand("profile", "Profiles the next updates through the handlers"),
     ]
     _ = await application.bot.set_my_commands(commands)
 
-def main():
+
+async def post_init(application: ApplicationType) -> None:
+    from dashboard import start_dashboard
+
+    await set_bot_commands(application)
+    await start_dashboard()
+
+
+async def post_shutdown(_application: ApplicationType) -> None:
+    from dashboard import stop_dashboard
+
+    await stop_dashboard()
+
+
+def init() -> None:
+    """
+    Startup sequence, kept out of module imports so that importing db/utils/handlers has no side effects.
+    """
     _ = load_dotenv()
 
+    # imported here as DATA_DIR and the LOG_* settings from .env must be set before db and logs are first imported
+    from db import init_db
+    from logs import setup_logging
+    from utils import init_cards
+
+    setup_logging()
+    init_db()
+    init_cards()
+
+
+def main():
+    init()
+
+    from handlers import set_handlers
+    from lifecycle import run
+    from metrics import InstrumentedRequest
+    from persistence import SQLitePersistence
+    from archive import start_archiver
+    from scheduler import start_scheduler
+
     bot_token = os.getenv("BOT_TOKEN")
     if bot_token is None:
         raise RuntimeError("Bot token not defined in .env")
@@ -51,12 +83,19 @@ def main():
     application = (
         ApplicationBuilder()
         .token(bot_token)
+        .persistence(SQLitePersistence())
+        .request(InstrumentedRequest(connection_pool_size=256))
         .rate_limiter(AIORateLimiter(overall_max_rate=1, max_retries=1))
         .build()
     )
 
     set_handlers(application)
-    application.post_init = set_bot_commands
+    if application.job_queue is None:
+        raise RuntimeError("JobQueue is not available, install python-telegram-bot[job-queue]")
+    start_scheduler(application.job_queue)
+    start_archiver(application.job_queue)
+    application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
     # command_names = [
     #     "/start", "/help",
@@ -69,7 +108,7 @@ def main():
     # commands = [BotCommand(name, "") for name in command_names]
     # await application.bot.set_my_commands(commands)
     #
-    application.run_polling()
+    asyncio.run(run(application))
 
 if __name__ == '__main__':
     main()
@@ -1,6 +1,7 @@
+import time
 from enum import StrEnum, Enum, auto
 from typing import ClassVar, final
-from sqlalchemy import Constraint, ForeignKey, UniqueConstraint, and_, CheckConstraint
+from sqlalchemy import Constraint, ForeignKey, Index, UniqueConstraint, and_, CheckConstraint, text
 from sqlalchemy.orm import Mapped, MappedAsDataclass, DeclarativeBase, mapped_column, relationship
 
 
@@ -35,9 +36,12 @@ class Card(Base, kw_only=True):
     __tablename__: str = "Card"
 
     card_id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    deck: Mapped[str] = mapped_column(index=True)
     title: Mapped[str] = mapped_column()
     card_type: Mapped[CardType] = mapped_column(init=False)
     image_path: Mapped[str] = mapped_column()
+    image_hash: Mapped[str | None] = mapped_column(default=None)
+    variant_path: Mapped[str | None] = mapped_column(default=None)  # Telegram-optimized copy made by assets.py
 
     team_card_joins: Mapped[list[TeamCardJoin]] = relationship(
         back_populates="card",
@@ -51,11 +55,15 @@ class Card(Base, kw_only=True):
         "polymorphic_abstract": True
     }
 
+    @property
+    def send_image_path(self) -> str:
+        return self.variant_path or self.image_path
+
 
 @final
 class RuleCard(Card):
     # noinspection PyClassVar
-    __mapper_args__: ClassVar[dict[str, object]] = {
+    __mapper_args__: ClassVar[dict[str, object]] = {  # pyright: ignore[reportIncompatibleVariableOverride]
         "polymorphic_identity": CardType.RULE
     }
 
@@ -64,9 +72,11 @@ class RuleCard(Card):
 class TaskCard(Card):
     task_type: Mapped[TaskType] = mapped_column(nullable=True)
     task_special: Mapped[TaskSpecial] = mapped_column(nullable=True)
+    task_points: Mapped[int] = mapped_column(nullable=True)
+    task_all_or_nothing_points: Mapped[int] = mapped_column(nullable=True)
 
     # noinspection PyClassVar
-    __mapper_args__: ClassVar[dict[str, object]] = {
+    __mapper_args__: ClassVar[dict[str, object]] = {  # pyright: ignore[reportIncompatibleVariableOverride]
         "polymorphic_identity": CardType.TASK
     }
 
@@ -75,9 +85,10 @@ class TaskCard(Card):
 class PowerupCard(Card):
     powerup_special: Mapped[PowerupSpecial] = mapped_column(nullable=True)
     powerup_send_to_chasers: Mapped[bool] = mapped_column(nullable=True)
+    powerup_bonus_points: Mapped[int] = mapped_column(nullable=True)
 
     # noinspection PyClassVar
-    __mapper_args__: ClassVar[dict[str, object]] = {
+    __mapper_args__: ClassVar[dict[str, object]] = {  # pyright: ignore[reportIncompatibleVariableOverride]
         "polymorphic_identity": CardType.POWERUP
     }
 
@@ -85,9 +96,7 @@ class PowerupCard(Card):
 class ChatRole(StrEnum):
     ADMIN = "admin"
     LOCATION = "location"
-    TEAM_1 = "team_1"
-    TEAM_2 = "team_2"
-    TEAM_3 = "team_3"
+    TEAM = "team"
 
 
 @final
@@ -97,9 +106,11 @@ class GameChat(Base):
     chat_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
     game_id: Mapped[int] = mapped_column(ForeignKey("Game.game_id", ondelete="CASCADE"))
     role: Mapped[ChatRole] = mapped_column()
+    team_index: Mapped[int | None] = mapped_column(default=None)  # 1-based position in the running order, teams only
     callback_message_id: Mapped[int | None] = mapped_column(default=None)
 
     score: Mapped[int | None] = mapped_column(default=None)
+    version: Mapped[int] = mapped_column(init=False)  # optimistic concurrency, see graceful_fail
 
     game: Mapped[Game] = relationship(
         foreign_keys=[game_id],
@@ -110,16 +121,27 @@ class GameChat(Base):
         cascade="all, delete-orphan",
         init=False,
     )
+    deck_counts: Mapped[list[DeckCount]] = relationship(
+        cascade="all, delete-orphan",
+        init=False,
+    )
 
     def __post_init__(self) -> None:
-        if self.score is None and self.role in [ChatRole.TEAM_1, ChatRole.TEAM_2, ChatRole.TEAM_3]:
+        if self.score is None and self.role == ChatRole.TEAM:
             self.score = 0
 
-    __table_args__: tuple[Constraint, ...] = (
-        UniqueConstraint(game_id, role, name="unique_game_role"),
-        CheckConstraint("score IS NULL OR role IN ('TEAM_1', 'TEAM_2', 'TEAM_3')", name="score_only_for_team_chats"),
+    __table_args__: tuple[Constraint | Index, ...] = (
+        Index("unique_game_role", game_id, role, unique=True, sqlite_where=text("role != 'TEAM'")),
+        Index("unique_game_team_index", game_id, team_index, unique=True),
+        CheckConstraint("(role = 'TEAM') = (team_index IS NOT NULL)", name="team_index_only_for_team_chats"),
+        CheckConstraint("score IS NULL OR role = 'TEAM'", name="score_only_for_team_chats"),
     )
 
+    # noinspection PyClassVar
+    __mapper_args__: ClassVar[dict[str, object]] = {  # pyright: ignore[reportIncompatibleVariableOverride]
+        "version_id_col": version,
+    }
+
 
 class B1G1FStates(Enum):
     INACTIVE = auto()  # powerup not used
@@ -134,23 +156,34 @@ class Game(Base):
     __tablename__ = "Game"
 
     game_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    deck: Mapped[str] = mapped_column(default="default")
     is_started: Mapped[bool] = mapped_column(default=False)
     is_paused: Mapped[bool] = mapped_column(default=False)
 
     all_or_nothing: Mapped[bool] = mapped_column(default=False)
     B1G1F: Mapped[B1G1FStates] = mapped_column(default=B1G1FStates.INACTIVE)  # REFER TO PPT ^&@!^#&*@!^#&^!@*&#^#&*
+    B1G1F_bonus: Mapped[int] = mapped_column(default=0)  # bonus of the B1G1F card in play
 
     reveal_num_tasks: Mapped[int | None] = mapped_column(default=None)
     reveal_more: Mapped[bool | None] = mapped_column(default=None)
 
     running_team_chat_id: Mapped[int | None] = mapped_column(ForeignKey("Chat.chat_id"), default=None)
 
+    tournament_id: Mapped[int | None] = mapped_column(ForeignKey("Tournament.tournament_id"), default=None, index=True)
+    round: Mapped[int | None] = mapped_column(default=None)  # tournament games only
+
+    # unix timestamps, archive.py uses them to find finished and abandoned games
+    created_at: Mapped[float] = mapped_column(default_factory=time.time)
+    started_at: Mapped[float | None] = mapped_column(default=None)  # first start only
+    ended_at: Mapped[float | None] = mapped_column(default=None)  # cleared if the game is started again
+    version: Mapped[int] = mapped_column(init=False)  # optimistic concurrency, see graceful_fail
+
     admin_chat: Mapped[GameChat] = relationship(
         foreign_keys=[game_id],
         primaryjoin=and_(GameChat.game_id == game_id, GameChat.role == ChatRole.ADMIN),
         cascade="all, delete-orphan",
         single_parent=True,
-        overlaps="location_chat,team_1_chat,team_2_chat,team_3_chat",
+        overlaps="location_chat,team_chats",
         init=False,
         post_update=True,
     )
@@ -159,36 +192,17 @@ class Game(Base):
         primaryjoin=and_(GameChat.game_id == game_id, GameChat.role == ChatRole.LOCATION),
         cascade="all, delete-orphan",
         single_parent=True,
-        overlaps="admin_chat,team_1_chat,team_2_chat,team_3_chat",
-        init=False,
-        post_update=True,
-    )
-    team_1_chat: Mapped[GameChat | None] = relationship(
-        foreign_keys=[game_id],
-        primaryjoin=and_(GameChat.game_id == game_id, GameChat.role == ChatRole.TEAM_1),
-        cascade="all, delete-orphan",
-        single_parent=True,
-        overlaps="admin_chat,location_chat,team_2_chat,team_3_chat",
+        overlaps="admin_chat,team_chats",
         init=False,
         post_update=True,
     )
-    team_2_chat: Mapped[GameChat | None] = relationship(
-        foreign_keys=[game_id],
-        primaryjoin=and_(GameChat.game_id == game_id, GameChat.role == ChatRole.TEAM_2),
+    team_chats: Mapped[list[GameChat]] = relationship(
+        foreign_keys=[GameChat.game_id],
+        primaryjoin=and_(GameChat.game_id == game_id, GameChat.role == ChatRole.TEAM),
+        order_by=GameChat.team_index,
         cascade="all, delete-orphan",
-        single_parent=True,
-        overlaps="admin_chat,location_chat,team_1_chat,team_3_chat",
+        overlaps="admin_chat,location_chat,game",
         init=False,
-        post_update=True,
-    )
-    team_3_chat: Mapped[GameChat | None] = relationship(
-        foreign_keys=[game_id],
-        primaryjoin=and_(GameChat.game_id == game_id, GameChat.role == ChatRole.TEAM_3),
-        cascade="all, delete-orphan",
-        single_parent=True,
-        overlaps="admin_chat,location_chat,team_1_chat,team_2_chat",
-        init=False,
-        post_update=True,
     )
     running_team_chat: Mapped[GameChat | None] = relationship(
         foreign_keys=[running_team_chat_id],
@@ -200,6 +214,23 @@ class Game(Base):
         CheckConstraint("NOT is_started OR running_team_chat_id IS NOT NULL"),
     )
 
+    # noinspection PyClassVar
+    __mapper_args__: ClassVar[dict[str, object]] = {  # pyright: ignore[reportIncompatibleVariableOverride]
+        "version_id_col": version,
+    }
+
+
+# games grouped into numbered rounds, see tournaments.py
+@final
+class Tournament(Base):
+    __tablename__ = "Tournament"
+
+    tournament_id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    name: Mapped[str] = mapped_column()
+    admin_chat_id: Mapped[int] = mapped_column(index=True)  # the organisers' chat, not necessarily a game's chat
+    current_round: Mapped[int] = mapped_column(default=1)
+    created_at: Mapped[float] = mapped_column(default_factory=time.time)
+
 
 class CardState(StrEnum):
     UNDRAWN = "undrawn"
@@ -227,3 +258,147 @@ class TeamCardJoin(Base):
         UniqueConstraint(team_chat_id, card_id, name="unique_team_card"),
     )
 
+
+class DeckSlot(StrEnum):
+    NORMAL_TASK = "normal_task"
+    EXTREME_TASK = "extreme_task"
+    POWERUP = "powerup"
+
+
+# number of a team's cards per state and slot, kept in step with TeamCardJoin by decks.py
+@final
+class DeckCount(Base):
+    __tablename__ = "DeckCount"
+
+    team_chat_id: Mapped[int] = mapped_column(ForeignKey("Chat.chat_id", ondelete="CASCADE"), primary_key=True)
+    state: Mapped[CardState] = mapped_column(primary_key=True)
+    slot: Mapped[DeckSlot] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column()
+
+
+class TimerKind(StrEnum):
+    HEAD_START = "head_start"
+    LOCATION_REMINDER = "location_reminder"
+    KEYBOARD_EXPIRY = "keyboard_expiry"
+
+
+@final
+class Timer(Base):
+    __tablename__ = "Timer"
+
+    kind: Mapped[TimerKind] = mapped_column(primary_key=True)
+    chat_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)  # the chat the timer acts on
+    game_id: Mapped[int] = mapped_column(ForeignKey("Game.game_id", ondelete="CASCADE"))
+    due_at: Mapped[float] = mapped_column(index=True)  # unix timestamp
+    message_id: Mapped[int | None] = mapped_column(default=None)  # the keyboard to expire, keyboard expiry only
+
+
+# one point of a team's location track, see locations.py for the encoding
+@final
+class LocationPoint(Base):
+    __tablename__ = "LocationPoint"
+
+    point_id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    game_id: Mapped[int] = mapped_column(ForeignKey("Game.game_id", ondelete="CASCADE"))
+    team_chat_id: Mapped[int] = mapped_column(ForeignKey("Chat.chat_id", ondelete="CASCADE"))
+    keyframe: Mapped[bool] = mapped_column()
+    # absolute on keyframes, deltas from the previous point otherwise, so most rows store one or two byte integers
+    t: Mapped[int] = mapped_column()  # unix seconds
+    lat: Mapped[int] = mapped_column()  # 1e-5 degrees
+    lon: Mapped[int] = mapped_column()  # 1e-5 degrees
+    cell: Mapped[int] = mapped_column()  # grid cell of the absolute position
+
+    __table_args__: tuple[Index, ...] = (
+        Index("location_track", game_id, team_chat_id, point_id),
+        Index("location_cell", game_id, cell),
+    )
+
+
+class ScoreReason(StrEnum):
+    TASK = "task"
+    B1G1F_BONUS = "b1g1f_bonus"
+
+
+# append-only history of every score change, the aggregates below are kept in step with it by scoring.py
+@final
+class ScoreEvent(Base):
+    __tablename__ = "ScoreEvent"
+
+    event_id: Mapped[int] = mapped_column(primary_key=True, init=False)
+    game_id: Mapped[int] = mapped_column(ForeignKey("Game.game_id", ondelete="CASCADE"), index=True)
+    team_chat_id: Mapped[int] = mapped_column()  # not a foreign key, history outlives the chat's assignment
+    reason: Mapped[ScoreReason] = mapped_column()
+    points: Mapped[int] = mapped_column()
+    created_at: Mapped[float] = mapped_column()  # unix timestamp
+    card_id: Mapped[int | None] = mapped_column(default=None)
+
+
+@final
+class Standing(Base):
+    __tablename__ = "Standing"
+
+    chat_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    title: Mapped[str] = mapped_column()
+    points: Mapped[int] = mapped_column(index=True)
+    tasks_completed: Mapped[int] = mapped_column()
+    games_played: Mapped[int] = mapped_column()
+    last_game_id: Mapped[int] = mapped_column()
+
+
+@final
+class TaskStat(Base):
+    __tablename__ = "TaskStat"
+
+    card_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    drawn: Mapped[int] = mapped_column(default=0)
+    completed: Mapped[int] = mapped_column(default=0)
+
+
+# a team's points in one tournament round, kept in step with ScoreEvent by scoring.py; outlives the round's games
+@final
+class TournamentScore(Base):
+    __tablename__ = "TournamentScore"
+
+    tournament_id: Mapped[int] = mapped_column(ForeignKey("Tournament.tournament_id"), primary_key=True)
+    round: Mapped[int] = mapped_column(primary_key=True)
+    chat_id: Mapped[int] = mapped_column(primary_key=True)  # not a foreign key, like ScoreEvent.team_chat_id
+    game_id: Mapped[int] = mapped_column()
+    title: Mapped[str | None] = mapped_column(default=None)  # the chat's title, known once it scores
+    points: Mapped[int] = mapped_column(default=0)
+    tasks_completed: Mapped[int] = mapped_column(default=0)
+
+
+# idempotency keys of handled callback queries, see dedupe.py
+@final
+class ProcessedCallback(Base):
+    __tablename__ = "ProcessedCallback"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    created_at: Mapped[float] = mapped_column(index=True)  # unix timestamp
+
+
+# pickled python-telegram-bot context data, see persistence.py
+@final
+class ContextData(Base):
+    __tablename__ = "ContextData"
+
+    kind: Mapped[str] = mapped_column(primary_key=True)  # "bot", "chat", "user" or "conversation:<name>"
+    key: Mapped[str] = mapped_column(primary_key=True)
+    data: Mapped[bytes] = mapped_column()
+
+
+# updates fetched but not handled before a shutdown, replayed on the next start, see lifecycle.py
+@final
+class PendingUpdate(Base):
+    __tablename__ = "PendingUpdate"
+
+    update_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    data: Mapped[str] = mapped_column()  # the update's JSON
+
+
+@final
+class BotState(Base):
+    __tablename__ = "BotState"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[int] = mapped_column()
@@ -0,0 +1,189 @@
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Any
+
+from sqlalchemy import Engine, event
+from telegram.request import HTTPXRequest
+
+# --- Histograms ---
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS: tuple[float, ...] = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...]
+    counts: list[int] = field(init=False)
+    total: float = field(default=0.0, init=False)
+    count: int = field(default=0, init=False)
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name: str, labels: str) -> list[str]:
+        lines: list[str] = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+# --- Per-update timings ---
+class HandlerOutcome(StrEnum):
+    OK = "ok"
+    CHECK_FAILED = "check_failed"
+    ERROR = "error"
+
+
+@dataclass
+class UpdateTimings:
+    db_time: float = 0.0
+    api_time: float = 0.0
+    query_count: int = 0
+    # side effects so far, a handler that has any of them cannot simply be rerun (see utils.graceful_fail)
+    api_calls: int = 0
+    commits: int = 0
+    outcome: HandlerOutcome = HandlerOutcome.OK
+    wall_time: float = 0.0  # set once the handler returns
+
+
+_current_timings: ContextVar[UpdateTimings | None] = ContextVar("current_timings", default=None)
+
+
+@dataclass
+class HandlerMetrics:
+    wall_time: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    db_time: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    api_time: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    query_count: Histogram = field(default_factory=lambda: Histogram(QUERY_COUNT_BUCKETS))
+    outcomes: dict[HandlerOutcome, int] = field(default_factory=lambda: {outcome: 0 for outcome in HandlerOutcome})
+
+
+handler_metrics: dict[str, HandlerMetrics] = {}
+
+
+@contextmanager
+def track_handler(handler_name: str) -> Iterator[UpdateTimings]:
+    """
+    Records wall time, DB time, Telegram API time, query count and outcome of the enclosed handler call.
+    Nested calls (e.g. no_callback inside graceful_fail) are attributed to the outermost handler.
+    """
+    if _current_timings.get() is not None:
+        yield UpdateTimings()
+        return
+
+    timings = UpdateTimings()
+    token = _current_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    except BaseException:
+        timings.outcome = HandlerOutcome.ERROR
+        raise
+    finally:
+        timings.wall_time = time.perf_counter() - start
+        _current_timings.reset(token)
+
+        metrics = handler_metrics.setdefault(handler_name, HandlerMetrics())
+        metrics.wall_time.observe(timings.wall_time)
+        metrics.db_time.observe(timings.db_time)
+        metrics.api_time.observe(timings.api_time)
+        metrics.query_count.observe(timings.query_count)
+        metrics.outcomes[timings.outcome] += 1
+
+
+# --- DB instrumentation ---
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn: Any, *_: Any) -> None:  # pyright: ignore[reportExplicitAny, reportAny]
+    if _current_timings.get() is not None:
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())  # pyright: ignore[reportAny]
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn: Any, *_: Any) -> None:  # pyright: ignore[reportExplicitAny, reportAny]
+    timings = _current_timings.get()
+    start_times: list[float] | None = conn.info.get("query_start_times")  # pyright: ignore[reportAny]
+    if timings is None or not start_times:
+        return
+
+    timings.db_time += time.perf_counter() - start_times.pop()
+    timings.query_count += 1
+
+
+@event.listens_for(Engine, "commit")
+def _commit(_conn: Any) -> None:  # pyright: ignore[reportExplicitAny, reportAny]
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.commits += 1
+
+
+# --- Telegram API instrumentation ---
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, *args: Any, **kwargs: Any) -> tuple[int, bytes]:  # pyright: ignore[reportExplicitAny, reportAny]
+        start = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)  # pyright: ignore[reportAny]
+        finally:
+            timings = _current_timings.get()
+            if timings is not None:
+                timings.api_time += time.perf_counter() - start
+                timings.api_calls += 1
+
+
+# --- Exposition ---
+def render_prometheus() -> str:
+    handlers = sorted(handler_metrics.items())
+    lines: list[str] = []
+    for name, attribute in (
+        ("trainwreck_handler_seconds", "wall_time"),
+        ("trainwreck_handler_db_seconds", "db_time"),
+        ("trainwreck_handler_api_seconds", "api_time"),
+        ("trainwreck_handler_queries", "query_count"),
+    ):
+        lines.append(f"# TYPE {name} histogram")
+        for handler_name, metrics in handlers:
+            histogram: Histogram = getattr(metrics, attribute)
+            lines += histogram.render(name, f'handler="{handler_name}"')
+
+    lines.append("# TYPE trainwreck_handler_outcomes_total counter")
+    for handler_name, metrics in handlers:
+        for outcome, count in metrics.outcomes.items():
+            lines.append(f'trainwreck_handler_outcomes_total{{handler="{handler_name}",outcome="{outcome}"}} {count}')
+
+    return "\n".join(lines) + "\n"
+
+
+def render_summary() -> str:
+    if len(handler_metrics) == 0:
+        return "No handler calls recorded yet"
+
+    lines = ["handler: calls | avg wall / db / api (ms) | avg queries | ok / check failed / error"]
+    for handler_name, metrics in sorted(handler_metrics.items(), key=lambda item: -item[1].wall_time.total):
+        calls = metrics.wall_time.count
+        lines.append(
+            f"{handler_name}: {calls} | "
+            f"{1000 * metrics.wall_time.total / calls:.1f} / "
+            f"{1000 * metrics.db_time.total / calls:.1f} / "
+            f"{1000 * metrics.api_time.total / calls:.1f} | "
+            f"{metrics.query_count.total / calls:.1f} | "
+            f"{metrics.outcomes[HandlerOutcome.OK]} / "
+            f"{metrics.outcomes[HandlerOutcome.CHECK_FAILED]} / "
+            f"{metrics.outcomes[HandlerOutcome.ERROR]}",
+        )
+    return "\n".join(lines)
@@ -0,0 +1,159 @@
+"""
+python-telegram-bot persistence on the game database, so chat_data, user_data, bot_data and conversation states
+survive restarts.
+
+Each chat's, user's and conversation's data is one pickled ContextData row. Rows are loaded lazily: a chat's data is
+read the first time an update or job for that chat refreshes it, not all at once on startup. The application hands
+over changed data every update_interval seconds; those calls only stage the rows whose pickled contents actually
+changed, and everything staged in one round is written in a single transaction. Empty data is stored as no row at all,
+so the many chats that never keep anything cost nothing.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+from typing import Any
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import engine
+from mappings import Base, ContextData
+
+type Data = dict[Any, Any]  # pyright: ignore[reportExplicitAny]
+type ConversationKey = tuple[int | str, ...]
+type ConversationDict = dict[ConversationKey, object]
+
+UPDATE_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_INTERVAL_SECONDS", "60"))
+
+_table = Base.metadata.tables[ContextData.__tablename__]
+
+
+def _digest(blob: bytes | None) -> bytes | None:
+    return hashlib.blake2b(blob, digest_size=16).digest() if blob is not None else None
+
+
+class SQLitePersistence(BasePersistence[Data, Data, Data]):
+    def __init__(self, update_interval: float = UPDATE_INTERVAL_SECONDS):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._loaded: set[tuple[str, str]] = set()
+        self._digests: dict[tuple[str, str], bytes | None] = {}  # of the stored rows, to skip unchanged writes
+        self._pending: dict[tuple[str, str], bytes | None] = {}  # None deletes the row
+        self._write_task: asyncio.Task[None] | None = None
+
+    # --- Storage ---
+    def _load(self, kind: str, key: str) -> object | None:
+        self._loaded.add((kind, key))
+        with Session(engine) as session:
+            blob = session.scalar(select(ContextData.data).where(ContextData.kind == kind, ContextData.key == key))
+        self._digests[(kind, key)] = _digest(blob)
+        return pickle.loads(blob) if blob is not None else None
+
+    def _stage(self, kind: str, key: str, data: object | None) -> None:
+        empty = data is None or data == {}
+        blob = pickle.dumps(data, pickle.HIGHEST_PROTOCOL) if not empty else None
+        if self._digests.get((kind, key)) == _digest(blob) and (kind, key) not in self._pending:
+            return
+        self._pending[(kind, key)] = blob
+
+        # the application stages a whole round of changes back to back, write them together once it has
+        if self._write_task is None:
+            self._write_task = asyncio.get_running_loop().create_task(self._write_soon())
+
+    async def _write_soon(self) -> None:
+        await asyncio.sleep(0)
+        self._write_task = None
+        self._write_pending()
+
+    def _write_pending(self) -> None:
+        if len(self._pending) == 0:
+            return
+        pending, self._pending = self._pending, {}
+
+        with Session(engine) as session:
+            for (kind, key), blob in pending.items():
+                if blob is None:
+                    _ = session.execute(delete(_table).where(_table.c.kind == kind, _table.c.key == key))
+                else:
+                    _ = session.execute(
+                        insert(_table)
+                        .values(kind=kind, key=key, data=blob)
+                        .on_conflict_do_update(index_elements=[_table.c.kind, _table.c.key], set_={"data": blob}),
+                    )
+            session.commit()
+
+        for kind_key, blob in pending.items():
+            self._digests[kind_key] = _digest(blob)
+
+    # --- Loading ---
+    async def get_user_data(self) -> dict[int, Data]:
+        return {}  # loaded per user in refresh_user_data
+
+    async def get_chat_data(self) -> dict[int, Data]:
+        return {}  # loaded per chat in refresh_chat_data
+
+    async def get_bot_data(self) -> Data:
+        data = self._load("bot", "")
+        return data if isinstance(data, dict) else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        kind = f"conversation:{name}"
+        with Session(engine) as session:
+            rows = session.execute(select(ContextData.key, ContextData.data).where(ContextData.kind == kind)).tuples()
+            conversations: ConversationDict = {}
+            for key, blob in rows:
+                self._loaded.add((kind, key))
+                self._digests[(kind, key)] = _digest(blob)
+                conversations[tuple(json.loads(key))] = pickle.loads(blob)
+        return conversations
+
+    async def refresh_user_data(self, user_id: int, user_data: Data) -> None:
+        if ("user", str(user_id)) not in self._loaded:
+            data = self._load("user", str(user_id))
+            if isinstance(data, dict):
+                user_data.update(data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Data) -> None:
+        if ("chat", str(chat_id)) not in self._loaded:
+            data = self._load("chat", str(chat_id))
+            if isinstance(data, dict):
+                chat_data.update(data)
+
+    async def refresh_bot_data(self, bot_data: Data) -> None:
+        pass  # loaded once in get_bot_data, this process is its only writer
+
+    # --- Updating ---
+    async def update_user_data(self, user_id: int, data: Data) -> None:
+        self._stage("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: Data) -> None:
+        self._stage("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data: Data) -> None:
+        self._stage("bot", "", data)
+
+    async def update_callback_data(self, data: object) -> None:
+        pass  # callback data is not stored
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: object | None) -> None:
+        self._stage(f"conversation:{name}", json.dumps(key), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded.add(("user", str(user_id)))
+        self._stage("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded.add(("chat", str(chat_id)))
+        self._stage("chat", str(chat_id), None)
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            _ = self._write_task.cancel()
+            self._write_task = None
+        self._write_pending()
@@ -0,0 +1,165 @@
+"""
+On-demand cProfile of live handlers.
+
+An admin runs /profile <n> (or sets PROFILE_NEXT_UPDATES at startup) and the next n updates through graceful_fail are
+profiled. Python allows one profiler per thread and the handlers interleave on the event loop, so a single profiler
+runs from the first of those updates starting to the last one finishing, and everything the loop does in that window is
+in the profile, idle time included. The result is written in pstats format to DATA_DIR/profiles.
+
+The summary groups self time by where it was spent: SQLAlchemy's Python code, SQLite itself (including the queries'
+sorts), python-telegram-bot and its HTTP stack, the event loop waiting on sockets and timers (where the Telegram
+round trips end up, as awaiting is not time spent in the handler), and the bot's own code.
+
+Usage: python profiling.py [profile.prof] [--sort tottime|cumulative|calls] [--limit 25]
+"""
+import argparse
+import cProfile
+import logging
+import os
+import pstats
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from db import data_dir
+
+PROFILE_NEXT_UPDATES = int(os.getenv("PROFILE_NEXT_UPDATES", "0"))
+MAX_PROFILED_UPDATES = 1_000
+
+profiles_dir = data_dir / "profiles"
+
+logger = logging.getLogger(__name__)
+
+_remaining = PROFILE_NEXT_UPDATES  # updates still to be claimed for the current profile
+_active = 0  # claimed updates still running
+_profiled = 0
+_profiler: cProfile.Profile | None = None
+_started_at = 0.0
+last_profile_path: Path | None = None
+
+
+# --- Profiling ---
+def request_profile(num_updates: int) -> None:
+    global _remaining
+    _remaining = min(num_updates, MAX_PROFILED_UPDATES)
+
+
+def profile_status() -> tuple[int, Path | None]:
+    """
+    Returns the number of updates still to be profiled and the path of the last profile written.
+    """
+    return _remaining + _active, last_profile_path
+
+
+def _stop_and_dump() -> None:
+    global _profiler, _profiled, last_profile_path
+
+    if _profiler is None:
+        return
+    _profiler.disable()
+
+    profiles_dir.mkdir(parents=True, exist_ok=True)
+    path = profiles_dir / f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{_profiled}u.prof"
+    _profiler.dump_stats(path)
+    logger.info("Profiled %d updates over %.1f s into %s", _profiled, time.perf_counter() - _started_at, path)
+
+    _profiler = None
+    _profiled = 0
+    last_profile_path = path
+
+
+@contextmanager
+def profile_update() -> Iterator[None]:
+    """
+    Wraps one update in graceful_fail. A no-op unless a profile was requested.
+    """
+    global _remaining, _active, _profiled, _profiler, _started_at
+
+    if _remaining == 0:
+        yield
+        return
+
+    _remaining -= 1
+    _active += 1
+    _profiled += 1
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _started_at = time.perf_counter()
+        _profiler.enable()
+    try:
+        yield
+    finally:
+        _active -= 1
+        if _remaining == 0 and _active == 0:
+            _stop_and_dump()
+
+
+# --- Summary ---
+_LIBRARY_BUCKETS = (
+    ("/sqlalchemy/", "SQLAlchemy"),
+    ("/telegram/", "python-telegram-bot"),
+    ("/httpx/", "HTTP client"),
+    ("/httpcore/", "HTTP client"),
+    ("/h11/", "HTTP client"),
+    ("/anyio/", "HTTP client"),
+    ("/asyncio/", "event loop"),
+    ("/selectors.py", "event loop"),
+)
+
+
+def _bucket(filename: str, function_name: str) -> str:
+    if filename == "~":  # built-in functions
+        if "sqlite3" in function_name:
+            return "SQLite"
+        if "select." in function_name:
+            return "event loop waiting on I/O and timers"
+        return "built-ins"
+
+    path = filename.replace("\\", "/")
+    for marker, bucket in _LIBRARY_BUCKETS:
+        if marker in path:
+            return bucket
+    if "/site-packages/" in path:
+        return "other libraries"
+    if "/lib/python" in path:
+        return "standard library"
+    return "bot code"
+
+
+def summarize(path: Path, sort: str, limit: int) -> None:
+    stats = pstats.Stats(str(path))
+    entries: dict[tuple[str, int, str], tuple[int, int, float, float, object]] = stats.stats  # pyright: ignore[reportAttributeAccessIssue, reportUnknownMemberType]
+
+    buckets: defaultdict[str, float] = defaultdict(float)
+    for (filename, _, function_name), (_, _, self_time, _, _) in entries.items():
+        buckets[_bucket(filename, function_name)] += self_time
+    total = sum(buckets.values())
+
+    print(f"{path}: {total:.3f} s profiled")
+    for bucket, seconds in sorted(buckets.items(), key=lambda item: -item[1]):
+        print(f"  {bucket:<40}{seconds:9.3f} s {100 * seconds / total:6.1f} %")
+    print()
+
+    _ = stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("profile", type=Path, nargs="?", help="profile to summarize (latest in DATA_DIR by default)")
+    _ = parser.add_argument("--sort", choices=("tottime", "cumulative", "calls"), default="tottime")
+    _ = parser.add_argument("--limit", type=int, default=25, help="number of functions to list")
+    args = parser.parse_args()
+
+    path: Path | None = args.profile
+    if path is None:
+        path = max(profiles_dir.glob("*.prof"), key=lambda profile: profile.stat().st_mtime, default=None)
+        if path is None:
+            parser.error(f"no profiles in {profiles_dir}")
+
+    summarize(path, args.sort, args.limit)
+
+
+if __name__ == "__main__":
+    main()
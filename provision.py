@@ -0,0 +1,137 @@
+"""
+Offline bulk provisioning for events: creates every game of an event, with its admin, location and team chats and the
+teams' decks, in one transaction, instead of running /create_game, /create_team and /create_location_chat in each chat.
+
+The input lists chat ids and roles, grouped into games by a label of your choice. Teams run in the order they are
+listed. Either a CSV file with the columns game,role,chat_id and optionally deck (the deck of the game's first row is
+used):
+
+    game,role,chat_id,deck
+    A,admin,-1001,default
+    A,location,-1002,
+    A,team,-1003,
+    A,team,-1004,
+
+or a JSON list of games:
+
+    [{"game": "A", "admin": -1001, "location": -1002, "teams": [-1003, -1004], "deck": "default"}]
+
+The chats must not be assigned to a game already. Each label's new game id is printed. The bot can keep running
+meanwhile: the games are written in a single short transaction, and nothing else in the database is touched. The
+database must already have this checkout's schema and card catalog, so start the bot from the same checkout first. A
+running bot's dashboard only lists the new games once the bot changes them (e.g. /start_game) or restarts.
+
+Usage: python provision.py <games.csv|games.json> [--tournament <tournament id>]
+"""
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+from dotenv import load_dotenv
+
+from catalog import DEFAULT_DECK
+
+type GameInput = dict[str, Any]  # pyright: ignore[reportExplicitAny]
+
+
+def _games_from_csv(path: Path) -> list[GameInput]:
+    games: dict[str, GameInput] = {}
+    with path.open(encoding="utf-8", newline="") as file:
+        for line_number, row in enumerate(csv.DictReader(file), start=2):
+            label, role, chat_id = row["game"].strip(), row["role"].strip().lower(), int(row["chat_id"])
+            game = games.setdefault(label, {"game": label, "teams": [], "deck": (row.get("deck") or "").strip()})
+            if role == "team":
+                game["teams"].append(chat_id)
+            elif role in ("admin", "location") and role not in game:
+                game[role] = chat_id
+            else:
+                raise ValueError(f"{path}:{line_number}: unexpected {role} chat for game {label}")
+    return list(games.values())
+
+
+def _games_from_json(path: Path) -> list[GameInput]:
+    with path.open(encoding="utf-8") as file:
+        games: list[GameInput] = json.load(file)
+    return games
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("games", type=Path, help="CSV or JSON file of the games' chats")
+    _ = parser.add_argument("--tournament", type=int, help="add the games to this tournament's current round")
+    args = parser.parse_args()
+
+    path: Path = args.games
+    try:
+        inputs = _games_from_json(path) if path.suffix.lower() == ".json" else _games_from_csv(path)
+    except (OSError, KeyError, ValueError) as e:
+        parser.error(f"could not read {path}: {e}")
+
+    # only the bot's .env: its startup sequence rewrites the Card table and recreates the database on a schema change,
+    # neither of which may happen under a running bot
+    _ = load_dotenv()
+
+    from sqlalchemy import select, text
+    from sqlalchemy.orm import Session
+
+    from db import SCHEMA_VERSION, db_path, engine
+    from mappings import Card, Tournament
+    from provisioning import GameSpec, provision_games
+    from utils import CheckFailedError, get_card_index, init_card_index
+
+    if not db_path.is_file():
+        parser.error(f"no database at {db_path}, start the bot once first")
+    with engine.connect() as connection:
+        schema_version: int = connection.execute(text("PRAGMA user_version")).scalar_one()
+    if schema_version != SCHEMA_VERSION:
+        parser.error(
+            f"the database has schema version {schema_version} and this checkout {SCHEMA_VERSION}, "
+            "start the bot from this checkout first",
+        )
+
+    init_card_index()  # dealing the decks needs the catalog
+    with Session(engine) as session:
+        if set(session.scalars(select(Card.card_id))) != set(get_card_index().by_id):
+            parser.error("the database has another card catalog than this checkout, start the bot from it first")
+
+    started = time.perf_counter()
+    try:
+        specs = [
+            GameSpec(
+                admin_chat_id=int(game["admin"]),
+                location_chat_id=int(game["location"]) if game.get("location") is not None else None,
+                team_chat_ids=tuple(int(chat_id) for chat_id in game.get("teams", ())),
+                deck=game.get("deck") or DEFAULT_DECK,
+            )
+            for game in inputs
+        ]
+    except (KeyError, TypeError, ValueError) as e:
+        parser.error(f"invalid game in {path}, missing or malformed {e}")
+
+    with Session(engine) as session:
+        round_number: int | None = None
+        if args.tournament is not None:
+            tournament = session.get(Tournament, args.tournament)
+            if tournament is None:
+                parser.error(f"tournament {args.tournament} does not exist")
+            round_number = tournament.current_round
+
+        try:
+            game_ids = provision_games(session, specs, time.time(), args.tournament, round_number)
+        except CheckFailedError as e:
+            parser.error(str(e))
+        session.commit()
+
+    for game, game_id in zip(inputs, game_ids):
+        print(f"{game.get('game', '')}\t{game_id}")
+    print(
+        f"Provisioned {len(game_ids)} games with {sum(len(spec.team_chat_ids) for spec in specs)} teams "
+        f"in {time.perf_counter() - started:.2f} s",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Bulk game provisioning: sets up many games, each with its admin, location and team chats and the teams' decks, in one
+transaction.
+
+Game ids are drawn at random and checked with one query, and every table is filled with a single executemany insert,
+so provisioning K games costs the same handful of statements as provisioning one instead of an ORM add per card per
+team. The rows go through Core, so the games are marked for the dashboard explicitly. provision.py is the command line
+front end for events.
+"""
+import random
+from collections import Counter
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from catalog import DEFAULT_DECK
+from dashboard import mark_game_dirty
+from mappings import B1G1FStates, Base, ChatRole, Game, GameChat
+from utils import CheckFailedError, deal_team_decks, get_card_index
+
+GAME_ID_MIN = 100_000
+GAME_ID_MAX = 999_999
+SPARE_CANDIDATES = 8
+
+_GAME_IDS = range(GAME_ID_MIN, GAME_ID_MAX + 1)
+
+
+@dataclass(frozen=True)
+class GameSpec:
+    admin_chat_id: int
+    location_chat_id: int | None
+    team_chat_ids: tuple[int, ...]  # in running order
+    deck: str = DEFAULT_DECK
+
+    @property
+    def chat_ids(self) -> list[int]:
+        location = [self.location_chat_id] if self.location_chat_id is not None else []
+        return [self.admin_chat_id, *location, *self.team_chat_ids]
+
+
+def allocate_game_ids(session: Session, count: int) -> list[int]:
+    """
+    Draws count unused game ids, checking a batch of random candidates with one query. With far fewer games than ids
+    the first batch nearly always suffices, a few spare candidates cover the odd collision.
+    """
+    game_ids: list[int] = []
+    while len(game_ids) < count:
+        needed = count - len(game_ids)
+        candidates = set(random.sample(_GAME_IDS, needed + SPARE_CANDIDATES)) - set(game_ids)
+        taken = set(session.scalars(select(Game.game_id).where(Game.game_id.in_(candidates))))
+        game_ids += list(candidates - taken)[:needed]
+    return game_ids
+
+
+def _check_specs(session: Session, specs: Sequence[GameSpec]) -> None:
+    chat_ids = [chat_id for spec in specs for chat_id in spec.chat_ids]
+    repeated = sorted(chat_id for chat_id, count in Counter(chat_ids).items() if count > 1)
+    if len(repeated) > 0:
+        raise CheckFailedError(f"Chats given more than one role: {', '.join(map(str, repeated))}")
+
+    assigned = sorted(session.scalars(select(GameChat.chat_id).where(GameChat.chat_id.in_(chat_ids))))
+    if len(assigned) > 0:
+        raise CheckFailedError(f"Chats already assigned to a game: {', '.join(map(str, assigned))}")
+
+    unknown_decks = sorted({spec.deck for spec in specs} - set(get_card_index().ids_by_deck))
+    if len(unknown_decks) > 0:
+        raise CheckFailedError(f"Decks do not exist: {', '.join(unknown_decks)}")
+
+
+def provision_games(session: Session, specs: Sequence[GameSpec], now: float, tournament_id: int | None = None,
+                    round_number: int | None = None) -> list[int]:
+    """
+    Creates a game per spec, in the same order, and returns their ids. The caller commits.
+    """
+    _check_specs(session, specs)
+    game_ids = allocate_game_ids(session, len(specs))
+
+    _ = session.execute(insert(Base.metadata.tables[Game.__tablename__]), [
+        {
+            "game_id": game_id,
+            "deck": spec.deck,
+            "is_started": False,
+            "is_paused": False,
+            "all_or_nothing": False,
+            "B1G1F": B1G1FStates.INACTIVE,
+            "B1G1F_bonus": 0,
+            "tournament_id": tournament_id,
+            "round": round_number,
+            "created_at": now,
+            "version": 1,
+        }
+        for game_id, spec in zip(game_ids, specs)
+    ])
+
+    chat_rows: list[dict[str, object]] = []
+    for game_id, spec in zip(game_ids, specs):
+        roles: list[tuple[int, ChatRole, int | None]] = [(spec.admin_chat_id, ChatRole.ADMIN, None)]
+        if spec.location_chat_id is not None:
+            roles.append((spec.location_chat_id, ChatRole.LOCATION, None))
+        roles += [(chat_id, ChatRole.TEAM, index) for index, chat_id in enumerate(spec.team_chat_ids, start=1)]
+        chat_rows += [
+            {
+                "chat_id": chat_id,
+                "game_id": game_id,
+                "role": role,
+                "team_index": team_index,
+                "callback_message_id": None,
+                "score": 0 if role == ChatRole.TEAM else None,
+                "version": 1,
+            }
+            for chat_id, role, team_index in roles
+        ]
+    _ = session.execute(insert(Base.metadata.tables[GameChat.__tablename__]), chat_rows)
+
+    deal_team_decks(session, {chat_id: spec.deck for spec in specs for chat_id in spec.team_chat_ids})
+
+    for game_id in game_ids:
+        mark_game_dirty(session, game_id)
+    return game_ids
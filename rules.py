@@ -0,0 +1,73 @@
+"""
+Card rules: what each card does, as declared in the card catalog.
+
+A card's points are fields of its catalog entry, compiled into its CardRecord (see catalog.py). Its special names its
+effects: async functions run when the card is drawn, completed or used, which handlers.py supplies per trigger and
+special next to the flows they drive. compile_rules resolves them once at startup into a table keyed by trigger and
+card id, so running a card's effect is a dict lookup rather than a chain of checks on the special, and a new card only
+needs a catalog entry unless it brings a new kind of effect.
+"""
+from collections.abc import Callable, Coroutine, Mapping
+from enum import StrEnum
+from types import MappingProxyType
+
+from sqlalchemy.orm import Session
+from telegram.ext import ContextTypes
+
+from catalog import CardIndex, CardRecord
+from mappings import GameChat, PowerupSpecial, TaskSpecial
+
+# returns whether the caller carries on with its next step, False if the effect took over, e.g. to ask the team
+type CardEffect = Callable[[Session, GameChat, CardRecord, ContextTypes.DEFAULT_TYPE], Coroutine[None, None, bool]]
+type Special = TaskSpecial | PowerupSpecial
+
+
+class Trigger(StrEnum):
+    TASK_COMPLETED = "task_completed"  # after the task is scored, before the next draw
+    POWERUP_DRAWN = "powerup_drawn"  # after the powerup is shown, before the task is selected
+    POWERUP_USED = "powerup_used"  # after the powerup is announced
+
+
+_rule_table: MappingProxyType[tuple[Trigger, int], CardEffect] | None = None
+
+
+def _special(card: CardRecord) -> Special | None:
+    special = card.task_special or card.powerup_special
+    return None if special in (None, TaskSpecial.NONE, PowerupSpecial.NONE) else special
+
+
+def compile_rules(card_index: CardIndex, effects: Mapping[tuple[Trigger, Special], CardEffect]) -> None:
+    """
+    Builds the rule table from the catalog's cards and the effects of each trigger and special. Raises RuntimeError if
+    a card's special has no effects, so a catalog naming a special the bot cannot play fails at startup.
+    """
+    global _rule_table
+
+    specials = {special for _, special in effects}
+    table: dict[tuple[Trigger, int], CardEffect] = {}
+    for card in card_index.by_id.values():
+        special = _special(card)
+        if special is None:
+            continue
+        if special not in specials:
+            raise RuntimeError(f"Card {card.title!r} has the {special.value} special, which has no effects")
+        for trigger in Trigger:
+            effect = effects.get((trigger, special))
+            if effect is not None:
+                table[(trigger, card.card_id)] = effect
+
+    _rule_table = MappingProxyType(table)
+
+
+async def run_effect(trigger: Trigger, session: Session, chat: GameChat, card: CardRecord,
+                     context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    Runs the card's effect for the trigger, if it has one. Returns whether the caller should carry on.
+    """
+    if _rule_table is None:
+        raise RuntimeError("Card rules are not compiled, call compile_rules() first")
+
+    effect = _rule_table.get((trigger, card.card_id))
+    if effect is None:
+        return True
+    return await effect(session, chat, card, context)
@@ -0,0 +1,175 @@
+"""
+Timed game features: the chasers' head start, periodic location reminders for the running team and expiry of stale
+callback keyboards.
+
+Timers are rows in the Timer table, keyed by (kind, chat), so they survive restarts and rescheduling one just moves its
+due time. A single repeating JobQueue job drains whatever is due through the due_at index, instead of one job per
+game, and the earliest due time is cached in memory so idle ticks never touch the database.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections.abc import Coroutine
+
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, UOWTransaction
+from telegram.ext import ContextTypes, JobQueue
+
+from db import engine
+from mappings import Base, Game, GameChat, Timer, TimerKind
+
+HEAD_START_MINUTES = int(os.getenv("HEAD_START_MINUTES", "20"))
+LOCATION_REMINDER_MINUTES = int(os.getenv("LOCATION_REMINDER_MINUTES", "15"))
+KEYBOARD_TTL_MINUTES = int(os.getenv("KEYBOARD_TTL_MINUTES", "30"))
+
+TICK_SECONDS = 5
+BATCH_SIZE = 500
+
+CYCLE_TIMER_KINDS = (TimerKind.HEAD_START, TimerKind.LOCATION_REMINDER)
+
+logger = logging.getLogger(__name__)
+
+_next_due = 0.0  # earliest committed due time, 0 forces a look at the table on the next tick
+
+
+# --- Scheduling ---
+def schedule(session: Session, kind: TimerKind, game_id: int, chat_id: int, delay_seconds: float,
+             message_id: int | None = None) -> None:
+    """
+    Creates or moves the (kind, chat) timer in the session's transaction.
+    """
+    due_at = time.time() + delay_seconds
+    timer_table = Base.metadata.tables[Timer.__tablename__]
+    statement = insert(timer_table).values(
+        kind=kind, chat_id=chat_id, game_id=game_id, due_at=due_at, message_id=message_id,
+    )
+    # a plain connection execute, as this also runs inside flushes where the session must not autoflush
+    _ = session.connection().execute(statement.on_conflict_do_update(
+        index_elements=[timer_table.c.kind, timer_table.c.chat_id],
+        set_={"game_id": game_id, "due_at": due_at, "message_id": message_id},
+    ))
+    session.info.setdefault("timer_dues", []).append(due_at)
+
+
+def schedule_cycle_timers(session: Session, game_id: int, running_team_chat_id: int) -> None:
+    schedule(session, TimerKind.HEAD_START, game_id, running_team_chat_id, HEAD_START_MINUTES * 60)
+    schedule(session, TimerKind.LOCATION_REMINDER, game_id, running_team_chat_id, LOCATION_REMINDER_MINUTES * 60)
+
+
+def cancel_cycle_timers(session: Session, game_id: int) -> None:
+    _ = session.connection().execute(
+        delete(Base.metadata.tables[Timer.__tablename__]).where(
+            Timer.game_id == game_id, Timer.kind.in_(CYCLE_TIMER_KINDS),
+        ),
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _schedule_keyboard_expiry(session: Session, _flush_context: UOWTransaction, _instances: object) -> None:
+    # every place that sends a keyboard records it in callback_message_id, so watching the attribute covers them all
+    for obj in session.dirty:
+        if not isinstance(obj, GameChat):
+            continue
+        added = inspect(obj).attrs.callback_message_id.history.added
+        if len(added) > 0 and added[0] is not None:
+            schedule(
+                session, TimerKind.KEYBOARD_EXPIRY, obj.game_id, obj.chat_id, KEYBOARD_TTL_MINUTES * 60,
+                message_id=added[0],
+            )
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_scheduler(session: Session) -> None:
+    # only committed timers move the wake-up time, the tick reads the table and would not see uncommitted ones
+    global _next_due
+
+    dues: list[float] | None = session.info.pop("timer_dues", None)
+    if dues is not None:
+        _next_due = min(_next_due, *dues)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_scheduled(session: Session) -> None:
+    _ = session.info.pop("timer_dues", None)
+
+
+# --- Firing ---
+def _is_running_cycle(game: Game | None, chat_id: int) -> bool:
+    return game is not None and game.is_started and not game.is_paused and game.running_team_chat_id == chat_id
+
+
+def _fire(session: Session, context: ContextTypes.DEFAULT_TYPE, timer: Timer,
+          now: float) -> list[Coroutine[object, object, object]]:
+    """
+    Applies a due timer's database changes and returns the messages it sends. Timers whose cycle or keyboard is gone
+    are simply dropped.
+    """
+    bot = context.bot
+    game = session.get(Game, timer.game_id)
+
+    if timer.kind == TimerKind.HEAD_START:
+        session.delete(timer)
+        if game is None or not _is_running_cycle(game, timer.chat_id):
+            return []
+        return [
+            bot.send_message(
+                team_chat.chat_id,
+                "The head start is over, the chasers are now chasing!" if team_chat.chat_id == timer.chat_id else
+                "The head start is over, you may now start your chase!",
+            )
+            for team_chat in game.team_chats
+        ]
+
+    elif timer.kind == TimerKind.LOCATION_REMINDER:
+        if not _is_running_cycle(game, timer.chat_id):
+            session.delete(timer)
+            return []
+        timer.due_at = now + LOCATION_REMINDER_MINUTES * 60
+        return [bot.send_message(timer.chat_id, "Reminder: please send your location into the location chat")]
+
+    elif timer.kind == TimerKind.KEYBOARD_EXPIRY:
+        chat = session.get(GameChat, timer.chat_id)
+        if chat is None or chat.callback_message_id != timer.message_id:
+            session.delete(timer)
+            return []
+        # the running team still needs its keyboard to progress, only keyboards left over from past cycles are stale
+        if _is_running_cycle(game, chat.chat_id):
+            timer.due_at = now + KEYBOARD_TTL_MINUTES * 60
+            return []
+        session.delete(timer)
+        chat.callback_message_id = None
+        return [bot.edit_message_reply_markup(chat.chat_id, timer.message_id, reply_markup=None)]
+
+    raise RuntimeError(f"Unknown timer kind: {timer.kind}")
+
+
+async def _tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    global _next_due
+
+    now = time.time()
+    if now < _next_due:
+        return
+
+    with Session(engine) as session:
+        timers = session.scalars(
+            select(Timer).where(Timer.due_at <= now).order_by(Timer.due_at).limit(BATCH_SIZE),
+        ).all()
+
+        sends: list[Coroutine[object, object, object]] = []
+        for timer in timers:
+            sends.extend(_fire(session, context, timer, now))
+        session.commit()
+
+        # anything left over from a full batch is already due and gets picked up on the next tick
+        _next_due = session.scalar(select(func.min(Timer.due_at))) or math.inf
+
+    for result in await asyncio.gather(*sends, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.warning("Failed to send timer message: %s", result)
+
+
+def start_scheduler(job_queue: JobQueue[ContextTypes.DEFAULT_TYPE]) -> None:
+    _ = job_queue.run_repeating(_tick, interval=TICK_SECONDS, first=0, name="timers")
@@ -0,0 +1,158 @@
+"""
+Scoring: every score change is appended to ScoreEvent and applied to the aggregates in the same transaction, so
+leaderboards read a handful of pre-aggregated rows instead of scanning the history.
+
+Aggregates kept up to date:
+- GameChat.score: a team's total in its current game
+- Standing: all-time totals per chat across games
+- TournamentScore: per team and round totals of tournament games, see tournaments.py
+- TaskStat: how often each task card was drawn and completed
+"""
+import time
+from collections.abc import Sequence
+
+from sqlalchemy import case, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from catalog import CardRecord
+from mappings import Base, Game, GameChat, ScoreEvent, ScoreReason, Standing, TaskStat, TournamentScore
+
+
+def task_points(task: CardRecord, all_or_nothing: bool) -> int:
+    # the catalog compiles every task's points, defaults included, into its record
+    points = task.task_all_or_nothing_points if all_or_nothing else task.task_points
+    return points or 0
+
+
+# --- Recording ---
+def award_points(session: Session, team_chat: GameChat, title: str, points: int, reason: ScoreReason,
+                 card_id: int | None = None) -> None:
+    if team_chat.score is None:
+        raise RuntimeError("Team chat has no score")
+
+    team_chat.score += points
+    session.add(ScoreEvent(
+        game_id=team_chat.game_id,
+        team_chat_id=team_chat.chat_id,
+        reason=reason,
+        points=points,
+        created_at=time.time(),
+        card_id=card_id,
+    ))
+
+    standing = Base.metadata.tables[Standing.__tablename__]
+    completed = 1 if reason == ScoreReason.TASK else 0
+    _ = session.execute(
+        insert(standing)
+        .values(
+            chat_id=team_chat.chat_id,
+            title=title,
+            points=points,
+            tasks_completed=completed,
+            games_played=1,
+            last_game_id=team_chat.game_id,
+        )
+        .on_conflict_do_update(
+            index_elements=[standing.c.chat_id],
+            set_={
+                "title": title,
+                "points": standing.c.points + points,
+                "tasks_completed": standing.c.tasks_completed + completed,
+                "games_played": case(
+                    (standing.c.last_game_id != team_chat.game_id, standing.c.games_played + 1),
+                    else_=standing.c.games_played,
+                ),
+                "last_game_id": team_chat.game_id,
+            },
+        ),
+    )
+
+    game = team_chat.game
+    if game.tournament_id is not None and game.round is not None:
+        tournament_score = Base.metadata.tables[TournamentScore.__tablename__]
+        _ = session.execute(
+            insert(tournament_score)
+            .values(
+                tournament_id=game.tournament_id,
+                round=game.round,
+                chat_id=team_chat.chat_id,
+                game_id=game.game_id,
+                title=title,
+                points=points,
+                tasks_completed=completed,
+            )
+            .on_conflict_do_update(
+                index_elements=[tournament_score.c.tournament_id, tournament_score.c.round, tournament_score.c.chat_id],
+                set_={
+                    "title": title,
+                    "points": tournament_score.c.points + points,
+                    "tasks_completed": tournament_score.c.tasks_completed + completed,
+                },
+            ),
+        )
+
+
+def record_round_started(session: Session, game: Game) -> None:
+    """
+    Enters a tournament game's teams in the round's scores, so teams that never score still count as having played.
+    """
+    if game.tournament_id is None or game.round is None:
+        return
+
+    _ = session.execute(
+        insert(Base.metadata.tables[TournamentScore.__tablename__]).on_conflict_do_nothing(),
+        [
+            {"tournament_id": game.tournament_id, "round": game.round, "chat_id": team_chat.chat_id,
+             "game_id": game.game_id, "points": 0, "tasks_completed": 0}
+            for team_chat in game.team_chats
+        ],
+    )
+
+
+def award_task(session: Session, team_chat: GameChat, title: str, task: CardRecord) -> None:
+    points = task_points(task, team_chat.game.all_or_nothing)
+    award_points(session, team_chat, title, points, ScoreReason.TASK, task.card_id)
+    _bump_task_stat(session, task.card_id, completed=1)
+
+
+def record_task_drawn(session: Session, card_id: int) -> None:
+    _bump_task_stat(session, card_id, drawn=1)
+
+
+def _bump_task_stat(session: Session, card_id: int, drawn: int = 0, completed: int = 0) -> None:
+    task_stat = Base.metadata.tables[TaskStat.__tablename__]
+    _ = session.execute(
+        insert(task_stat)
+        .values(card_id=card_id, drawn=drawn, completed=completed)
+        .on_conflict_do_update(
+            index_elements=[task_stat.c.card_id],
+            set_={"drawn": task_stat.c.drawn + drawn, "completed": task_stat.c.completed + completed},
+        ),
+    )
+
+
+# --- Leaderboards ---
+def game_leaderboard(team_chats: Sequence[GameChat]) -> list[GameChat]:
+    return sorted(team_chats, key=lambda team_chat: (-(team_chat.score or 0), team_chat.team_index or 0))
+
+
+def all_time_leaderboard(session: Session, limit: int) -> Sequence[Standing]:
+    return session.scalars(
+        select(Standing).order_by(Standing.points.desc(), Standing.tasks_completed.desc()).limit(limit),
+    ).all()
+
+
+def task_completion_rates(session: Session, card_ids: frozenset[int]) -> list[tuple[int, int, int]]:
+    """
+    Returns (card id, times drawn, times completed) for the given cards that have been drawn at least once, highest
+    completion rate first.
+    """
+    rows = [
+        (card_id, drawn, completed)
+        for card_id, drawn, completed in session.execute(
+            select(TaskStat.card_id, TaskStat.drawn, TaskStat.completed).where(TaskStat.drawn > 0),
+        ).tuples()
+        if card_id in card_ids
+    ]
+    return sorted(rows, key=lambda row: (-row[2] / row[1], -row[1]))
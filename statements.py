@@ -0,0 +1,106 @@
+"""
+Pre-built statements for the queries that run on almost every update.
+
+Each statement is constructed once at import with bind parameters, so executing it skips building the Core construct
+and reuses its memoized cache key, going straight to the engine's compiled cache. Execute them with a parameter dict,
+e.g. ``session.scalars(CARD_IDS_BY_STATE, {"chat_id": chat_id, "state": CardState.SHOWN})``. Card queries only touch
+TeamCardJoin ids; card metadata is resolved from the in-memory CardIndex.
+
+The read path at the bottom serves the informational commands: Core queries on a bare connection returning plain
+rows, with no session, no identity map and no commit.
+"""
+from dataclasses import dataclass
+
+from sqlalchemy import Connection, bindparam, select, update
+from sqlalchemy.orm import Session, joinedload
+
+from logs import bind_log_context
+from mappings import CardState, ChatRole, Game, GameChat, TeamCardJoin
+
+# the game is needed by nearly every caller, so load it in the same round trip
+GAME_CHAT_BY_ID = (
+    select(GameChat)
+    .where(GameChat.chat_id == bindparam("chat_id"))
+    .options(joinedload(GameChat.game))
+)
+
+CARD_IDS_BY_STATE = (
+    select(TeamCardJoin.card_id)
+    .where(
+        TeamCardJoin.team_chat_id == bindparam("chat_id"),
+        TeamCardJoin.state == bindparam("state"),
+    )
+    .order_by(TeamCardJoin.id)
+)
+
+# moves the given cards from one state to another, returning the ids of the cards that were actually in from_state
+SET_CARD_STATES = (
+    update(TeamCardJoin)
+    .where(
+        TeamCardJoin.team_chat_id == bindparam("chat_id"),
+        TeamCardJoin.card_id.in_(bindparam("card_ids", expanding=True)),
+        TeamCardJoin.state == bindparam("from_state"),
+    )
+    .values(state=bindparam("to_state"))
+    .returning(TeamCardJoin.card_id)
+)
+
+CLEAR_SHOWN = (
+    update(TeamCardJoin)
+    .where(
+        TeamCardJoin.team_chat_id == bindparam("chat_id"),
+        TeamCardJoin.state == CardState.SHOWN,
+    )
+    .values(state=CardState.UNDRAWN)
+    .returning(TeamCardJoin.card_id)
+)
+
+
+def get_game_chat(session: Session, chat_id: int) -> GameChat | None:
+    """
+    Equivalent of session.get(GameChat, chat_id) that also loads the chat's game, using GAME_CHAT_BY_ID on a miss.
+    """
+    chat = session.identity_map.get(session.identity_key(GameChat, chat_id))  # pyright: ignore[reportUnknownMemberType]
+    if not isinstance(chat, GameChat):
+        chat = session.scalars(GAME_CHAT_BY_ID, {"chat_id": chat_id}).one_or_none()
+    if chat is not None:
+        bind_log_context(game_id=chat.game_id)
+    return chat
+
+
+# --- Read path ---
+@dataclass(frozen=True, slots=True)
+class ChatView:
+    chat_id: int
+    role: ChatRole
+    callback_message_id: int | None
+    deck: str
+    running_team_chat_id: int | None
+    game_id: int
+
+
+CHAT_VIEW_BY_ID = (
+    select(
+        GameChat.chat_id,
+        GameChat.role,
+        GameChat.callback_message_id,
+        Game.deck,
+        Game.running_team_chat_id,
+        GameChat.game_id,
+    )
+    .join(Game, GameChat.game_id == Game.game_id)
+    .where(GameChat.chat_id == bindparam("chat_id"))
+)
+
+
+def read_chat_view(connection: Connection, chat_id: int) -> ChatView | None:
+    row = connection.execute(CHAT_VIEW_BY_ID, {"chat_id": chat_id}).one_or_none()
+    if row is None:
+        return None
+    chat = ChatView(*row)
+    bind_log_context(game_id=chat.game_id)
+    return chat
+
+
+def read_card_ids(connection: Connection, chat_id: int, card_state: CardState) -> list[int]:
+    return list(connection.scalars(CARD_IDS_BY_STATE, {"chat_id": chat_id, "state": card_state}))
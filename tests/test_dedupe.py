@@ -0,0 +1,150 @@
+"""
+Duplicate callback queries are dropped before routing, see dedupe.py.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import UTC, datetime
+from enum import Enum, auto
+
+# db reads DATA_DIR on import, so point it at a scratch directory first
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="dedupe-test-")
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+import dedupe
+from db import engine, init_db
+from mappings import ChatRole, Game, GameChat, ProcessedCallback
+from utils import callback_dispatcher, callback_enum, card_callback_generator
+
+GAME_ID = 1
+CHAT_ID = -100
+KEYBOARD_MESSAGE_ID = 7
+
+
+@callback_enum
+class DedupeTestActions(Enum):
+    PRESS = auto()
+
+
+class _AnsweringBot:
+    def __init__(self):
+        self.answered: int = 0
+
+    async def answer_callback_query(self, *_args: object, **_kwargs: object) -> bool:
+        self.answered += 1
+        return True
+
+
+def _press(bot: _AnsweringBot, update_id: int, query_id: str) -> Update:
+    message = Message(KEYBOARD_MESSAGE_ID, datetime.now(UTC), Chat(CHAT_ID, Chat.GROUP))
+    query = CallbackQuery(
+        query_id, User(1, "Runner", False), "instance", message=message,
+        data=f"{card_callback_generator(DedupeTestActions.PRESS)}:1",
+    )
+    query.set_bot(bot)  # pyright: ignore[reportArgumentType]
+    return Update(update_id, callback_query=query)
+
+
+def _stored_keys() -> set[str]:
+    with Session(engine) as session:
+        return set(session.scalars(select(ProcessedCallback.key)))
+
+
+class DispatchCallbackTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def setUp(self):
+        with Session(engine) as session:
+            _ = session.execute(delete(ProcessedCallback))
+            _ = session.execute(delete(GameChat))
+            _ = session.execute(delete(Game))
+            session.add(Game(game_id=GAME_ID))
+            session.flush()
+            session.add(
+                GameChat(
+                    chat_id=CHAT_ID, game_id=GAME_ID, role=ChatRole.TEAM, team_index=1,
+                    callback_message_id=KEYBOARD_MESSAGE_ID,
+                ),
+            )
+            session.commit()
+        dedupe._recent_keys.clear()  # pyright: ignore[reportPrivateUsage]
+
+        self.bot: _AnsweringBot = _AnsweringBot()
+        self.runs: list[int] = []
+        self.consumes: bool = False  # whether the handler clears the keyboard like validate_callback_query
+        self.fails: bool = False
+
+        async def handler(tele_update: Update, _context: object) -> None:
+            self.runs.append(tele_update.update_id)
+            await asyncio.sleep(0)  # yield, so the concurrent deliveries interleave with the handler
+            if self.consumes:
+                with Session(engine) as session:
+                    _ = session.execute(
+                        update(GameChat).where(GameChat.chat_id == CHAT_ID).values(callback_message_id=None),
+                    )
+                    session.commit()
+            if self.fails:
+                raise RuntimeError("Handler failed")
+
+        self.dispatch = callback_dispatcher({DedupeTestActions.PRESS: handler})
+
+    async def test_concurrent_redeliveries_run_once(self):
+        update = _press(self.bot, 1, "1")
+        _ = await asyncio.gather(*(self.dispatch(update, None) for _ in range(5)))  # pyright: ignore[reportArgumentType]
+
+        self.assertEqual(self.runs, [1])
+        self.assertEqual(self.bot.answered, 4)
+        self.assertEqual(_stored_keys(), {"u1", "q1", f"m{CHAT_ID}:{KEYBOARD_MESSAGE_ID}"})
+
+    async def test_double_tap_runs_once(self):
+        first, second = _press(self.bot, 1, "1"), _press(self.bot, 2, "2")
+        _ = await asyncio.gather(self.dispatch(first, None), self.dispatch(second, None))  # pyright: ignore[reportArgumentType]
+
+        self.assertEqual(self.runs, [1])
+        self.assertEqual(self.bot.answered, 1)
+        self.assertEqual(_stored_keys(), {"u1", "q1", f"m{CHAT_ID}:{KEYBOARD_MESSAGE_ID}"})
+
+    async def test_redelivery_after_restart_is_dropped(self):
+        await self.dispatch(_press(self.bot, 1, "1"), None)  # pyright: ignore[reportArgumentType]
+        dedupe._recent_keys.clear()  # pyright: ignore[reportPrivateUsage]
+        await self.dispatch(_press(self.bot, 1, "1"), None)  # pyright: ignore[reportArgumentType]
+
+        self.assertEqual(self.runs, [1])
+        self.assertEqual(self.bot.answered, 1)
+
+    async def test_failed_press_can_be_pressed_again(self):
+        self.fails = True
+        with self.assertRaises(RuntimeError):
+            await self.dispatch(_press(self.bot, 1, "1"), None)  # pyright: ignore[reportArgumentType]
+
+        self.fails = False
+        await self.dispatch(_press(self.bot, 1, "1"), None)  # pyright: ignore[reportArgumentType]
+        await self.dispatch(_press(self.bot, 2, "2"), None)  # pyright: ignore[reportArgumentType]
+
+        self.assertEqual(self.runs, [1, 2])
+        self.assertEqual(self.bot.answered, 1)
+
+    async def test_failed_press_after_consuming_stays_claimed(self):
+        self.consumes = True
+        self.fails = True
+        with self.assertRaises(RuntimeError):
+            await self.dispatch(_press(self.bot, 1, "1"), None)  # pyright: ignore[reportArgumentType]
+
+        self.fails = False
+        await self.dispatch(_press(self.bot, 2, "2"), None)  # pyright: ignore[reportArgumentType]
+
+        self.assertEqual(self.runs, [1])
+        self.assertEqual(self.bot.answered, 1)
+        self.assertIn(f"m{CHAT_ID}:{KEYBOARD_MESSAGE_ID}", _stored_keys())
+
+
+if __name__ == "__main__":
+    _ = unittest.main()
@@ -0,0 +1,143 @@
+"""
+Tournaments: games grouped into numbered rounds, with standings summed across the rounds.
+
+The first round's games join one by one with /tournament add_game, or are set up in bulk by provisioning.py.
+next_round archives a finished round's games and provisions the next round in one transaction, with the same chats in
+the same roles, so running dozens of games a round takes one command per round.
+
+Scores are aggregated as they are awarded: scoring.py keeps a TournamentScore row per team and round, so standings
+are a sum over a few rows per team rather than a replay of ScoreEvent, and they survive the games being archived. A
+team is identified by its chat across rounds.
+"""
+import csv
+import io
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from archive import archive_finished_games
+from mappings import Game, Tournament, TournamentScore
+from provisioning import GameSpec, provision_games
+from statements import get_game_chat
+from utils import CheckFailedError
+
+
+@dataclass
+class TeamStanding:
+    chat_id: int
+    title: str
+    points: int = 0
+    tasks_completed: int = 0
+    round_points: dict[int, int] = field(default_factory=dict)  # round -> points
+
+
+# --- Tournaments ---
+def validate_tournament_id(session: Session, arg: str) -> Tournament:
+    tournament = session.get(Tournament, int(arg)) if arg.isdecimal() else None
+    if tournament is None:
+        raise CheckFailedError("Tournament not found, please check the tournament id and try again")
+    return tournament
+
+
+def ensure_tournament_admin(tournament: Tournament, chat_id: int) -> None:
+    if tournament.admin_chat_id != chat_id:
+        raise CheckFailedError("This chat is not the tournament's admin chat")
+
+
+def find_tournament(session: Session, chat_id: int) -> Tournament | None:
+    """
+    The tournament of the chat's game, or else the latest tournament the chat administers.
+    """
+    chat = get_game_chat(session, chat_id)
+    if chat is not None and chat.game.tournament_id is not None:
+        return session.get(Tournament, chat.game.tournament_id)
+    return session.scalars(
+        select(Tournament).where(Tournament.admin_chat_id == chat_id).order_by(Tournament.tournament_id.desc()),
+    ).first()
+
+
+def add_game(tournament: Tournament, game: Game) -> None:
+    if game.tournament_id is not None:
+        raise CheckFailedError(f"Game is already in round {game.round} of tournament {game.tournament_id}")
+    if game.started_at is not None:
+        raise CheckFailedError("Only games that have not been started yet can join a tournament")
+
+    game.tournament_id = tournament.tournament_id
+    game.round = tournament.current_round
+
+
+def next_round(session: Session, tournament: Tournament, now: float) -> Sequence[Game]:
+    """
+    Archives the current round's games, which must all have ended, and provisions the next round with the same chats.
+    Returns the new games. The caller commits.
+    """
+    games = session.scalars(
+        select(Game)
+        .where(Game.tournament_id == tournament.tournament_id, Game.round == tournament.current_round)
+        .order_by(Game.created_at),
+    ).all()
+    if len(games) == 0:
+        raise CheckFailedError(f"Round {tournament.current_round} has no games, add some with /tournament add_game")
+
+    unfinished = [str(game.game_id) for game in games if game.is_started or game.ended_at is None]
+    if len(unfinished) > 0:
+        raise CheckFailedError(f"These games have not ended yet: {', '.join(unfinished)}")
+
+    specs = [
+        GameSpec(
+            admin_chat_id=game.admin_chat.chat_id,
+            location_chat_id=game.location_chat.chat_id if game.location_chat is not None else None,
+            team_chat_ids=tuple(team_chat.chat_id for team_chat in game.team_chats),
+            deck=game.deck,
+        )
+        for game in games
+    ]
+    archive_finished_games(session, games, now)
+    session.expire_all()  # the purged games and chats are still in the session, and the chats come straight back
+
+    tournament.current_round += 1
+    game_ids = provision_games(session, specs, now, tournament.tournament_id, tournament.current_round)
+    return session.scalars(select(Game).where(Game.game_id.in_(game_ids))).all()
+
+
+# --- Standings ---
+def tournament_standings(session: Session, tournament_id: int) -> list[TeamStanding]:
+    standings: dict[int, TeamStanding] = {}
+    for score in session.scalars(
+        select(TournamentScore).where(TournamentScore.tournament_id == tournament_id).order_by(TournamentScore.round),
+    ):
+        standing = standings.setdefault(score.chat_id, TeamStanding(score.chat_id, f"Chat {score.chat_id}"))
+        if score.title is not None:
+            standing.title = score.title  # the latest title the chat scored under
+        standing.points += score.points
+        standing.tasks_completed += score.tasks_completed
+        standing.round_points[score.round] = score.points
+
+    return sorted(standings.values(), key=lambda standing: (-standing.points, -standing.tasks_completed))
+
+
+def export_standings(session: Session, tournament: Tournament) -> bytes:
+    """
+    The standings as CSV, with each team's points per round.
+    """
+    standings = tournament_standings(session, tournament.tournament_id)
+    rounds = range(1, tournament.current_round + 1)
+
+    file = io.StringIO()
+    writer = csv.writer(file)
+    _ = writer.writerow(
+        ["rank", "chat_id", "title", "points", "tasks_completed", "rounds_played", *(f"round_{n}" for n in rounds)],
+    )
+    for rank, standing in enumerate(standings, start=1):
+        _ = writer.writerow([
+            rank,
+            standing.chat_id,
+            standing.title,
+            standing.points,
+            standing.tasks_completed,
+            len(standing.round_points),
+            *(standing.round_points.get(n, "") for n in rounds),
+        ])
+    return file.getvalue().encode()
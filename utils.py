@@ -1,97 +1,93 @@
+import logging
+import random
 import re
-from collections.abc import Callable, Coroutine, Sequence
+import time
+from collections.abc import Callable, Collection, Coroutine, Iterable, Mapping, Sequence
 from dataclasses import dataclass
 from enum import Enum
-from functools import wraps
+from functools import cache, wraps
 from pathlib import Path
 
-from sqlalchemy import func, select, update
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import Connection, delete, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
+from catalog import CardIndex, CardRecord, load_index
+from dashboard import mark_chat_dirty
 from db import engine
-from mappings import B1G1FStates, Card, ChatRole, PowerupCard, TaskSpecial, TaskType, TaskCard, PowerupSpecial, \
-    RuleCard, GameChat, \
+from decks import EXTREME_TASK_SLOTS, POWERUP_SLOTS, TASK_SLOTS, count_cards, deal_decks, move_cards
+from dedupe import claim_callback, release_unconsumed_keyboard
+from logs import bind_log_context, log_context
+from metrics import HandlerOutcome, UpdateTimings, track_handler
+from profiling import profile_update
+from mappings import B1G1FStates, Base, Card, CardType, ChatRole, TaskType, GameChat, \
     Game, \
-    TeamCardJoin, CardState
+    CardState
+from statements import CARD_IDS_BY_STATE, CLEAR_SHOWN, SET_CARD_STATES, ChatView, get_game_chat, read_chat_view
 
-# --- Loading cards ---
-_POWERUP_DO_NOT_SEND_NAMES = ["All or Nothing", "Buy 1 Get 1 Free"]
-_TASK_NAME_TO_SPECIAL = {
-    "Pair O' Legs Error": TaskSpecial.FULLERTON,
-    "Let's Go Gambling!": TaskSpecial.MBS
-}
-_POWERUP_ID_TO_SPECIAL = {
-    "All or Nothing": PowerupSpecial.ALL_OR_NOTHING,
-    "Buy 1 Get 1 Free": PowerupSpecial.BUY_1_GET_1_FREE,
-}
 
-all_tasks = []
-all_powerups = []
-all_rules = []
+# --- Loading cards ---
+_card_index: CardIndex | None = None
 
 
 def _load_cards_into_db(root_path: Path) -> None:
-    with Session(engine) as session:
-        for rule_path in sorted((root_path / "rules").iterdir()):
-            if not rule_path.is_file():
-                continue
-
-            session.add(RuleCard(
-                title=rule_path.stem,
-                image_path=str(rule_path),
-            ))
-
-        for task_path in sorted((root_path / "tasks").iterdir()):
-            if not task_path.is_file():
-                continue
-
-            card_info = task_path.stem.split("_")
-            if card_info[1] == "N":
-                task_type = TaskType.NORMAL
-            elif card_info[1] == "E":
-                task_type = TaskType.EXTREME
-            else:
-                print(f"are you stupid {task_path} is wrong")
-                continue
-
-            session.add(TaskCard(
-                title=card_info[2],
-                image_path=str(task_path),
-                task_type=task_type,
-                task_special=_TASK_NAME_TO_SPECIAL.get(card_info[2], TaskSpecial.NONE),
-            ))
-
-        for powerup_path in sorted((root_path / "powerups").iterdir()):
-            if not powerup_path.is_file():
-                continue
-
-            card_info = powerup_path.stem.split("_")
-            send_to_chasers = card_info[2] not in _POWERUP_DO_NOT_SEND_NAMES
-
-            session.add(PowerupCard(
-                title=card_info[2],
-                image_path=str(powerup_path),
-                powerup_send_to_chasers=send_to_chasers,
-                powerup_special=_POWERUP_ID_TO_SPECIAL.get(card_info[2], PowerupSpecial.NONE),
-            ))
+    global _card_index
+
+    cards = load_index(root_path)
 
+    # card ids are stable across catalog recompiles, so replacing the rows keeps persisted games on the same cards
+    card_table = Base.metadata.tables[Card.__tablename__]
+    with Session(engine) as session:
+        _ = session.execute(delete(card_table))
+        _ = session.execute(insert(card_table), cards)
         session.commit()
 
+    _card_index = CardIndex.from_rows(cards)
+
 
-_load_cards_into_db(Path("cards"))
+def init_cards() -> None:
+    _load_cards_into_db(Path("cards"))
+
+
+def init_card_index() -> None:
+    """
+    Loads the card catalog for lookups only, leaving the Card table as the bot wrote it, for tools that run alongside
+    the bot.
+    """
+    global _card_index
+    _card_index = CardIndex.from_rows(load_index(Path("cards")))
+
+
+def get_card_index() -> CardIndex:
+    if _card_index is None:
+        raise RuntimeError("Cards are not loaded, call init_cards() first")
+    return _card_index
+
+
+def deal_team_decks(session: Session, team_decks: Mapping[int, str]) -> None:
+    """
+    Deals every given team chat id the task and powerup cards of its deck, see decks.deal_decks.
+    """
+    card_index = get_card_index()
+    records_by_deck = {
+        deck: card_index.records(sorted(card_index.ids_by_deck[deck] - card_index.ids(CardType.RULE)))
+        for deck in set(team_decks.values())
+    }
+    deal_decks(session, {chat_id: records_by_deck[deck] for chat_id, deck in team_decks.items()})
 
 
 # --- StartedGame convenience class ---
+MIN_TEAMS = 2
+
+
 @dataclass
 class StartedGame:
     game_id: int
     admin_chat: GameChat
     location_chat: GameChat
-    team_1_chat: GameChat
-    team_2_chat: GameChat
-    team_3_chat: GameChat
+    team_chats: list[GameChat]  # in running order
     running_team_chat: GameChat
 
     is_paused: bool
@@ -107,30 +103,67 @@ class CheckFailedError(Exception):
 type HandlerType[OutT] = Callable[[Update, ContextTypes.DEFAULT_TYPE], Coroutine[None, None, OutT]]
 
 
+MAX_CONFLICT_ATTEMPTS = 3
+
+# one record per handled update, sampled by LOG_SAMPLE_RATES (see logs.py) unless the handler failed
+handler_logger = logging.getLogger("handler")
+
+
 def graceful_fail[T](f: HandlerType[T]) -> HandlerType[T | None]:
     @wraps(f)
     async def wrapper(tele_update: Update, context: ContextTypes.DEFAULT_TYPE) -> T | None:
-        print(f"Running handler {f.__name__}")
+        chat_id = tele_update.effective_chat.id if tele_update.effective_chat is not None else None
+        with log_context(update_id=tele_update.update_id, chat_id=chat_id, handler=f.__name__), profile_update():
+            timings = UpdateTimings()
+            try:
+                with track_handler(f.__name__) as timings:
+                    return await _run_with_retries(f, tele_update, context, timings)
+            finally:
+                handler_logger.log(
+                    logging.WARNING if timings.outcome == HandlerOutcome.ERROR else logging.INFO,
+                    "Handled update",
+                    extra={"latency_ms": round(1000 * timings.wall_time, 1), "outcome": timings.outcome.value},
+                )
+
+    return wrapper
+
 
+async def _run_with_retries[T](f: HandlerType[T], tele_update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               timings: UpdateTimings) -> T | None:
+    attempts = 0
+    while True:
         try:
             return await f(tele_update, context)
         except CheckFailedError as e:
+            timings.outcome = HandlerOutcome.CHECK_FAILED
             _ = await context.bot.send_message(get_chat_id(tele_update), str(e))
+            return None
+        except StaleDataError:
+            # another update committed a change to the same Game/GameChat since this one read it, so this attempt's
+            # last transaction was rolled back. Rerunning is only safe while that transaction is all the attempt did:
+            # once it has committed or sent anything to Telegram, a rerun would repeat that
+            if timings.commits > 0 or timings.api_calls > 0:
+                timings.outcome = HandlerOutcome.CHECK_FAILED
+                handler_logger.warning("Not retrying after a concurrent update, the handler already took effect")
+                _ = await context.bot.send_message(
+                    get_chat_id(tele_update), "The game was changed by someone else at the same time, please try again",
+                )
+                return None
+
+            attempts += 1
+            if attempts >= MAX_CONFLICT_ATTEMPTS:
+                raise
+            handler_logger.warning("Retrying after a concurrent update, attempt %d", attempts + 1)
 
-    return wrapper
 
 def no_callback[T](f: HandlerType[T]) -> HandlerType[T | None]:
     @wraps(f)
     async def wrapper(tele_update: Update, context: ContextTypes.DEFAULT_TYPE) -> T | None:
-        with Session(engine) as session:
-            chat: GameChat | None = None
-            try:
-                chat = get_game_chat_or_raise(session, tele_update)
-            except CheckFailedError:
-                pass
+        with engine.connect() as connection:
+            chat = read_chat_view(connection, get_chat_id(tele_update))
 
-            if chat is not None and chat.callback_message_id is not None:
-                raise CheckFailedError("Finish or cancel the current callback operation first")
+        if chat is not None and chat.callback_message_id is not None:
+            raise CheckFailedError("Finish or cancel the current callback operation first")
         return await f(tele_update, context)
 
     return wrapper
@@ -143,27 +176,35 @@ def get_chat_id(tele_update: Update) -> int:
     return tele_update.effective_chat.id
 
 
+def get_chat_title(tele_update: Update) -> str:
+    if tele_update.effective_chat is None:
+        raise RuntimeError("Update has no effective chat")
+    return tele_update.effective_chat.title or f"Chat {tele_update.effective_chat.id}"
+
+
 def chat_not_assigned_check(session: Session, tele_update: Update) -> None:
-    chat: GameChat | None = session.get(GameChat, get_chat_id(tele_update))
+    chat: GameChat | None = get_game_chat(session, get_chat_id(tele_update))
     if chat is not None:
         raise CheckFailedError("Chat is already assigned to a role")
 
 
 def game_not_started_check(session: Session, tele_update: Update) -> None:
-    chat: GameChat | None = session.get(GameChat, get_chat_id(tele_update))
+    chat: GameChat | None = get_game_chat(session, get_chat_id(tele_update))
     if chat is not None and chat.game.is_started:
         raise CheckFailedError("Game is already started")
 
 
 def get_game_chat_or_raise(session: Session, tele_update: Update) -> GameChat:
-    chat: GameChat | None = session.get(GameChat, get_chat_id(tele_update))
+    chat: GameChat | None = get_game_chat(session, get_chat_id(tele_update))
     if chat is None:
         raise CheckFailedError("Chat is not assigned to any role")
     return chat
 
 
-def validate_game_id(session: Session, context: ContextTypes.DEFAULT_TYPE) -> Game:
-    if context.args is None or len(context.args) != 1 or (re.fullmatch(r"\d{6}", context.args[0]) is None):
+def validate_game_id(session: Session, context: ContextTypes.DEFAULT_TYPE, max_args: int = 1) -> Game:
+    if context.args is None or not 1 <= len(context.args) <= max_args or (
+        re.fullmatch(r"\d{6}", context.args[0]) is None
+    ):
         raise CheckFailedError("Please provide a valid game id")
 
     game_id = int(context.args[0])
@@ -171,9 +212,17 @@ def validate_game_id(session: Session, context: ContextTypes.DEFAULT_TYPE) -> Ga
     if game is None:
         raise CheckFailedError("Game not found, please check the game id and try again")
 
+    bind_log_context(game_id=game_id)
     return game
 
 
+def validate_team_number(arg: str) -> int:
+    if re.fullmatch(r"[1-9]\d*", arg) is None:
+        raise CheckFailedError("Please provide a valid team number")
+
+    return int(arg)
+
+
 def ensure_admin_chat(session: Session, tele_update: Update) -> GameChat:
     chat = get_game_chat_or_raise(session, tele_update)
     if chat.role != ChatRole.ADMIN:
@@ -182,14 +231,28 @@ def ensure_admin_chat(session: Session, tele_update: Update) -> GameChat:
     return chat
 
 
-def ensure_running_team_chat(session: Session, tele_update: Update) -> GameChat:
-    chat = get_game_chat_or_raise(session, tele_update)
-    if chat.role not in [ChatRole.TEAM_1, ChatRole.TEAM_2, ChatRole.TEAM_3]:
+def _running_team_check(chat_id: int, role: ChatRole, running_team_chat_id: int | None) -> None:
+    if role != ChatRole.TEAM:
         raise CheckFailedError("This chat is not a team chat")
 
-    if chat.game.running_team_chat_id != chat.chat_id:
+    if running_team_chat_id != chat_id:
         raise CheckFailedError("Your team is not currently running")
 
+
+def ensure_running_team_chat(session: Session, tele_update: Update) -> GameChat:
+    chat = get_game_chat_or_raise(session, tele_update)
+    _running_team_check(chat.chat_id, chat.role, chat.game.running_team_chat_id)
+    return chat
+
+
+def ensure_running_team_view(connection: Connection, tele_update: Update) -> ChatView:
+    """
+    Read-only counterpart of ensure_running_team_chat for handlers that do not modify the game.
+    """
+    chat = read_chat_view(connection, get_chat_id(tele_update))
+    if chat is None:
+        raise CheckFailedError("Chat is not assigned to any role")
+    _running_team_check(chat.chat_id, chat.role, chat.running_team_chat_id)
     return chat
 
 
@@ -198,18 +261,14 @@ def to_started_game(game: Game) -> StartedGame:
         raise CheckFailedError("Game is not started, please wait for your admin to start the game")
 
     assert game.location_chat is not None, "SQL trigger failed to ensure location chat exists for started game"
-    assert game.team_1_chat is not None, "SQL trigger failed to ensure team 1 chat exists for started game"
-    assert game.team_2_chat is not None, "SQL trigger failed to ensure team 2 chat exists for started game"
-    assert game.team_3_chat is not None, "SQL trigger failed to ensure team 3 chat exists for started game"
+    assert len(game.team_chats) >= MIN_TEAMS, "SQL trigger failed to ensure team chats exist for started game"
     assert game.running_team_chat is not None, "SQL trigger failed to ensure running team chat exists for started game"
 
     return StartedGame(
         game_id=game.game_id,
         admin_chat=game.admin_chat,
         location_chat=game.location_chat,
-        team_1_chat=game.team_1_chat,
-        team_2_chat=game.team_2_chat,
-        team_3_chat=game.team_3_chat,
+        team_chats=list(game.team_chats),
         running_team_chat=game.running_team_chat,
         is_paused=game.is_paused,
         all_or_nothing=game.all_or_nothing,
@@ -217,183 +276,203 @@ def to_started_game(game: Game) -> StartedGame:
     )
 
 
-def get_tasks(session: Session, chat_id: int, card_state: CardState) -> Sequence[TaskCard]:
-    return session.scalars(
-        select(TaskCard)
-        .join(TeamCardJoin, TaskCard.card_id == TeamCardJoin.card_id)
-        .where(
-            TeamCardJoin.state == card_state,
-            TeamCardJoin.team_chat_id == chat_id,
-        ),
-    ).all()
+def next_running_team_chat(started_game: StartedGame) -> GameChat:
+    team_chats = started_game.team_chats
+    running_position = team_chats.index(started_game.running_team_chat)
+    return team_chats[(running_position + 1) % len(team_chats)]
+
+
+def get_card_ids(session: Session, chat_id: int, card_state: CardState) -> list[int]:
+    return list(session.scalars(CARD_IDS_BY_STATE, {"chat_id": chat_id, "state": card_state}))
+
 
+def filter_cards(card_ids: Iterable[int], card_type: CardType) -> list[CardRecord]:
+    card_index = get_card_index()
+    type_ids = card_index.ids(card_type)
+    return card_index.records(card_id for card_id in card_ids if card_id in type_ids)
 
-def get_powerups(session: Session, chat_id: int, card_state: CardState) -> Sequence[PowerupCard]:
-    return session.scalars(
-        select(PowerupCard)
-        .join(TeamCardJoin, PowerupCard.card_id == TeamCardJoin.card_id)
-        .where(
-            TeamCardJoin.state == card_state,
-            TeamCardJoin.team_chat_id == chat_id,
-        ),
-    ).all()
+
+def get_tasks(session: Session, chat_id: int, card_state: CardState) -> list[CardRecord]:
+    return filter_cards(get_card_ids(session, chat_id, card_state), CardType.TASK)
+
+
+def get_powerups(session: Session, chat_id: int, card_state: CardState) -> list[CardRecord]:
+    return filter_cards(get_card_ids(session, chat_id, card_state), CardType.POWERUP)
+
+
+def set_card_states(session: Session, chat_id: int, card_ids: Collection[int], from_state: CardState,
+                    to_state: CardState) -> list[int]:
+    """
+    Moves the team's given cards from from_state to to_state and returns the ids of the cards that were moved.
+    """
+    mark_chat_dirty(session, chat_id)
+    moved_ids = list(session.scalars(
+        SET_CARD_STATES,
+        {"chat_id": chat_id, "card_ids": list(card_ids), "from_state": from_state, "to_state": to_state},
+    ))
+    move_cards(session, chat_id, get_card_index().records(moved_ids), from_state, to_state)
+    return moved_ids
 
 
 async def validate_callback_query(session: Session, tele_update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = tele_update.callback_query
     if query is None:
         raise RuntimeError("Update has no callback query")
-    _ = await query.answer()
     if query.data is None:
         raise RuntimeError("Callback query has no data")
 
-    chat = ensure_running_team_chat(session, tele_update)
-    if chat.callback_message_id is not None:
-        _ = await context.bot.delete_message(chat.chat_id, chat.callback_message_id)
-    chat.callback_message_id = None
+    try:
+        chat = ensure_running_team_chat(session, tele_update)
+    except CheckFailedError:
+        _ = await query.answer()
+        raise
 
+    # commit before anything is sent, so a conflict with a concurrent update here can still be retried
+    callback_message_id = chat.callback_message_id
+    chat.callback_message_id = None
     session.commit()
 
+    _ = await query.answer()
+    if callback_message_id is not None:
+        _ = await context.bot.delete_message(chat.chat_id, callback_message_id)
+
     return chat, query.data
 
 
-# --- Enum formatter ---
+# --- Callback data codec ---
+_CALLBACK_PREFIXES: dict[Enum, str] = {}
+
+
+def callback_enum[E: type[Enum]](enum_class: E) -> E:
+    """
+    Registers an Enum class for use in callback data, precomputing a compact prefix for every member in the format
+    "<class initials><member value>", e.g. CompleteTaskActions.SELECT_TASK -> "cta2".
+    """
+    class_code = "".join(c for c in enum_class.__name__ if c.isupper()).lower()
+    for member in enum_class:
+        prefix = f"{class_code}{member.value}"
+        if ":" in prefix or prefix in _CALLBACK_PREFIXES.values():
+            raise RuntimeError(f"Callback prefix {prefix} for {member} is ambiguous")
+        _CALLBACK_PREFIXES[member] = prefix
+
+    return enum_class
+
+
 def card_callback_generator(enum_value: Enum) -> str:
     """
-    Converts Enum value to a callback data string in the format "enum_class_name:member_name".
+    Returns the precomputed callback data prefix of an Enum value registered with callback_enum.
     """
-    enum_class_name = enum_value.__class__.__name__
-    class_name_snake = ''.join(['_' + c.lower() if c.isupper() else c for c in enum_class_name]).lstrip('_')
-    member_name_lower = enum_value.name.lower()
-    return f"{class_name_snake}:{member_name_lower}"
+    try:
+        return _CALLBACK_PREFIXES[enum_value]
+    except KeyError:
+        raise RuntimeError(f"{enum_value} is not registered as callback data") from None
 
 
-def card_callback_pattern(enum_value: Enum) -> str:
+def callback_dispatcher(routes: dict[Enum, HandlerType[object]]) -> HandlerType[None]:
     """
-    Converts Enum value to regex matching callback data provided by card_callback_generator.
+    Builds a single callback query handler that routes by a table lookup on the callback data prefix. Duplicate
+    deliveries and double taps are dropped before routing, and a keyboard whose handler failed before consuming it can
+    be pressed again, see dedupe.py.
     """
-    return f"^{card_callback_generator(enum_value)}"
+    prefix_routes = {card_callback_generator(enum_value): handler for enum_value, handler in routes.items()}
 
+    async def dispatch_callback(tele_update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = tele_update.callback_query
+        if query is None or query.data is None:
+            return
 
-# --- Drawing cards helper functions ---
-def generate_shown_tasks(session: Session, chat_id: int, num_cards: int, extremes_only: bool) -> list[TaskCard]:
-    query = (
-        select(TaskCard, TeamCardJoin)
-        .join(TeamCardJoin, TeamCardJoin.card_id == TaskCard.card_id)
-        .where(
-            TeamCardJoin.team_chat_id == chat_id,
-            TeamCardJoin.state == CardState.UNDRAWN,
-        )
-    )
-    if extremes_only:
-        query = (
-            query
-            .where(TaskCard.task_type == TaskType.EXTREME)
-        )
-    result = session.execute(
-        query.order_by(func.random()).limit(num_cards),
-    )
+        prefix, _, _ = query.data.partition(":")
+        handler = prefix_routes.get(prefix)
+        if handler is None:
+            _ = await query.answer("This button is no longer valid")
+            return
+
+        if not claim_callback(tele_update, time.time()):
+            _ = await query.answer()
+            return
 
-    shown_cards: list[TaskCard] = []
-    for row in result:
-        card, team_card_join = row.tuple()
-        team_card_join.state = CardState.SHOWN
-        shown_cards.append(card)
+        try:
+            _ = await handler(tele_update, context)
+        except Exception:
+            release_unconsumed_keyboard(tele_update)
+            raise
 
-    if len(shown_cards) < num_cards:
-        raise CheckFailedError("Not enough tasks left to show")
+    return dispatch_callback
 
-    session.commit()
 
-    return shown_cards
+# --- Drawing cards helper functions ---
+def count_undrawn_tasks(session: Session, chat_id: int, extremes_only: bool) -> int:
+    return count_cards(session, chat_id, CardState.UNDRAWN, EXTREME_TASK_SLOTS if extremes_only else TASK_SLOTS)
+
 
+def count_undrawn_powerups(session: Session, chat_id: int) -> int:
+    return count_cards(session, chat_id, CardState.UNDRAWN, POWERUP_SLOTS)
 
-def generate_shown_powerups(session: Session, chat_id: int, num_cards: int) -> list[PowerupCard]:
-    query = (
-        select(PowerupCard, TeamCardJoin)
-        .join(TeamCardJoin, TeamCardJoin.card_id == PowerupCard.card_id)
-        .where(
-            TeamCardJoin.team_chat_id == chat_id,
-            TeamCardJoin.state == CardState.UNDRAWN,
-        )
-    )
-    result = session.execute(
-        query.order_by(func.random()).limit(num_cards),
-    )
 
-    shown_cards: list[PowerupCard] = []
-    for row in result:
-        card, team_card_join = row.tuple()
-        team_card_join.state = CardState.SHOWN
-        shown_cards.append(card)
+def _show_random_cards(session: Session, chat_id: int, candidate_ids: frozenset[int], num_undrawn: int,
+                       num_cards: int, kind: str) -> list[CardRecord]:
+    # num_undrawn comes from the deck counters, so an empty deck is caught without loading the team's undrawn cards
+    if num_undrawn < num_cards:
+        raise CheckFailedError(f"Not enough {kind} left to show")
 
-    if len(shown_cards) < num_cards:
-        raise CheckFailedError("Not enough powerups left to show")
+    undrawn_ids = candidate_ids.intersection(get_card_ids(session, chat_id, CardState.UNDRAWN))
 
+    shown_ids = random.sample(sorted(undrawn_ids), num_cards)
+    _ = set_card_states(session, chat_id, shown_ids, CardState.UNDRAWN, CardState.SHOWN)
     session.commit()
 
-    return shown_cards
+    return get_card_index().records(shown_ids)
+
+
+def generate_shown_tasks(session: Session, chat_id: int, num_cards: int, extremes_only: bool) -> list[CardRecord]:
+    card_index = get_card_index()
+    candidate_ids = card_index.ids(CardType.TASK)
+    if extremes_only:
+        candidate_ids &= card_index.ids_by_task_type.get(TaskType.EXTREME, frozenset())
+
+    num_undrawn = count_undrawn_tasks(session, chat_id, extremes_only)
+    return _show_random_cards(session, chat_id, candidate_ids, num_undrawn, num_cards, "tasks")
+
+
+def generate_shown_powerups(session: Session, chat_id: int, num_cards: int) -> list[CardRecord]:
+    return _show_random_cards(
+        session, chat_id, get_card_index().ids(CardType.POWERUP), count_undrawn_powerups(session, chat_id), num_cards,
+        "powerups",
+    )
 
 
-def db_select_card(session: Session, chat: GameChat, card_id: int, clear_shown: bool) -> Card:
-    team_card_join = session.scalars(
-        select(TeamCardJoin)
-        .where(
-            TeamCardJoin.card_id == card_id,
-            TeamCardJoin.team_chat_id == chat.chat_id,
-            TeamCardJoin.state == CardState.SHOWN,
-        )
-        .options(joinedload(TeamCardJoin.card)),
-    ).one_or_none()
-    if team_card_join is None:
+def db_select_card(session: Session, chat: GameChat, card_id: int, clear_shown: bool) -> CardRecord:
+    if len(set_card_states(session, chat.chat_id, [card_id], CardState.SHOWN, CardState.DRAWN)) == 0:
         raise CheckFailedError("No card found with that ID")
-    team_card_join.state = CardState.DRAWN
 
     if clear_shown:
-        _ = session.execute(
-            update(TeamCardJoin)
-            .where(
-                TeamCardJoin.team_chat_id == chat.chat_id,
-                TeamCardJoin.state == CardState.SHOWN,
-            )
-            .values(state=CardState.UNDRAWN),
-        )
+        cleared_ids = session.scalars(CLEAR_SHOWN, {"chat_id": chat.chat_id}).all()
+        move_cards(session, chat.chat_id, get_card_index().records(cleared_ids), CardState.SHOWN, CardState.UNDRAWN)
+        mark_chat_dirty(session, chat.chat_id)
 
     session.commit()
 
-    return team_card_join.card
-
-
-def create_shown_task_selector(session: Session, chat_id: int, enum_value: Enum) -> InlineKeyboardMarkup:
-    shown_tasks = get_tasks(session, chat_id, CardState.SHOWN)
+    return get_card_index().by_id[card_id]
 
-    return InlineKeyboardMarkup.from_column(
-        [InlineKeyboardButton(
-            task.title,
-            callback_data=f"{card_callback_generator(enum_value)}:{task.card_id}",
-        ) for task in shown_tasks],
-    )
 
+@cache
+def _card_button(card_id: int, title: str, enum_value: Enum) -> InlineKeyboardButton:
+    return InlineKeyboardButton(title, callback_data=f"{card_callback_generator(enum_value)}:{card_id}")
 
-def create_shown_powerup_selector(session: Session, chat_id: int, enum_value: Enum) -> InlineKeyboardMarkup:
-    shown_powerups = get_powerups(session, chat_id, CardState.SHOWN)
 
+def create_card_selector(cards: Sequence[CardRecord], enum_value: Enum,
+                         extra_buttons: Sequence[InlineKeyboardButton] = ()) -> InlineKeyboardMarkup:
+    """
+    Builds a one-button-per-row keyboard from already loaded cards, reusing buttons per (card_id, action).
+    """
     return InlineKeyboardMarkup.from_column(
-        [InlineKeyboardButton(
-            powerup.title,
-            callback_data=f"{card_callback_generator(enum_value)}:{powerup.card_id}",
-        ) for powerup in shown_powerups],
+        [_card_button(card.card_id, card.title, enum_value) for card in cards] + list(extra_buttons),
     )
 
 
-def add_points(team_chat: GameChat, task: TaskCard):
-    if team_chat.score is None:
-        raise RuntimeError("Team chat has no score")
+def create_shown_task_selector(session: Session, chat_id: int, enum_value: Enum) -> InlineKeyboardMarkup:
+    return create_card_selector(get_tasks(session, chat_id, CardState.SHOWN), enum_value)
+
 
-    if task.task_type == TaskType.NORMAL:
-        team_chat.score += 2
-    elif task.task_type == TaskType.EXTREME:
-        if team_chat.game.all_or_nothing:
-            team_chat.score += 4
-        else:
-            team_chat.score += 3
+def create_shown_powerup_selector(session: Session, chat_id: int, enum_value: Enum) -> InlineKeyboardMarkup:
+    return create_card_selector(get_powerups(session, chat_id, CardState.SHOWN), enum_value)